@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 import click
 import importlib
 
@@ -89,25 +90,87 @@ def cli():
 @cli.command(context_settings=CONTEXT_SETTINGS)
 @click.option('--cache/--no-cache', default=True, help='Do not use Scrapy cache (i.e. "live" scrape)')
 @click.option('--resume/--no-resume', default=False, help='Resume a previously interrupted scrape')
+@click.option('--incremental', is_flag=True, default=False,
+              help='Revalidate the cached pages and only parse the pages which changed since the last scrape')
+@click.option('--replay', is_flag=True, default=False,
+              help='''Re-run the parsers over the cached pages only, at full speed (no network call).
+              With -j N, the parsing is split between N worker processes''')
+@click.option('--timing', is_flag=True, default=False,
+              help='Time the hot paths of the crawl (parsers, html parsing, lookups, graph lock, json writes)')
+@click.option('--worker', is_flag=True, default=False,
+              help='Run as a worker of a crawl shared by several processes (see FRONTIER_URL)')
+@click.option('--all', 'all_scrapers', is_flag=True, default=False,
+              help='Run every scraper (at the same time, see --jobs)')
+@click.option('-j', '--jobs', 'jobs', type=click.INT, default=None,
+              help='''Number of scrapers running at a time, when running several (default is all of them).
+              With --worker, the number of worker processes to start''')
+@click.option('--in-process', 'in_process', is_flag=True, default=False,
+              help='Run several scrapers in this process (on a single core) instead of a process each')
+@click.option('--concurrency', 'concurrency', type=click.INT,
+              default=None,
+              help='''Number of requests made at a time by all the running scrapers, when running several
+              (default is 32, or REPLAY_CONCURRENT_REQUESTS per scraper with --replay)''')
 @add_options(global_options)
-@click.argument('name')
-def scrape(cache, resume, name, **kwargs):
-    '''Run a Scrapy pipeline for crawling / parsing / dumping output'''
+@click.argument('names', nargs=-1)
+def scrape(cache, resume, incremental, replay, timing, worker, all_scrapers, jobs, in_process, concurrency, names, **kwargs):
+    '''Run a Scrapy pipeline for crawling / parsing / dumping output
 
-    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'scrapers', name)
-    _check_environment()
+    NAMES: the scraper(s) to run (e.g. nces or edgov.osers). Several scrapers run at the same time'''
 
     # Prepare conf dict
     conf = scrape_helpers.get_variables(scrape_config, str.isupper)
 
-    # Get the crawler & start the scrape
-    crawler = importlib.import_module(f'edscrapers.scrapers.{name}').Crawler
+    if all_scrapers:
+        from edscrapers.scrapers.base import runner
+        names = runner.scraper_names(conf['SCRAPY_SETTINGS']['SPIDER_MODULES'])
+    if not names:
+        raise click.UsageError('Provide the name of a scraper (or several, or --all)')
+    name = names[0] if len(names) == 1 else 'all'
+
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'scrapers', name)
+    _check_environment()
 
     if not cache:
         conf['SCRAPY_SETTINGS']['HTTPCACHE_ENABLED'] = False
     else:
         conf['SCRAPY_SETTINGS']['HTTPCACHE_ENABLED'] = True
 
+    if incremental:
+        # the cache keeps the pages (and their validators), but every page is revalidated
+        conf['SCRAPY_SETTINGS']['HTTPCACHE_ENABLED'] = True
+        conf['SCRAPY_SETTINGS']['HTTPCACHE_POLICY'] = 'edscrapers.scrapers.base.incremental.RevalidatingPolicy'
+        conf['SCRAPY_SETTINGS']['INCREMENTAL_ENABLED'] = True
+
+    if replay:
+        if not cache or incremental:
+            raise click.UsageError('--replay reads every page from the cache (no --no-cache or --incremental)')
+        if jobs and jobs > 1 and len(names) == 1:
+            # the parsing is split between worker processes
+            worker = True
+
+    if timing:
+        # the timings are recorded in the stats and in ED_OUTPUT_PATH/scrapy/timing
+        # (see scrapers/base/timing.py)
+        conf['SCRAPY_SETTINGS']['TIMING_ENABLED'] = True
+
+    if worker:
+        if len(names) > 1:
+            raise click.UsageError('--worker runs a single scraper')
+        # the workers share the requests and the seen-set of the crawl
+        conf['SCRAPY_SETTINGS']['FRONTIER_ENABLED'] = True
+        conf['SCRAPY_SETTINGS']['SCHEDULER'] = 'edscrapers.scrapers.base.frontier.FrontierScheduler'
+        conf['SCRAPY_SETTINGS']['DUPEFILTER_CLASS'] = 'edscrapers.scrapers.base.frontier.FrontierDupeFilter'
+
+    if replay:
+        # no download delay, no throttling and no network call (see scrapers/base/replay.py)
+        from edscrapers.scrapers.base import replay as scrape_replay
+        scrape_replay.replay_settings(conf['SCRAPY_SETTINGS'])
+
+    if concurrency is None:
+        concurrency = int(os.getenv('SCRAPE_CONCURRENCY', 32))
+        if replay:
+            concurrency = conf['SCRAPY_SETTINGS']['REPLAY_CONCURRENT_REQUESTS'] * (jobs or len(names))
+
     if kwargs['verbosity']:
         conf['SCRAPY_SETTINGS']['LOG_ENABLED'] = True
     else:
@@ -123,12 +186,139 @@ def scrape(cache, resume, name, **kwargs):
         conf['SCRAPY_SETTINGS']['JOBDIR'] = job_dir
         conf['SCRAPY_SETTINGS']['HTTPCACHE_DIR'] = cache_dir
 
+    if worker and jobs and jobs > 1:
+        # start the worker processes of the crawl, and merge their graphs once they are done
+        from edscrapers.scrapers.base import runner
+        run = runner.run_workers(name, conf['SCRAPY_SETTINGS'], jobs, concurrency=concurrency)
+        if run['failed']:
+            logger.error(f"Worker(s) {', '.join(run['failed'])} did not finish")
+            sys.exit(1)
+        logger.success('Scrape complete!')
+        return
+
+    if len(names) > 1:
+        # every scraper runs in a process of its own
+        from edscrapers.scrapers.base import runner
+        run = runner.run_scrapers(list(names), conf['SCRAPY_SETTINGS'], jobs=jobs,
+                                  concurrency=concurrency, resume=resume, in_process=in_process)
+        if run['failed']:
+            logger.error(f"Scraper(s) {', '.join(run['failed'])} did not finish")
+            sys.exit(1)
+        logger.success('Scrapes complete!')
+        return
+
+    # Get the crawler & start the scrape
+    crawler = importlib.import_module(f'edscrapers.scrapers.{name}').Crawler
 
     process = CrawlerProcess(conf['SCRAPY_SETTINGS'])
     process.crawl(crawler)
     process.start()
 
 
+@cli.command('merge-graphs', context_settings=CONTEXT_SETTINGS)
+@click.option('--keep', is_flag=True, default=False, help='Keep the worker graphs once merged')
+@click.argument('name')
+@add_options(global_options)
+def merge_graphs(keep, name, **kwargs):
+    ''' Merge the graphs of the workers of a crawl (see `eds scrape --worker`).
+
+    NAME: the scraper the workers ran (e.g. edgov)'''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'scrapers', f'{name}_merge')
+    _check_environment()
+    from edscrapers.scrapers.base import runner
+    conf = scrape_helpers.get_variables(scrape_config, str.isupper)
+    if runner.merge_graphs(name, conf['SCRAPY_SETTINGS'], keep=keep) is None:
+        sys.exit(1)
+    logger.success('Graphs merged!')
+
+
+def _cache_dir(cache_dir):
+    """ returns the http cache directory to work on (default is where `eds scrape --resume` puts it) """
+    return cache_dir or os.path.join(os.getenv('ED_OUTPUT_PATH'), 'scrapy', 'httpcache')
+
+
+@cli.group(context_settings=CONTEXT_SETTINGS)
+def cache():
+    ''' Report on, prune and import the Scrapy http cache (SQLite storage).'''
+    pass
+
+
+@cache.command('stats', context_settings=CONTEXT_SETTINGS)
+@click.option('-n', '--name', 'names', multiple=True,
+              help='Spider whose cache to report on (e.g. nces). Can be repeated. Defaults to every spider')
+@click.option('--cache-dir', 'cache_dir', type=click.Path(file_okay=False), default=None,
+              help='Http cache directory (default is ED_OUTPUT_PATH/scrapy/httpcache)')
+@click.option('--max-age', 'max_age', type=click.FLOAT, default=None,
+              help='Also count the entries older than this many days')
+@add_options(global_options)
+def cache_stats(names, cache_dir, max_age, **kwargs):
+    ''' Report the number of entries and the size of the cache of every spider.'''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'tools', 'cache')
+    _check_environment()
+    from edscrapers.scrapers.base import httpcache
+    stats = httpcache.cache_stats(_cache_dir(cache_dir), names,
+                                  max_age=max_age * 24 * 60 * 60 if max_age else None)
+    if not stats:
+        logger.warning(f'No SQLite http cache in {_cache_dir(cache_dir)}')
+        return
+    logger.info(f"  {'spider':<16} {'entries':>9} {'body MB':>9} {'stored MB':>10} {'file MB':>9} "
+                f"{'oldest':>19} {'newest':>19}{'  expired' if max_age else ''}")
+    for spider_stats in stats:
+        dates = [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(spider_stats[key]))
+                 if spider_stats[key] else '-' for key in ('oldest', 'newest')]
+        line = (f"  {spider_stats['spider']:<16} {spider_stats['entries']:>9} "
+                f"{spider_stats['body_bytes'] / 2**20:>9.1f} {spider_stats['stored_bytes'] / 2**20:>10.1f} "
+                f"{spider_stats['file_bytes'] / 2**20:>9.1f} {dates[0]:>19} {dates[1]:>19}")
+        if max_age:
+            line += f"{spider_stats['expired']:>9}"
+        logger.info(line)
+
+
+@cache.command('prune', context_settings=CONTEXT_SETTINGS)
+@click.option('-n', '--name', 'names', multiple=True,
+              help='Spider whose cache to prune (e.g. nces). Can be repeated. Defaults to every spider')
+@click.option('--cache-dir', 'cache_dir', type=click.Path(file_okay=False), default=None,
+              help='Http cache directory (default is ED_OUTPUT_PATH/scrapy/httpcache)')
+@click.option('--max-age', 'max_age', type=click.FLOAT, default=None,
+              help='Remove the entries older than this many days (default is HTTPCACHE_EXPIRATION_SECS, if set)')
+@click.option('--max-size', 'max_size', type=click.FLOAT, default=None,
+              help='Then remove the oldest entries until the cache of every spider holds at most this many MB')
+@add_options(global_options)
+def cache_prune(names, cache_dir, max_age, max_size, **kwargs):
+    ''' Remove the expired (or the oldest) entries of the cache and shrink the cache files.'''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'tools', 'cache')
+    _check_environment()
+    from edscrapers.scrapers.base import httpcache
+    max_age = max_age * 24 * 60 * 60 if max_age else scrape_config.SCRAPY_SETTINGS['HTTPCACHE_EXPIRATION_SECS']
+    if not max_age and not max_size:
+        raise click.UsageError('Provide --max-age and/or --max-size')
+    for pruned in httpcache.prune(_cache_dir(cache_dir), names, max_age=max_age or None,
+                                  max_size=max_size * 2**20 if max_size else None):
+        logger.info(f"{pruned['spider']}: removed {pruned['removed']} entries, "
+                    f"{pruned['file_bytes_before'] / 2**20:.1f}MB -> {pruned['file_bytes_after'] / 2**20:.1f}MB")
+    logger.success('Cache pruned!')
+
+
+@cache.command('import', context_settings=CONTEXT_SETTINGS)
+@click.option('-n', '--name', 'names', multiple=True,
+              help='Spider whose cache to import (e.g. nces). Can be repeated. Defaults to every spider')
+@click.option('--cache-dir', 'cache_dir', type=click.Path(file_okay=False), default=None,
+              help='Http cache directory (default is ED_OUTPUT_PATH/scrapy/httpcache)')
+@click.option('--remove', is_flag=True, default=False, help='Delete the filesystem cache once imported')
+@add_options(global_options)
+def cache_import(names, cache_dir, remove, **kwargs):
+    ''' Move a filesystem http cache (a directory per response) into the SQLite cache files.'''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'tools', 'cache')
+    _check_environment()
+    from edscrapers.scrapers.base import httpcache
+    imported = httpcache.import_filesystem_cache(_cache_dir(cache_dir), names,
+                                                 compression=scrape_config.SCRAPY_SETTINGS['HTTPCACHE_COMPRESSION'],
+                                                 remove=remove)
+    for spider_name, count in imported.items():
+        logger.info(f'{spider_name}: imported {count} responses')
+    logger.success('Cache imported!')
+
+
 @cli.command(context_settings=CONTEXT_SETTINGS)
 @click.option('-i', '--input', 'in_file_path', type=click.Path(exists=True), default=None,
               help=''' Input file, if used by requested transformer (e.g. datajson transformer
@@ -164,6 +354,77 @@ def stats(name, **kwargs):
     logger.success('Stats complete!')
 
 
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.option('-n', '--name', 'names', multiple=True,
+              help='''Scraper to check (e.g. nces or edgov.osers). Can be repeated.
+              Defaults to every scraper with saved pages in the corpus''')
+@click.option('-b', '--backend', 'backends', multiple=True,
+              type=click.Choice(['html5lib', 'lxml', 'parsel']),
+              help='Html parsing backend to compare against html5lib. Can be repeated. Defaults to all backends')
+@click.option('--corpus', 'corpus_dir', type=click.Path(exists=True, file_okay=False), default=None,
+              help='Directory of saved pages (default is ED_OUTPUT_PATH/tools/parity/corpus)')
+@click.option('--cache-dir', 'cache_dir', type=click.Path(exists=True, file_okay=False), default=None,
+              help='Read the saved pages from this Scrapy http cache directory instead of a corpus')
+@add_options(global_options)
+def parity(names, backends, corpus_dir, cache_dir, **kwargs):
+    ''' Compare the datasets parsed from saved pages with each html parsing backend.'''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'tools', 'parity')
+    _check_environment()
+    from edscrapers.tools.parity import parity as parity_tool
+    if not backends:
+        backends = ('html5lib', 'lxml', 'parsel')
+    mismatches = parity_tool.parity(names, backends, corpus_dir=corpus_dir, cache_dir=cache_dir)
+    if mismatches:
+        logger.error(f'{mismatches} page(s) parsed differently across backends')
+        sys.exit(1)
+    logger.success('Parity check complete!')
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.option('-c', '--count', 'count', type=click.INT, default=100000,
+              help='Number of generated links (or crawled pages) to benchmark with (default is 100000)')
+@click.option('--corpus', 'corpus_dir', type=click.Path(exists=True, file_okay=False), default=None,
+              help='''Benchmark with the links of the saved pages in this directory instead of generated ones.
+              For parsers, the corpus of saved pages (default is the corpus shipped with the package)''')
+@click.option('-n', '--name', 'scrapers', multiple=True,
+              help='Benchmark the parsers of this scraper, can be repeated (default is every scraper in the corpus)')
+@click.option('-b', '--backend', 'backends', multiple=True,
+              type=click.Choice(['html5lib', 'lxml', 'parsel'], case_sensitive=False),
+              help='Html parsing backend to benchmark the parsers with, can be repeated (default is all)')
+@click.option('-r', '--repeat', 'repeat', type=click.INT, default=5,
+              help='Number of timed rounds over the pages of a parser (default is 5)')
+@click.option('--compare', 'compare_to', default=None,
+              help='Compare with the run of this commit (or a report file, or "last")')
+@click.option('--max-regression', 'max_regression', type=click.FLOAT, default=None,
+              help='Fail if the pages/s of a parser drops by more than this percent from the compared run')
+@click.argument('name', type=click.Choice(['links', 'graph', 'parsers']))
+@add_options(global_options)
+def benchmark(count, corpus_dir, scrapers, backends, repeat, compare_to, max_regression, name, **kwargs):
+    ''' Run a micro-benchmark of the scraping kit.
+
+    NAME: the benchmark to run (links: link classification, graph: crawl graph updates,
+    parsers: the parsers against the saved pages of the benchmark corpus)'''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'tools', 'benchmark')
+    _check_environment()
+    if name == 'links':
+        from edscrapers.tools.benchmark import links
+        report = links.benchmark(count=count, corpus_dir=corpus_dir)
+        if report['disagreements']:
+            sys.exit(1)
+    elif name == 'graph':
+        from edscrapers.tools.benchmark import graph
+        graph.benchmark(pages=count)
+    elif name == 'parsers':
+        from edscrapers.tools.benchmark import parsers
+        _, regressions = parsers.benchmark(scrapers=scrapers, backends=backends, corpus_dir=corpus_dir,
+                                           repeat=repeat, compare_to=compare_to,
+                                           threshold=max_regression or parsers.DEFAULT_THRESHOLD)
+        if regressions and max_regression is not None:
+            logger.error(f"{len(regressions)} parser(s) regressed by more than {max_regression}%")
+            sys.exit(1)
+    logger.success('Benchmark complete!')
+
+
 @cli.command(context_settings=CONTEXT_SETTINGS)
 @click.option('-d', 'detached', is_flag=True, default=False, help='Run the server in a detached process')
 @click.option('--debug', 'debug', is_flag=True, default=False, help='Flag for turning debug mode on')
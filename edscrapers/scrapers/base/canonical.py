@@ -0,0 +1,311 @@
+""" module provides the canonical form of the urls crawled by the scrapers, so
+equivalent urls (e.g. 'http://www2.ed.gov/a?referrer=b' and 'https://ed.gov/a')
+are scheduled (and fetched, parsed and probed) only once, instead of being
+deduplicated after the crawl.
+
+The CANONICAL_URL setting (see scrapers/base/config.py) holds the rules of the
+canonical form:
+- 'strip_query_params': the names of the query parameters removed from the
+  urls (e.g. ['referrer']). ['*'] removes the whole query
+- 'strip_patterns': regular expressions removed from the urls
+  (e.g. the session tokens of rems.ed.gov)
+- 'deny_patterns': regular expressions of the urls which are never crawled
+  (e.g. the '/print/' version of the pages)
+- 'equivalent_schemes': 'http://' and 'https://' urls are the same page
+- 'strip_www': 'www.' and 'www2.' hosts are the same as their domain
+- 'lowercase': urls which only differ by case are the same page
+
+A crawler class can override the rules with a 'canonical_url' attribute of the
+same form. Its entries replace the entries of the setting.
+
+The rules are applied at request time:
+- the `CanonicalUrlMiddleware` strips the urls of the requests the spiders
+  follow, and drops the denied ones. Crawlers can also use
+  `Canonicalizer.process_value()` as the 'process_value' of their link extractors
+- the `CanonicalDupeFilter` fingerprints the requests by their canonical
+  url (see `Canonicalizer.key()`), so equivalent urls are filtered as duplicates.
+  The requests filtered because of the canonical form (i.e. which scrapy would
+  have scheduled) are recorded in the scrapy stats as 'canonical/saved' """
+
+import re
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from scrapy import Request, signals
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.python import to_bytes
+from w3lib.url import canonicalize_url
+
+# the default rules, used where neither the CANONICAL_URL setting nor the crawler sets them
+DEFAULT_RULES = {
+    'strip_query_params': ['referrer'],
+    'strip_patterns': [],
+    'deny_patterns': [r'/print/'],
+    'equivalent_schemes': True,
+    'strip_www': True,
+    'lowercase': False,
+}
+
+# meta key holding the url of a request before it was stripped
+ORIGINAL_URL_KEY = 'canonical_original_url'
+
+WWW_REGEX = re.compile(r'^www\d*\.')
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+
+def _setting(settings, name, default=None):
+    """ returns the setting 'name' of 'settings' (scrapy settings or a dict) """
+
+    if settings is None:
+        from edscrapers.scrapers.base import config
+        settings = config.SCRAPY_SETTINGS
+    if hasattr(settings, 'getdict') and isinstance(default, dict):
+        return settings.getdict(name, default)
+    return settings.get(name, default)
+
+
+def spider_rules(spider, settings=None):
+    """ function returns the canonical url rules of 'spider' (a spider or a
+    crawler class): the CANONICAL_URL setting, with the 'canonical_url'
+    attribute of the spider merged over it.
+
+    PARAMETERS:
+    - spider: the spider or crawler class. None for the rules of the setting
+
+    - settings: the scrapy settings (or a dict of settings).
+    default is the SCRAPY_SETTINGS of scrapers/base/config.py """
+
+    rules = dict(DEFAULT_RULES)
+    rules.update(_setting(settings, 'CANONICAL_URL', dict()) or dict())
+    rules.update(getattr(spider, 'canonical_url', None) or dict())
+    unknown = set(rules) - set(DEFAULT_RULES)
+    if unknown:
+        raise ValueError(f'unknown canonical url rule(s) {sorted(unknown)}. '
+                         f'Expected some of {list(DEFAULT_RULES.keys())}')
+    return rules
+
+
+def for_spider(spider, settings=None, **rules):
+    """ function returns the `Canonicalizer` of 'spider' (see `spider_rules()`).
+    'rules' override the rules of the spider """
+
+    return Canonicalizer(**dict(spider_rules(spider, settings), **rules))
+
+
+def enabled(settings=None):
+    """ function returns True if the urls are canonicalized at request time
+    (the CANONICAL_URL_ENABLED setting) """
+
+    return bool(_setting(settings, 'CANONICAL_URL_ENABLED', True))
+
+
+class Canonicalizer():
+    """ class puts urls in their canonical form (see the module documentation) """
+
+    def __init__(self, strip_query_params=('referrer',), strip_patterns=(), deny_patterns=(r'/print/',),
+                 equivalent_schemes=True, strip_www=True, lowercase=False):
+
+        self.strip_query_params = set(strip_query_params or ())
+        self.strip_query = '*' in self.strip_query_params
+        self.strip_patterns = [re.compile(pattern) for pattern in strip_patterns or ()]
+        self.deny_patterns = [re.compile(pattern) for pattern in deny_patterns or ()]
+        self.equivalent_schemes = equivalent_schemes
+        self.strip_www = strip_www
+        self.lowercase = lowercase
+
+    def denied(self, url):
+        """ returns True if 'url' must not be crawled (see 'deny_patterns') """
+        return any(pattern.search(url) for pattern in self.deny_patterns)
+
+    def strip(self, url):
+        """ returns 'url' without the parts which do not tell pages apart (see
+        'strip_patterns' and 'strip_query_params') and without its fragment.
+        Unlike `key()`, the returned url can still be requested """
+
+        for pattern in self.strip_patterns:
+            url = pattern.sub('', url)
+
+        parts = urlsplit(url)
+        query = parts.query
+        if query and self.strip_query:
+            query = ''
+        elif query and self.strip_query_params:
+            params = parse_qsl(query, keep_blank_values=True)
+            kept = [(name, value) for name, value in params if name not in self.strip_query_params]
+            if len(kept) != len(params):
+                query = urlencode(kept)
+        if query == parts.query and not parts.fragment:
+            return url
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))
+
+    def process_value(self, value):
+        """ link extractor 'process_value': returns the stripped url
+        or None if the url must not be crawled """
+
+        if self.denied(value):
+            return None
+        return self.strip(value)
+
+    def key(self, url):
+        """ returns the canonical form of 'url', which is the same for all the
+        urls of a page (e.g. 'ed.gov/a?b=1' for 'https://www2.ed.gov/a?b=1#c').
+        The key is not a url which can be requested """
+
+        # sorted query, normalized percent-encoding and no fragment
+        parts = urlsplit(canonicalize_url(self.strip(url)))
+        host = parts.netloc.lower()
+        default_port = DEFAULT_PORTS.get(parts.scheme)
+        if default_port and host.endswith(default_port):
+            host = host[:-len(default_port)]
+        if self.strip_www:
+            host = WWW_REGEX.sub('', host)
+
+        key = host + (parts.path or '/')
+        if parts.query:
+            key += '?' + parts.query
+        if not self.equivalent_schemes:
+            key = parts.scheme + '://' + key
+        if self.lowercase:
+            key = key.lower()
+        return key
+
+    def fingerprint(self, request):
+        """ returns the fingerprint of 'request': the scrapy request
+        fingerprint, computed with the canonical url of the request """
+
+        fingerprint = hashlib.sha1()
+        fingerprint.update(to_bytes(request.method))
+        fingerprint.update(to_bytes(self.key(request.url)))
+        fingerprint.update(request.body or b'')
+        return fingerprint.hexdigest()
+
+
+class CanonicalDupeFilter(RFPDupeFilter):
+    """ dupefilter which fingerprints the requests by their canonical url,
+    with the canonical url rules of the spider of the crawl.
+
+    The requests filtered although their (original) url was not seen before are
+    the requests saved by the canonical form. They are counted in the scrapy
+    stats as 'canonical/saved'. When CANONICAL_URL_ENABLED is False, the
+    requests are fingerprinted by scrapy, like the RFPDupeFilter does """
+
+    def __init__(self, path=None, debug=False, canonicalizer=None, stats=None):
+        super().__init__(path, debug)
+        self.canonicalizer = canonicalizer
+        self.stats = stats
+        # the hash of the (first) original url of every fingerprint, or the
+        # set of the hashes once several urls had the same fingerprint
+        self.original_urls = dict()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        dupefilter = cls.from_settings(crawler.settings)
+        if enabled(crawler.settings):
+            dupefilter.canonicalizer = for_spider(crawler.spidercls, crawler.settings)
+        dupefilter.stats = crawler.stats
+        return dupefilter
+
+    def request_fingerprint(self, request):
+        if self.canonicalizer is None:
+            return super().request_fingerprint(request)
+        return self.canonicalizer.fingerprint(request)
+
+    def request_seen(self, request):
+        fingerprint = self.request_fingerprint(request)
+        if fingerprint in self.fingerprints:
+            self.count_saved(fingerprint, request)
+            return True
+        self.add_fingerprint(fingerprint, request)
+        if self.file:
+            self.file.write(fingerprint + '\n')
+        return False
+
+    def add_fingerprint(self, fingerprint, request):
+        """ records 'fingerprint' as seen, for 'request' """
+
+        self.fingerprints.add(fingerprint)
+        if self.canonicalizer is not None:
+            self.original_urls[fingerprint] = _original_url_hash(request)
+
+    def count_saved(self, fingerprint, request):
+        """ counts the duplicate 'request' as saved if its original url
+        has not been seen before (with the same fingerprint) """
+
+        if self.canonicalizer is None:
+            return
+        url_hash = _original_url_hash(request)
+        seen = self.original_urls.get(fingerprint)
+        if seen is None or seen == url_hash:
+            # not seen by this process (e.g. in the JOBDIR) or the very same url
+            return
+        if isinstance(seen, set):
+            if url_hash in seen:
+                return
+            seen.add(url_hash)
+        else:
+            self.original_urls[fingerprint] = {seen, url_hash}
+        if self.stats is not None:
+            self.stats.inc_value('canonical/saved')
+
+
+def _original_url_hash(request):
+    """ returns the hash of the url 'request' had before it was stripped.
+    The fragment is left out, as scrapy never tells urls apart by their fragment """
+    return hash(request.meta.get(ORIGINAL_URL_KEY, request.url).split('#', 1)[0])
+
+
+class CanonicalUrlMiddleware():
+    """ spider middleware which strips the urls of the requests yielded
+    by the spiders (see `Canonicalizer.strip()`), and drops the requests of
+    the urls which must not be crawled (e.g. '/print/' pages).
+
+    The number of requests stripped and dropped is recorded in the scrapy
+    stats as 'canonical/stripped' and 'canonical/dropped'.
+    This middleware must come before the ResourceHeadersMiddleware, so the
+    HEAD requests of the dataset resources are left alone.
+
+    Settings:
+    - CANONICAL_URL_ENABLED: canonicalize the urls at request time. default is True
+    - CANONICAL_URL: the canonical url rules (see the module documentation) """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.canonicalizer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not enabled(crawler.settings):
+            raise NotConfigured
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.canonicalizer = for_spider(spider, self.crawler.settings)
+
+    def spider_closed(self, spider):
+        spider.logger.info('Canonical urls: %(saved)d duplicate requests saved, '
+                           '%(stripped)d urls stripped and %(dropped)d urls dropped', {
+                               'saved': self.stats.get_value('canonical/saved', 0, spider=spider),
+                               'stripped': self.stats.get_value('canonical/stripped', 0, spider=spider),
+                               'dropped': self.stats.get_value('canonical/dropped', 0, spider=spider)})
+
+    def process_spider_output(self, response, result, spider):
+        for element in result:
+            if self.canonicalizer is None or not isinstance(element, Request) or element.dont_filter:
+                # items, and the requests which are never filtered
+                yield element
+                continue
+            url = element.url
+            if self.canonicalizer.denied(url):
+                self.stats.inc_value('canonical/dropped', spider=spider)
+                continue
+            stripped_url = self.canonicalizer.strip(url)
+            if stripped_url != url:
+                self.stats.inc_value('canonical/stripped', spider=spider)
+                element = element.replace(url=stripped_url)
+                element.meta.setdefault(ORIGINAL_URL_KEY, url)
+            yield element
@@ -0,0 +1,235 @@
+""" module provides the link classifier shared by the crawlers, the parsers
+and the transformers.
+
+A link (i.e. a url or the href of an <a> tag) is classified as one of:
+- DATA: links to a data resource (see DATA_EXTENSIONS)
+- DOCUMENT: links to a document (see DOCUMENT_EXTENSIONS)
+- AVOIDABLE: links to files which are never scraped (see AVOIDABLE_EXTENSIONS)
+  or to data resources which are explicitly excluded (see DENY_LIST)
+- OTHER: everything else (e.g. html pages)
+
+The extensions are matched against the end of the (lower-cased) link,
+the same way the parsers have always located resource links. Links are
+classified many thousand times per crawl, so all the lookup tables are
+built once, when the classifier is created, and a link is classified with a
+handful of dict lookups (one per distinct extension length) instead of a loop
+over every extension """
+
+import collections
+
+# the link categories
+DATA = 'data'
+DOCUMENT = 'document'
+AVOIDABLE = 'avoidable'
+OTHER = 'other'
+
+DATA_EXTENSIONS = {
+    '.xls': 'Excel data file',
+    '.csv': 'Comma delimited text file',
+    '.sas': 'SAS syntax file',
+    '.dat': 'Generic data file',
+    '.spss': 'SPSS syntax',  # This may be an incorrect extension, but we will continue to search for it
+    '.db.': 'Generic data base',
+    '.sql': 'Structured query language file',
+    '.xml': 'Extensible Markup language',
+    '.zip': 'File containing compressed files',
+    '.txt': 'Text files',
+
+    '.xlsx': 'Excel data file',
+    '.sps': 'SPSS syntax',
+    '.sav': 'SPSS data',
+    '.dat': 'Stata data',
+    '.do': 'Stata syntax',
+    '.r': 'R script',
+    '.rdata': 'R data',
+    '.rda': 'R data',
+    '.sd2': 'SAS data',
+    '.sd7': 'SAS data',
+    '.sas7bdat': 'SAS data'
+}
+
+DOCUMENT_EXTENSIONS = {
+    '.docx': 'Word document',
+    '.doc': 'Word document',
+    '.pdf': 'PDF file'
+}
+
+AVOIDABLE_EXTENSIONS = {
+    '.jpg': 'JPG image file',
+    '.jpeg': 'JPEG image file',
+    '.png': 'PNG image file',
+    '.ppt': 'MS PowerPoint file',
+    '.pptx': 'MS PowerPoint file',
+    '.mp3': 'MP3 audio file',
+}
+
+# contains list of data resources (file names) to exclude from datasets
+DENY_LIST = ['site-list.xls']
+
+# the longest extension reported for links which don't match a known extension
+MAX_OTHER_EXTENSION_LENGTH = 5
+
+# the result of classifying a link: its category and its normalized
+# extension (lower-cased, without dots) or None if it has no extension
+LinkClass = collections.namedtuple('LinkClass', ['category', 'extension'])
+
+
+class SuffixMatcher():
+    """ class matches the end of a string against a fixed set of suffixes.
+    Rather than testing every suffix, the matcher looks up the tail of the
+    string in a dict. When all the suffixes start with the same character
+    (e.g. the '.' of file extensions) only the tails starting with that
+    character are looked up, otherwise one tail per distinct suffix length """
+
+    def __init__(self, suffixes, ignore_case=True):
+        """ PARAMETERS:
+        - suffixes: a dict mapping each suffix to the value returned when it matches
+        (or any iterable of suffixes, which are then mapped to themselves)
+
+        - ignore_case: match the suffixes regardless of case. default is True """
+
+        if not isinstance(suffixes, dict):
+            suffixes = {suffix: suffix for suffix in suffixes}
+        self.ignore_case = ignore_case
+        self.suffixes = {(suffix.lower() if ignore_case else suffix): value
+                         for suffix, value in suffixes.items() if suffix}
+        self.lengths = sorted({len(suffix) for suffix in self.suffixes}, reverse=True)
+        self.max_length = self.lengths[0] if self.lengths else 0
+        leads = {suffix[0] for suffix in self.suffixes}
+        self.lead = leads.pop() if len(leads) == 1 else None
+
+    def match(self, text, default=None):
+        """ returns the value of the (longest) suffix 'text' ends with, or 'default' """
+
+        if not text or not self.max_length:
+            return default
+        tail = text[-self.max_length:]
+        if self.ignore_case:
+            tail = tail.lower()
+
+        if self.lead is not None:
+            # the left-most lead character gives the longest suffix
+            position = tail.find(self.lead)
+            while position != -1:
+                value = self.suffixes.get(tail[position:])
+                if value is not None:
+                    return value
+                position = tail.find(self.lead, position + 1)
+            return default
+
+        for length in self.lengths:
+            value = self.suffixes.get(tail[-length:])
+            if value is not None:
+                return value
+        return default
+
+
+class LinkClassifier():
+    """ class classifies links by their extension (see the module docstring) """
+
+    def __init__(self, data_extensions=DATA_EXTENSIONS,
+                 document_extensions=DOCUMENT_EXTENSIONS,
+                 avoidable_extensions=AVOIDABLE_EXTENSIONS,
+                 deny_list=DENY_LIST):
+
+        self.extensions = collections.OrderedDict([
+            (DATA, tuple(data_extensions.keys())),
+            (DOCUMENT, tuple(document_extensions.keys())),
+            (AVOIDABLE, tuple(avoidable_extensions.keys())),
+        ])
+        self.deny_list = frozenset(name.lower() for name in deny_list)
+
+        # maps every extension to its LinkClass
+        suffixes = dict()
+        for category, extensions in self.extensions.items():
+            for extension in extensions:
+                suffixes.setdefault(extension.lower(),
+                                    LinkClass(category, _normalize_extension(extension)))
+        self.matcher = SuffixMatcher(suffixes)
+
+        # the deny lists handed to the crawlers' link extractors, built once
+        self._deny_extensions = dict()
+        self._deny_patterns = dict()
+
+    def classify(self, url):
+        """ function returns the LinkClass of 'url' """
+
+        if not url:
+            return LinkClass(OTHER, None)
+
+        link_class = self.matcher.match(url)
+        if link_class is None:
+            return LinkClass(OTHER, _other_extension(url))
+
+        if link_class.category == DATA and self.deny_list and \
+                url[url.rfind('/')+1:].lower() in self.deny_list:
+            return LinkClass(AVOIDABLE, link_class.extension)
+        return link_class
+
+    def category(self, url):
+        """ function returns the category of 'url' """
+        return self.classify(url).category
+
+    def extension(self, url):
+        """ function returns the normalized extension of 'url' (or None) """
+        return self.classify(url).extension
+
+    def is_data(self, url):
+        """ function checks if 'url' links to a data resource """
+        return self.classify(url).category == DATA
+
+    def is_document(self, url):
+        """ function checks if 'url' links to a document """
+        return self.classify(url).category == DOCUMENT
+
+    def deny_extensions(self, categories=(DATA, DOCUMENT, AVOIDABLE)):
+        """ function returns the extensions (without the leading dot) of
+        'categories', as expected by the 'deny_extensions' argument of Scrapy's
+        LinkExtractor. The list is built once per set of categories """
+
+        categories = tuple(categories)
+        if categories not in self._deny_extensions:
+            self._deny_extensions[categories] = [extension[1:]
+                                                 for category in categories
+                                                 for extension in self.extensions[category]]
+        return self._deny_extensions[categories]
+
+    def deny_patterns(self, categories=(DATA,)):
+        """ function returns the extensions of 'categories' as (escaped)
+        regular expressions, as expected by the 'deny' argument of Scrapy's
+        LinkExtractor. The list is built once per set of categories """
+
+        categories = tuple(categories)
+        if categories not in self._deny_patterns:
+            self._deny_patterns[categories] = ['\\' + extension
+                                               for category in categories
+                                               for extension in self.extensions[category]]
+        return self._deny_patterns[categories]
+
+
+def _normalize_extension(extension):
+    """ function returns 'extension' lower-cased and without dots (e.g. '.XLS' -> 'xls') """
+    return extension.strip('.').lower() or None
+
+
+def _other_extension(url):
+    """ function returns the normalized extension of the last path segment
+    of 'url' (ignoring any query string or fragment) or None if the segment
+    has no extension, or one longer than MAX_OTHER_EXTENSION_LENGTH """
+
+    for separator in ('#', '?'):
+        position = url.find(separator)
+        if position != -1:
+            url = url[:position]
+    name = url[url.rfind('/')+1:]
+    position = name.rfind('.')
+    if position == -1:
+        return None
+    extension = name[position+1:].lower()
+    if 0 < len(extension) <= MAX_OTHER_EXTENSION_LENGTH:
+        return extension
+    return None
+
+
+# the classifier shared by the crawlers, parsers and transformers
+link_classifier = LinkClassifier()
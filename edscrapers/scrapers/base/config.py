@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
+import json
 import logging
 import logging.config
 
@@ -25,14 +26,130 @@ SCRAPY_SETTINGS = {
         'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware': 1,
         'edscrapers.scrapers.base.middlewares.RegexOffsiteMiddleware': 2,
         'scrapy.spidermiddlewares.offsite.OffsiteMiddleware': 3,
+        # after the http cache, so the cached responses do not get a download slot
+        'edscrapers.scrapers.base.policies.DownloadPolicyMiddleware': 4,
+    },
+    # the download policy of every host, applied to its download slot (see scrapers/base/policies.py):
+    # 'concurrency', 'delay', 'autothrottle', 'autothrottle_target' and 'max_size' (bytes).
+    # The hosts without a policy get DOWNLOAD_DELAY and AUTOTHROTTLE. Crawler classes can
+    # override entries with a 'download_policies' attribute. Set DOWNLOAD_POLICIES to a json
+    # object to replace the table
+    'DOWNLOAD_POLICIES': json.loads(os.getenv('DOWNLOAD_POLICIES', 'null')) or {
+        # the nces/ies servers cope with parallel requests
+        'nces.ed.gov': {'concurrency': 8, 'delay': 0.25, 'autothrottle_target': 4.0},
+        'ies.ed.gov': {'concurrency': 8, 'delay': 0.25, 'autothrottle_target': 4.0},
+        # ocrdata.ed.gov is fragile: one request at a time
+        'ocrdata.ed.gov': {'concurrency': 1, 'delay': 2.0, 'autothrottle_target': 1.0},
     },
     'ITEM_PIPELINES': {
+        'edscrapers.scrapers.base.pipelines.DuplicatesPipeline': 0,
         'edscrapers.scrapers.base.pipelines.JsonWriterPipeline': 1,
         'edscrapers.scrapers.base.pipelines.GraphItemPipeline': 2,
     },
     'SPIDER_MIDDLEWARES': {
-        'edscrapers.scrapers.base.middlewares.GraphMiddleWare': 1000
+        # after the scrapy DepthMiddleware (900), so the HEAD requests are not depth limited
+        'edscrapers.scrapers.base.middlewares.ResourceHeadersMiddleware': 880,
+        # after the CanonicalUrlMiddleware, so the stripped urls are scored
+        'edscrapers.scrapers.base.priority.PriorityMiddleware': 940,
+        'edscrapers.scrapers.base.canonical.CanonicalUrlMiddleware': 950,
+        'edscrapers.scrapers.base.middlewares.IncrementalMiddleware': 995,
+        'edscrapers.scrapers.base.middlewares.DocumentCacheMiddleware': 999,
+        'edscrapers.scrapers.base.middlewares.GraphMiddleWare': 1000,
+    },
+    # the requests are fingerprinted by their canonical url, so equivalent urls are
+    # scheduled once (see scrapers/base/canonical.py). Crawlers can override the rules
+    # with a 'canonical_url' attribute. Set CANONICAL_URL to a json object to replace them
+    'CANONICAL_URL_ENABLED': os.getenv('CANONICAL_URL_ENABLED', 'True') == 'True',
+    'CANONICAL_URL': json.loads(os.getenv('CANONICAL_URL', 'null')) or {
+        'strip_query_params': ['referrer'],
+        'strip_patterns': [],
+        'deny_patterns': [r'/print/'], # the printable version of the pages
+        'equivalent_schemes': True, # http:// and https://
+        'strip_www': True, # www. and www2.
+        'lowercase': False,
     },
+    'DUPEFILTER_CLASS': 'edscrapers.scrapers.base.canonical.CanonicalDupeFilter',
+    # drop the datasets scraped before during the crawl (see DuplicatesPipeline in
+    # scrapers/base/pipelines.py). The seen-set is 'exact' or 'bloom' (see scrapers/base/seen.py)
+    'DUPLICATES_ENABLED': os.getenv('DUPLICATES_ENABLED', 'True') == 'True',
+    'DUPLICATES_SEEN_SET': os.getenv('DUPLICATES_SEEN_SET', 'exact'),
+    'DUPLICATES_BLOOM_CAPACITY': int(os.getenv('DUPLICATES_BLOOM_CAPACITY', 10 * 1000 * 1000)),
+    'DUPLICATES_BLOOM_ERROR_RATE': float(os.getenv('DUPLICATES_BLOOM_ERROR_RATE', 0.001)),
+    # raise the priority of the links by the rate of dataset pages learned from the graph
+    # of the previous crawl, and record the yield curve (see scrapers/base/priority.py)
+    'PRIORITY_ENABLED': os.getenv('PRIORITY_ENABLED', 'False') == 'True',
+    'PRIORITY_GRAPH_PATH': os.getenv('PRIORITY_GRAPH_PATH', ''), # default is ED_OUTPUT_PATH/graphs/<name>/<name>.pickle
+    'PRIORITY_RANGE': int(os.getenv('PRIORITY_RANGE', 100)),
+    'PRIORITY_PREFIX_LEVELS': int(os.getenv('PRIORITY_PREFIX_LEVELS', 3)),
+    'PRIORITY_YIELD_STEP': int(os.getenv('PRIORITY_YIELD_STEP', 100)),
+    # html parsing backend used by the parsers ('html5lib', 'lxml' or 'parsel').
+    # Crawlers can override it with the 'html_parser_backend' class attribute
+    'HTML_PARSER_BACKEND': os.getenv('HTML_PARSER_BACKEND', 'html5lib'),
+    # fetch the headers of dataset resources with (non-blocking) HEAD requests
+    'RESOURCE_HEADERS_ENABLED': os.getenv('RESOURCE_HEADERS_ENABLED', 'True') == 'True',
+    'RESOURCE_HEADERS_TIMEOUT': float(os.getenv('RESOURCE_HEADERS_TIMEOUT', 30)),
+    # keep the resource headers in a persistent cache (see scrapers/base/metadata.py)
+    'RESOURCE_METADATA_CACHE_ENABLED': os.getenv('RESOURCE_METADATA_CACHE_ENABLED', 'True') == 'True',
+    'RESOURCE_METADATA_TTL': float(os.getenv('RESOURCE_METADATA_TTL', 7 * 24 * 60 * 60)),
+    # download the referring page of a dataset Collection when its title
+    # is not known from the crawl graph (or the http cache)
+    'COLLECTION_NETWORK_FALLBACK': os.getenv('COLLECTION_NETWORK_FALLBACK', 'False') == 'True',
+    'EXTENSIONS': {
+        # throttles every host after its download policy (see DOWNLOAD_POLICIES)
+        'scrapy.extensions.throttle.AutoThrottle': None,
+        'edscrapers.scrapers.base.policies.PolicyAutoThrottle': 0,
+        'edscrapers.scrapers.base.extensions.LookupMemoExtension': 500,
+        'edscrapers.scrapers.base.extensions.TimingExtension': 510,
+        'edscrapers.scrapers.base.extensions.MetricsExtension': 520,
+    },
+    # memoize the (network) Source/Collection lookups of a crawl (see scrapers/base/memo.py)
+    'LOOKUP_MEMO_SIZE': int(os.getenv('LOOKUP_MEMO_SIZE', 1024)),
+    'LOOKUP_MEMO_PERSIST': os.getenv('LOOKUP_MEMO_PERSIST', 'True') == 'True',
+    # how the JsonWriterPipeline writes the datasets: 'files' (a json file per dataset)
+    # or 'jsonl' (appended to the sharded dataset store, see scrapers/base/store.py)
+    'OUTPUT_MODE': os.getenv('OUTPUT_MODE', 'files'),
+    'OUTPUT_SHARD_SIZE': int(os.getenv('OUTPUT_SHARD_SIZE', 64 * 1024 * 1024)),
+    'OUTPUT_COMPRESSION': os.getenv('OUTPUT_COMPRESSION', ''), # '', 'gzip' or 'zstd'
+    # write the output on background threads (see scrapers/base/writer.py)
+    'OUTPUT_WRITER_ENABLED': os.getenv('OUTPUT_WRITER_ENABLED', 'True') == 'True',
+    'OUTPUT_WRITER_THREADS': int(os.getenv('OUTPUT_WRITER_THREADS', 1)),
+    'OUTPUT_WRITER_QUEUE_SIZE': int(os.getenv('OUTPUT_WRITER_QUEUE_SIZE', 1000)),
+    # the crawl graph is updated in batches of this many vertices and edges,
+    # or at least every GRAPH_FLUSH_INTERVAL seconds (see scrapers/base/graph.py)
+    'GRAPH_FLUSH_SIZE': int(os.getenv('GRAPH_FLUSH_SIZE', 500)),
+    'GRAPH_FLUSH_INTERVAL': float(os.getenv('GRAPH_FLUSH_INTERVAL', 5.0)),
+    # the graph exports written (by a background process) when a spider closes
+    # and after every transformer: pickle, graphml, edgelist and/or svg (see scrapers/base/exports.py)
+    'GRAPH_EXPORT_FORMATS': os.getenv('GRAPH_EXPORT_FORMATS', 'pickle,svg'),
+    'GRAPH_EXPORT_BACKGROUND': os.getenv('GRAPH_EXPORT_BACKGROUND', 'True') == 'True',
+    # no svg is rendered for graphs with more vertices than this
+    'GRAPH_SVG_MAX_VERTICES': int(os.getenv('GRAPH_SVG_MAX_VERTICES', 2000)),
+    # incremental crawl mode: skip parsing the pages unchanged since the last crawl
+    # (see scrapers/base/incremental.py). Set by the CLI '--incremental' option
+    'INCREMENTAL_ENABLED': os.getenv('INCREMENTAL_ENABLED', 'False') == 'True',
+    'INCREMENTAL_STORE_PATH': os.getenv('INCREMENTAL_STORE_PATH', ''),
+    # worker mode: the worker processes of a crawl share a crawl frontier
+    # (see scrapers/base/frontier.py). Set by the CLI '--worker' option
+    'FRONTIER_ENABLED': os.getenv('FRONTIER_ENABLED', 'False') == 'True',
+    'FRONTIER_URL': os.getenv('FRONTIER_URL', ''), # default is ED_OUTPUT_PATH/scrapy/frontier.sqlite
+    'FRONTIER_WORKER_ID': os.getenv('FRONTIER_WORKER_ID', ''), # default is '<host name>-<process id>'
+    'FRONTIER_BATCH_SIZE': int(os.getenv('FRONTIER_BATCH_SIZE', 16)),
+    'FRONTIER_WORKER_TIMEOUT': float(os.getenv('FRONTIER_WORKER_TIMEOUT', 600)),
+    # replay mode: re-run the parsers over the http cache, without any network call
+    # (see scrapers/base/replay.py). Set by the CLI '--replay' option
+    'REPLAY_ENABLED': os.getenv('REPLAY_ENABLED', 'False') == 'True',
+    'REPLAY_CONCURRENT_REQUESTS': int(os.getenv('REPLAY_CONCURRENT_REQUESTS', 64)),
+    'REPLAY_LIST_MISSING': os.getenv('REPLAY_LIST_MISSING', 'True') == 'True',
+    'REPLAY_MISSING_DIR': os.getenv('REPLAY_MISSING_DIR', ''), # default is ED_OUTPUT_PATH/scrapy/replay
+    # time the hot paths of the crawl (parsers, html parsing, lookups, graph lock
+    # and json writes, see scrapers/base/timing.py). Set by the CLI '--timing' option
+    'TIMING_ENABLED': os.getenv('TIMING_ENABLED', 'False') == 'True',
+    'TIMING_REPORT_DIR': os.getenv('TIMING_REPORT_DIR', ''), # default is ED_OUTPUT_PATH/scrapy/timing
+    # sample the throughput, download latencies, scheduler queue and memory of the crawl
+    # to ED_OUTPUT_PATH/metrics (json-lines and Prometheus textfile, see scrapers/base/metrics.py)
+    'METRICS_ENABLED': os.getenv('METRICS_ENABLED', 'True') == 'True',
+    'METRICS_INTERVAL': float(os.getenv('METRICS_INTERVAL', 10)),
+    'METRICS_DIR': os.getenv('METRICS_DIR', ''), # default is ED_OUTPUT_PATH/metrics
     'SCHEDULER_PRIORITY_QUEUE': 'scrapy.pqueues.DownloaderAwarePriorityQueue',
     # 'REDIRECT_ENABLED': False,
     'RETRY_ENABLED': False,
@@ -44,6 +161,15 @@ SCRAPY_SETTINGS = {
     # This is set by the CLI
     # 'HTTPCACHE_ENABLED': True,
 
+    # the http cache keeps a directory per response. Set HTTPCACHE_STORAGE to
+    # 'edscrapers.scrapers.base.httpcache.SQLiteCacheStorage' to keep the cache of a spider
+    # in a single (SQLite) file, with compressed bodies (see scrapers/base/httpcache.py),
+    # after moving an existing cache into it with `eds cache import`
+    'HTTPCACHE_STORAGE': os.getenv('HTTPCACHE_STORAGE', 'scrapy.extensions.httpcache.FilesystemCacheStorage'),
+    'HTTPCACHE_EXPIRATION_SECS': int(os.getenv('HTTPCACHE_EXPIRATION_SECS', 0)),
+    'HTTPCACHE_COMPRESSION': os.getenv('HTTPCACHE_COMPRESSION', 'zlib'), # '', 'zlib' or 'zstd'
+    'HTTPCACHE_MMAP_SIZE': int(os.getenv('HTTPCACHE_MMAP_SIZE', 256 * 1024 * 1024)),
+
     'AUTOTHROTTLE_ENABLED': True,
     'LOG_LEVEL': 'INFO',
     'DEPTH_LIMIT': 0
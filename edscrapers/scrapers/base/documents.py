@@ -0,0 +1,199 @@
+""" module provides a per-response cache of parsed html documents.
+
+A single page is read by several stages of a crawl (the GraphMiddleWare,
+the scraper's main parser, the office dispatchers and the sub-parsers).
+Parsing a page with html5lib is the single biggest cpu cost of a crawl, so
+every stage should get its document tree from `get_soup()` instead of
+creating its own BeautifulSoup object. That way a response is parsed once,
+no matter how many stages read it.
+
+Cache entries are keyed by the scrapy Response object. The entry for a
+response is released by the `DocumentCacheMiddleware` once the response
+leaves the spider middleware chain (entries are also dropped automatically
+if the Response object is garbage collected before that happens)
+
+The html parsing backend used for a response can be selected globally with
+the 'HTML_PARSER_BACKEND' scrapy setting (see scrapers/base/config.py) or per
+scraper with the 'html_parser_backend' attribute of the crawler class.
+The available backends are:
+- 'html5lib': BeautifulSoup with the html5lib tree builder. This is the
+  slowest backend, but it is the one all parsers were written against
+- 'lxml': BeautifulSoup with the lxml tree builder. Same api for the parsers,
+  many times faster than html5lib
+- 'parsel': the native lxml based Selector scrapy has already built on the
+  response. Stages which only need quick lookups (e.g. the page title or
+  checking if a page links to any resource) use the selector directly, so
+  pages without resources are never turned into a BeautifulSoup document.
+  Parsers which need a BeautifulSoup document get one built with lxml
+
+Use `eds parity` (edscrapers/tools/parity) to compare the datasets produced by
+the different backends before switching a scraper to a faster backend.
+
+NOTE: documents returned from the cache are shared between stages,
+so they MUST be treated as read-only """
+
+import weakref
+
+import bs4
+
+from edscrapers.scrapers.base import timing
+
+# the html parsing backend used when none was selected for a response
+DEFAULT_BACKEND = 'html5lib'
+
+# maps each backend to the BeautifulSoup tree builder it uses
+BACKENDS = {
+    'html5lib': 'html5lib',
+    'lxml': 'lxml',
+    'parsel': 'lxml',
+}
+
+# the tree builder used for parsing documents
+DEFAULT_FEATURES = BACKENDS[DEFAULT_BACKEND]
+
+# holds the cached documents, keyed by the Response they were parsed from
+_documents = weakref.WeakKeyDictionary()
+
+
+class _CachedDocument():
+    """ class represents the cache entry for a single response """
+
+    def __init__(self):
+        self.backend = DEFAULT_BACKEND # html parsing backend for the response
+        self.soups = dict() # parsed documents, keyed by tree builder
+        self.selector = None # the native selector of the response
+        self.parsed = 0 # number of times the response was actually parsed
+        self.reused = 0 # number of parses avoided by reusing a cached document
+
+
+def check_backend(backend):
+    """ function ensures the provided html parsing backend exists.
+    Returns the backend or raises ValueError """
+
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown html parser backend '{backend}'. "
+                         f"Expected one of {list(BACKENDS.keys())}")
+    return backend
+
+
+def set_backend(res, backend):
+    """ function selects the html parsing backend used for the provided response.
+    This is done by the `DocumentCacheMiddleware` before the response gets to
+    the spider, so the parsers don't need to know which backend is in use """
+
+    entry = _documents.get(res)
+    if entry is None:
+        entry = _documents.setdefault(res, _CachedDocument())
+    entry.backend = check_backend(backend)
+
+
+def get_backend(res):
+    """ function returns the html parsing backend selected for the provided response """
+
+    entry = _documents.get(res)
+    if entry is None:
+        return DEFAULT_BACKEND
+    return entry.backend
+
+
+def get_soup(res, features=None):
+    """ function returns the BeautifulSoup document for the provided response.
+    The response is only parsed the first time this function is called for it,
+    subsequent calls (e.g. from dispatchers and sub-parsers) get the cached document.
+
+    PARAMETERS:
+    - res: the scrapy Response whose text should be parsed
+
+    - features: the BeautifulSoup tree builder to use. default is the tree builder
+    of the backend selected for the response (see `set_backend()`)
+
+    Any exception raised while parsing the response is propagated to the caller
+    and nothing is cached """
+
+    entry = _documents.get(res)
+    if features is None:
+        features = BACKENDS[entry.backend if entry is not None else DEFAULT_BACKEND]
+    if entry is not None and features in entry.soups:
+        entry.reused += 1
+        return entry.soups[features]
+
+    with timing.timer('html_parse.' + features):
+        soup_parser = bs4.BeautifulSoup(res.text, features)
+
+    if entry is None:
+        entry = _documents.setdefault(res, _CachedDocument())
+    entry.soups[features] = soup_parser
+    entry.parsed += 1
+
+    return soup_parser
+
+
+def get_selector(res):
+    """ function returns the native (parsel) Selector for the provided response.
+    The selector is built and cached by scrapy itself, and is usually already
+    available because the crawler's link extractors use it.
+    Returns None if the response is not a text response """
+
+    entry = _documents.get(res)
+    if entry is not None and entry.selector is not None:
+        return entry.selector
+
+    try:
+        selector = res.selector
+    except AttributeError:
+        return None
+
+    if entry is not None:
+        # keep the selector with the entry, so responses aliased
+        # to this one (see `alias()`) can use it too
+        entry.selector = selector
+    return selector
+
+
+def get_title(res, default='[no title]'):
+    """ function returns the (stripped) title of the page in the provided
+    response, or 'default' if the page has no title or cannot be parsed.
+    The title is read with the backend selected for the response """
+
+    if get_backend(res) == 'parsel':
+        selector = get_selector(res)
+        if selector is None:
+            return default
+        title = selector.xpath('//head/title')
+        if not title:
+            return default
+        # mirror what BeautifulSoup's `Tag.string` gives for the title
+        texts = title[0].xpath('./text()').getall()
+        return (texts[0] if len(texts) == 1 else 'None').strip()
+
+    try:
+        soup_parser = get_soup(res)
+    except Exception:
+        return default
+
+    # documents built with lxml may not have a head
+    if soup_parser.head is not None and soup_parser.head.find(name='title'):
+        return str(soup_parser.head.find(name='title').string).strip()
+    return default
+
+
+def alias(res, original_res):
+    """ function makes the cached documents of 'original_res' available
+    to 'res'. This is used when a parser creates a modified copy of the
+    response it received (e.g. with `Response.replace()`), but the body of the
+    copy is the same as the original """
+
+    entry = _documents.get(original_res)
+    if entry is not None:
+        _documents[res] = entry
+
+
+def release(res):
+    """ function removes the cache entry for the provided response.
+    Returns a tuple of (number of parses, number of reused parses)
+    recorded for the response """
+
+    entry = _documents.pop(res, None)
+    if entry is None:
+        return (0, 0)
+    return (entry.parsed, entry.reused)
@@ -0,0 +1,236 @@
+""" module exports the crawl graph (see scrapers/base/graph.py) to files.
+
+`GraphWrapper.write_graph()` always writes the latest graph to
+'<file_stem_name>.pickle' itself, as that is the file the transformers load.
+Every other export is done by this module, by default in a detached
+background process (`python -m edscrapers.scrapers.base.exports`), so
+neither closing a spider nor running a transformer waits for them.
+
+The exports are selected with GRAPH_EXPORT_FORMATS, a comma separated list of:
+- pickle: a copy of the pickle in the dated directory (e.g. '2020-04-01/2020-04-01.nces.pickle')
+- graphml: '<file_stem_name>.graphml'
+- edgelist: '<file_stem_name>.edges.csv.gz' (the edges, as 'source,target' vertex indices)
+  and '<file_stem_name>.vertices.csv.gz' (the vertex attributes, by vertex index)
+- svg: '<file_stem_name>.svg', only written for graphs of at most
+  GRAPH_SVG_MAX_VERTICES vertices, since larger graphs take minutes to
+  render and are unreadable anyway
+
+GRAPH_EXPORT_BACKGROUND=False runs the exports in the calling process instead """
+
+import os
+import sys
+import json
+import shutil
+import pathlib
+import argparse
+import subprocess
+from datetime import datetime
+
+import igraph
+import pandas as pd
+from loguru import logger
+
+PICKLE = 'pickle'
+GRAPHML = 'graphml'
+EDGELIST = 'edgelist'
+SVG = 'svg'
+EXPORT_FORMATS = (PICKLE, GRAPHML, EDGELIST, SVG)
+
+# default exports, as written before the exports were configurable
+DEFAULT_FORMATS = 'pickle,svg'
+# default number of vertices above which no svg is rendered
+DEFAULT_SVG_MAX_VERTICES = 2000
+
+
+def export_formats(formats=None):
+    """ function returns the list of export formats from 'formats' (a comma
+    separated string or a list, default is the GRAPH_EXPORT_FORMATS environment
+    variable). Raises ValueError for unknown formats """
+
+    if formats is None:
+        formats = os.getenv('GRAPH_EXPORT_FORMATS', DEFAULT_FORMATS)
+    if isinstance(formats, str):
+        formats = formats.split(',')
+    formats = [export_format.strip().lower() for export_format in formats if export_format.strip()]
+    unknown = [export_format for export_format in formats if export_format not in EXPORT_FORMATS]
+    if unknown:
+        raise ValueError(f"unknown graph export format(s) {unknown}. "
+                         f"Expected some of {list(EXPORT_FORMATS)}")
+    return formats
+
+
+def dated_pickle_path(file_dir_path, file_stem_name, date=None):
+    """ function returns the path of the dated copy of the pickle """
+
+    date = date or datetime.now()
+    dated_name = f'{date.year}-{date.month:02d}-{date.day:02d}'
+    return pathlib.Path(file_dir_path, dated_name, f'{dated_name}.{file_stem_name}.pickle')
+
+
+def _attribute_value(value):
+    """ function converts a vertex/edge attribute to a value GraphML and csv can hold """
+
+    if value is None:
+        return ''
+    if isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (set, frozenset)):
+        value = sorted(value, key=str)
+    try:
+        return json.dumps(value, default=str)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _replace(path, write):
+    """ function calls 'write' with a temporary path and then moves the
+    written file to 'path', so readers never see half written exports """
+
+    path = pathlib.Path(path)
+    temporary_path = path.with_name(f'.{path.name}.tmp')
+    write(temporary_path)
+    os.replace(temporary_path, path)
+    return path
+
+
+def _export_graphml(graph, file_dir_path, file_stem_name):
+    # GraphML only holds strings, numbers and booleans, so export a copy
+    # of the graph with the other attributes (e.g. sets of datasets) converted
+    graph = graph.copy()
+    for sequence in (graph.vs, graph.es):
+        for attribute_name in sequence.attribute_names():
+            sequence[attribute_name] = [_attribute_value(value) for value in sequence[attribute_name]]
+    return _replace(pathlib.Path(file_dir_path, f'{file_stem_name}.graphml'),
+                    lambda path: graph.write_graphml(str(path)))
+
+
+def _export_edgelist(graph, file_dir_path, file_stem_name):
+    edges = pd.DataFrame(graph.get_edgelist(), columns=['source', 'target'])
+    vertices = pd.DataFrame({attribute_name: [_attribute_value(value) for value in graph.vs[attribute_name]]
+                             for attribute_name in graph.vs.attribute_names()})
+    vertices.index.name = 'index'
+    return [_replace(pathlib.Path(file_dir_path, f'{file_stem_name}.edges.csv.gz'),
+                     lambda path: edges.to_csv(path, index=False, compression='gzip')),
+            _replace(pathlib.Path(file_dir_path, f'{file_stem_name}.vertices.csv.gz'),
+                     lambda path: vertices.to_csv(path, index=True, compression='gzip'))]
+
+
+def _export_svg(graph, file_dir_path, file_stem_name, svg_max_vertices,
+                graph_width=2800, graph_height=2800, vertex_size=32, font_size=26):
+    if graph.vcount() > svg_max_vertices:
+        logger.info(f'Not rendering {file_stem_name}.svg: the graph has {graph.vcount()} vertices '
+                    f'(GRAPH_SVG_MAX_VERTICES is {svg_max_vertices})')
+        return None
+
+    def write(path):
+        with open(path, mode='wt') as svg_file:
+            graph.write_svg(fname=svg_file,
+                            width=graph_width, height=graph_height,
+                            vertex_size=vertex_size, font_size=font_size,
+                            edge_colors=['black']*graph.ecount(),
+                            edge_stroke_widths=[4]*graph.ecount())
+    return _replace(pathlib.Path(file_dir_path, f'{file_stem_name}.svg'), write)
+
+
+def export_graph(pickle_path, file_dir_path, file_stem_name, formats=None,
+                 svg_max_vertices=None, **svg_options):
+    """ function writes the exports of the graph pickled at 'pickle_path'.
+    Returns the paths of the written exports
+
+    PARAMETERS:
+    - pickle_path: the latest pickle of the graph (written by `GraphWrapper.write_graph()`)
+
+    - file_dir_path: the directory the exports are written to
+
+    - file_stem_name: the stem of the export file names (e.g. 'nces' or 'nces.deduplicate')
+
+    - formats: the export formats (default is GRAPH_EXPORT_FORMATS)
+
+    - svg_max_vertices: the number of vertices above which no svg is rendered
+    (default is GRAPH_SVG_MAX_VERTICES)
+
+    - svg_options: graph_width, graph_height, vertex_size and font_size of the svg """
+
+    formats = export_formats(formats)
+    if svg_max_vertices is None:
+        svg_max_vertices = int(os.getenv('GRAPH_SVG_MAX_VERTICES', DEFAULT_SVG_MAX_VERTICES))
+
+    written = []
+    if PICKLE in formats:
+        dated_path = dated_pickle_path(file_dir_path, file_stem_name)
+        dated_path.parent.mkdir(parents=True, exist_ok=True)
+        written.append(_replace(dated_path, lambda path: shutil.copyfile(pickle_path, path)))
+
+    if set(formats) & {GRAPHML, EDGELIST, SVG}:
+        graph = igraph.Graph.Read_Pickle(fname=str(pickle_path))
+        if GRAPHML in formats:
+            written.append(_export_graphml(graph, file_dir_path, file_stem_name))
+        if EDGELIST in formats:
+            written.extend(_export_edgelist(graph, file_dir_path, file_stem_name))
+        if SVG in formats:
+            written.append(_export_svg(graph, file_dir_path, file_stem_name,
+                                       svg_max_vertices, **svg_options))
+    return [path for path in written if path is not None]
+
+
+def start_export(pickle_path, file_dir_path, file_stem_name, formats=None,
+                 background=None, svg_max_vertices=None, **svg_options):
+    """ function starts the exports of the graph pickled at 'pickle_path'
+    (see `export_graph()`). When 'background' (default is GRAPH_EXPORT_BACKGROUND)
+    the exports run in a detached process and the process is returned,
+    otherwise they run right away and the paths of the exports are returned """
+
+    formats = export_formats(formats)
+    if background is None:
+        background = os.getenv('GRAPH_EXPORT_BACKGROUND', 'True') == 'True'
+    if not formats:
+        return []
+    if not background:
+        return export_graph(pickle_path, file_dir_path, file_stem_name, formats=formats,
+                            svg_max_vertices=svg_max_vertices, **svg_options)
+
+    arguments = [sys.executable, '-m', 'edscrapers.scrapers.base.exports',
+                 str(pickle_path), str(file_dir_path), file_stem_name,
+                 '--formats', ','.join(formats)]
+    if svg_max_vertices is not None:
+        arguments += ['--svg-max-vertices', str(svg_max_vertices)]
+    for option, value in svg_options.items():
+        arguments += [f"--{option.replace('_', '-')}", str(value)]
+
+    # the output of the export process goes to a log file, like the other logs
+    if os.getenv('ED_OUTPUT_PATH'):
+        log_dir = pathlib.Path(os.getenv('ED_OUTPUT_PATH'), 'logs')
+    else:
+        log_dir = pathlib.Path(file_dir_path)
+    log_dir.mkdir(parents=True, exist_ok=True)
+    with open(log_dir / f'graph_exports_{file_stem_name}.log', 'a') as log_file:
+        process = subprocess.Popen(arguments, stdin=subprocess.DEVNULL,
+                                   stdout=log_file, stderr=subprocess.STDOUT,
+                                   close_fds=True, start_new_session=True)
+    logger.info(f'Exporting the {file_stem_name} graph ({", ".join(formats)}) in the background '
+                f'(process {process.pid})')
+    return process
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Export a pickled crawl graph')
+    parser.add_argument('pickle_path')
+    parser.add_argument('file_dir_path')
+    parser.add_argument('file_stem_name')
+    parser.add_argument('--formats', default=None)
+    parser.add_argument('--svg-max-vertices', type=int, default=None)
+    parser.add_argument('--graph-width', type=int, default=2800)
+    parser.add_argument('--graph-height', type=int, default=2800)
+    parser.add_argument('--vertex-size', type=int, default=32)
+    parser.add_argument('--font-size', type=int, default=26)
+    options = parser.parse_args(arguments)
+
+    written = export_graph(options.pickle_path, options.file_dir_path, options.file_stem_name,
+                           formats=options.formats, svg_max_vertices=options.svg_max_vertices,
+                           graph_width=options.graph_width, graph_height=options.graph_height,
+                           vertex_size=options.vertex_size, font_size=options.font_size)
+    logger.info(f"Exported the {options.file_stem_name} graph: {[str(path) for path in written]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+""" module contains the custom scrapy extensions used by the scrapers """
+
+import os
+import json
+import time
+import pathlib
+from datetime import datetime
+from urllib.parse import urlparse
+
+from twisted.internet import task
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from edscrapers.scrapers.base import memo
+from edscrapers.scrapers.base import timing
+from edscrapers.scrapers.base import metrics
+
+
+class LookupMemoExtension():
+    """ extension creates the lookup memos (see edscrapers.scrapers.base.memo)
+    of a crawl, attaches them to the responses of the crawl and records how
+    well they did in the scrapy stats
+    (e.g. 'lookup_memo/sources/hits' and 'lookup_memo/sources/hit_ratio').
+
+    Settings:
+    - LOOKUP_MEMO_ENABLED: enable this extension. default is True
+    - LOOKUP_MEMO_SIZE: number of entries each memo keeps in memory. default is 1024
+    - LOOKUP_MEMO_PERSIST: persist the memos to the JOBDIR of a resumable
+    crawl, so a resumed crawl reuses them. Without a JOBDIR the memos only last
+    for the crawl. default is True """
+
+    def __init__(self, stats, maxsize=memo.DEFAULT_MAXSIZE, path=None):
+        self.stats = stats
+        self.maxsize = maxsize
+        self.path = path
+        self.memos = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('LOOKUP_MEMO_ENABLED', True):
+            raise NotConfigured
+
+        path = None
+        if settings.getbool('LOOKUP_MEMO_PERSIST', True) and settings.get('JOBDIR'):
+            path = os.path.join(settings.get('JOBDIR'), 'lookup_memo.sqlite')
+
+        extension = cls(crawler.stats,
+                        maxsize=settings.getint('LOOKUP_MEMO_SIZE', memo.DEFAULT_MAXSIZE),
+                        path=path)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        return extension
+
+    def spider_opened(self, spider):
+        self.memos = memo.CrawlMemos(self.maxsize, self.path)
+
+    def response_received(self, response, request, spider):
+        if self.memos is not None:
+            memo.set_memos(response, self.memos)
+
+    def spider_closed(self, spider):
+        if self.memos is None:
+            return
+        for lookup_memo in self.memos:
+            for count_name, count in lookup_memo.counts.items():
+                self.stats.set_value(f'lookup_memo/{lookup_memo.name}/{count_name}',
+                                     count, spider=spider)
+            self.stats.set_value(f'lookup_memo/{lookup_memo.name}/hit_ratio',
+                                 round(lookup_memo.hit_ratio(), 4), spider=spider)
+        self.memos.close()
+        self.memos = None
+
+
+class TimingExtension():
+    """ extension turns on the timers of the hot paths of a crawl (see
+    edscrapers.scrapers.base.timing) and, when a spider closes, records
+    its timings in the scrapy stats and in a json report.
+
+    The stats hold the count, total and max seconds of every section, for the
+    spider (e.g. 'timing/html_parse.html5lib/seconds') and for every module
+    the time was spent in (e.g. 'timing/modules/nces.parsers.nces_parser2/parse/seconds').
+    The report (see `timing.collect()`) is written to
+    TIMING_REPORT_DIR/<spider>.json (<spider>.<worker>.json for the workers of a crawl)
+
+    Settings:
+    - TIMING_ENABLED: enable this extension. default is False
+    - TIMING_REPORT_DIR: the directory of the reports.
+    default is ED_OUTPUT_PATH/scrapy/timing """
+
+    def __init__(self, stats, report_dir=None, worker=None):
+        self.stats = stats
+        self.report_dir = report_dir or os.path.join(os.getenv('ED_OUTPUT_PATH', '.'), 'scrapy', 'timing')
+        self.worker = worker # the worker id, in worker mode
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('TIMING_ENABLED', False):
+            raise NotConfigured
+
+        worker = None
+        if settings.getbool('FRONTIER_ENABLED'):
+            from edscrapers.scrapers.base.frontier import worker_id
+            worker = worker_id(settings)
+        extension = cls(crawler.stats, report_dir=settings.get('TIMING_REPORT_DIR'), worker=worker)
+        timing.enable()
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        # time the parsers through the callbacks of the (CrawlSpider) rules
+        for rule in getattr(spider, '_rules', []):
+            if rule.callback is not None:
+                rule.callback = timing.timed_callback(rule.callback, spider.name)
+
+    def spider_closed(self, spider):
+        report = timing.collect(spider.name)
+        for section, section_timing in report['sections'].items():
+            self._set_stats(f'timing/{section}', section_timing, spider)
+        for module, sections in report['modules'].items():
+            for section, section_timing in sections.items():
+                self._set_stats(f'timing/modules/{timing.short_module_name(module)}/{section}',
+                                section_timing, spider)
+
+        path = self.report_path(spider)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.worker is not None:
+            report['worker'] = self.worker
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        spider.logger.info(f'Timing report written to {path}')
+
+    def _set_stats(self, prefix, section_timing, spider):
+        for name in ('count', 'seconds', 'max_seconds'):
+            self.stats.set_value(f'{prefix}/{name}', section_timing[name], spider=spider)
+
+    def report_path(self, spider):
+        """ returns the path of the timing report of 'spider' """
+
+        file_name = f'{spider.name}.json' if self.worker is None else f'{spider.name}.{self.worker}.json'
+        return pathlib.Path(self.report_dir, file_name)
+
+
+class MetricsExtension():
+    """ extension samples the throughput, download latency, scheduler queue
+    and memory of a crawl every METRICS_INTERVAL seconds, and writes the
+    samples to a json-lines file and a Prometheus textfile
+    (see edscrapers.scrapers.base.metrics)
+
+    Settings:
+    - METRICS_ENABLED: enable this extension. default is True
+    - METRICS_INTERVAL: seconds between two samples. default is 10
+    - METRICS_DIR: the directory of the metrics files. default is ED_OUTPUT_PATH/metrics """
+
+    def __init__(self, crawler, interval=10.0, directory=None, worker=None):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = interval
+        self.directory = directory
+        self.worker = worker # the worker id, in worker mode
+        self.writer = None
+        self.task = None
+        self.latency = dict() # download latency histogram of every host
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED', True):
+            raise NotConfigured
+        interval = settings.getfloat('METRICS_INTERVAL', 10.0)
+        if interval <= 0:
+            raise NotConfigured
+
+        worker = None
+        if settings.getbool('FRONTIER_ENABLED'):
+            from edscrapers.scrapers.base.frontier import worker_id
+            worker = worker_id(settings)
+        extension = cls(crawler, interval=interval, directory=settings.get('METRICS_DIR'), worker=worker)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        return extension
+
+    def spider_opened(self, spider):
+        self.started = datetime.now()
+        self.start = self.last_time = time.monotonic()
+        self.last_counts = (0, 0, 0) # pages, items and bytes at the last sample
+        self.writer = metrics.MetricsWriter(spider.name, directory=self.directory,
+                                            worker=self.worker, started=self.started)
+        self.task = task.LoopingCall(self.sample, spider)
+        self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        if self.writer is not None:
+            self.sample(spider, final=True)
+            spider.logger.info(f'Crawl metrics written to {self.writer.jsonl_path}')
+
+    def response_received(self, response, request, spider):
+        # the responses of the http cache were not downloaded
+        if 'cached' in response.flags:
+            return
+        latency = request.meta.get('download_latency')
+        if latency is None:
+            return
+        host = urlparse(response.url).netloc
+        histogram = self.latency.get(host)
+        if histogram is None:
+            histogram = self.latency[host] = metrics.Histogram()
+        histogram.observe(latency)
+
+    def sample(self, spider, final=False):
+        """ takes a sample of the crawl and writes it to the metrics files """
+
+        now = time.monotonic()
+        counts = (self.stats.get_value('response_received_count', 0, spider=spider),
+                  self.stats.get_value('item_scraped_count', 0, spider=spider),
+                  self.stats.get_value('downloader/response_bytes', 0, spider=spider))
+        seconds = now - self.last_time
+        rates = [round((count - last_count) / seconds, 3) if seconds > 0 else 0.0
+                 for count, last_count in zip(counts, self.last_counts)]
+        self.last_time, self.last_counts = now, counts
+
+        rss_bytes, max_rss_bytes = metrics.memory_usage()
+        scheduler_queue, in_progress = self._queues()
+        sample = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'spider': spider.name,
+            'worker': self.worker,
+            'elapsed': round(now - self.start, 3),
+            'pages': counts[0],
+            'items': counts[1],
+            'bytes': counts[2],
+            'pages_per_sec': rates[0],
+            'items_per_sec': rates[1],
+            'bytes_per_sec': rates[2],
+            'scheduler_queue': scheduler_queue,
+            'in_progress': in_progress,
+            'rss_bytes': rss_bytes,
+            'max_rss_bytes': max_rss_bytes,
+            'latency': {host: histogram.to_dict() for host, histogram in self.latency.items()},
+        }
+        if final:
+            # the whole run, and the scrapy stats (which are only logged with -v)
+            sample['final'] = True
+            sample['avg_pages_per_sec'] = round(counts[0] / sample['elapsed'], 3) if sample['elapsed'] else 0.0
+            sample['avg_items_per_sec'] = round(counts[1] / sample['elapsed'], 3) if sample['elapsed'] else 0.0
+            sample['stats'] = self.stats.get_stats(spider)
+        try:
+            self.writer.write(sample)
+        except OSError as exc:
+            spider.logger.error(f'Could not write the crawl metrics: {exc}')
+
+    def _queues(self):
+        """ returns the (scheduler queue size, requests being downloaded) of
+        the crawl, or None for the numbers which are not available """
+
+        engine = self.crawler.engine
+        slot = getattr(engine, 'slot', None) if engine is not None else None
+        if slot is None: # the engine is not running
+            return None, None
+        try:
+            scheduler_queue = len(slot.scheduler)
+        except TypeError:
+            scheduler_queue = None
+        return scheduler_queue, len(engine.downloader.active)
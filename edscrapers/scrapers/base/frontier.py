@@ -0,0 +1,647 @@
+""" module provides the shared crawl frontier, so several worker processes
+(`eds scrape NAME --worker`, on one or several machines) can split one big crawl.
+
+Every worker runs the same spider with the `FrontierScheduler` and the
+`FrontierDupeFilter`. Instead of keeping its requests in memory (or in its
+JOBDIR), a worker pushes them to the frontier shared by all the workers of
+the crawl, and claims the requests it downloads from it in small batches.
+The requests seen by any worker are kept in a shared seen-set, so every page
+is crawled by a single worker, and so are the datasets scraped by any worker
+(see `FrontierSeenSet`), so every dataset is written once. The workers write to the common output
+directory, and every worker writes a crawl graph of its own, which
+`eds merge-graphs NAME` merges into the graph of the crawl (see `merge_graphs()` in
+scrapers/base/graph.py). The SQLite stores of the crawl (the resource metadata
+cache, the incremental page store and the lookup memos) are shared by the workers
+as well: they commit every write on its own, so a worker never holds a write lock
+another worker waits for.
+
+The frontier is selected with FRONTIER_URL:
+- an SQLite file ('sqlite:///path/to/frontier.sqlite' or just a path, the
+  default is ED_OUTPUT_PATH/scrapy/frontier.sqlite), for the workers of a single machine
+- a Redis server ('redis://host:port/db'), for workers on several machines.
+  This requires the optional 'redis' package (pip install redis)
+
+A worker is done when the frontier is empty and no other worker is busy
+(as a busy worker may still push requests). The last worker to finish
+marks the crawl finished, and the next worker to start begins a new crawl.
+When workers are interrupted, the crawl is resumed by starting workers again:
+the requests claimed (but not yet downloaded) by a worker which has not been
+heard of for FRONTIER_WORKER_TIMEOUT seconds are put back in the frontier.
+Like a resumed scrapy crawl (JOBDIR), the pages a worker had downloaded but
+not yet parsed when it was killed are not crawled again """
+
+import os
+import time
+import pickle
+import socket
+import hashlib
+import sqlite3
+import pathlib
+from collections import deque
+
+from scrapy import signals
+from scrapy.core.scheduler import Scheduler
+from scrapy.utils.reqser import request_to_dict, request_from_dict
+
+from edscrapers.scrapers.base.canonical import CanonicalDupeFilter
+
+# default location of the SQLite frontier
+DEFAULT_PATH = os.path.join(os.getenv('ED_OUTPUT_PATH', '.'), 'scrapy', 'frontier.sqlite')
+
+# default number of requests claimed (and pushed) at a time by a worker
+DEFAULT_BATCH_SIZE = 16
+# default number of seconds after which a silent worker is considered dead
+DEFAULT_WORKER_TIMEOUT = 600.0
+# number of seconds between the heartbeats of a busy worker
+HEARTBEAT_INTERVAL = 10.0
+
+# the states of a crawl
+RUNNING = 'running'
+FINISHED = 'finished'
+
+# meta key holding the frontier id of a claimed request
+FRONTIER_KEY = 'frontier_id'
+
+
+def worker_id(settings=None):
+    """ function returns the id of this worker: the FRONTIER_WORKER_ID
+    setting or, by default, '<host name>-<process id>' """
+
+    if settings is not None and settings.get('FRONTIER_WORKER_ID'):
+        return str(settings.get('FRONTIER_WORKER_ID'))
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def open_frontier(url, crawl, worker, worker_timeout=DEFAULT_WORKER_TIMEOUT):
+    """ function returns the frontier at 'url' (see the module documentation)
+    for the worker 'worker' of the crawl 'crawl' (i.e. the spider name) """
+
+    url = url or DEFAULT_PATH
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisFrontier(url, crawl, worker, worker_timeout)
+    if url.startswith('sqlite://'):
+        url = url[len('sqlite://'):]
+    return SQLiteFrontier(url, crawl, worker, worker_timeout)
+
+
+class SQLiteFrontier():
+    """ class represents a crawl frontier kept in an SQLite file (in WAL mode,
+    so the workers read it while one of them writes) """
+
+    def __init__(self, path, crawl, worker, worker_timeout=DEFAULT_WORKER_TIMEOUT):
+        self.path = path
+        self.crawl = crawl
+        self.worker = worker
+        self.worker_timeout = worker_timeout
+
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # the transactions are explicit (isolation_level=None), and 'BEGIN IMMEDIATE'
+        # takes the write lock up front, so two workers never claim the same requests
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS crawls (
+                crawl TEXT PRIMARY KEY,
+                status TEXT,
+                started_at REAL);
+            CREATE TABLE IF NOT EXISTS queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                crawl TEXT,
+                priority INTEGER,
+                request BLOB,
+                worker TEXT,
+                claimed_at REAL);
+            CREATE INDEX IF NOT EXISTS queue_pending ON queue (crawl, worker, priority DESC, id);
+            CREATE TABLE IF NOT EXISTS seen (
+                crawl TEXT,
+                fingerprint TEXT,
+                PRIMARY KEY (crawl, fingerprint)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS seen_datasets (
+                crawl TEXT,
+                key TEXT,
+                PRIMARY KEY (crawl, key)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS workers (
+                crawl TEXT,
+                worker TEXT,
+                heartbeat REAL,
+                busy INTEGER,
+                PRIMARY KEY (crawl, worker));''')
+
+    def _transaction(self, statements):
+        """ runs the (sql, parameters) 'statements' in a single write transaction.
+        Returns the cursor of the last statement """
+
+        cursor = None
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, parameters in statements:
+                cursor = self.connection.execute(sql, parameters)
+        except Exception:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+        return cursor
+
+    def open(self):
+        """ registers the worker with the crawl, starting a new crawl if
+        the previous one is finished. Returns True if the worker
+        joins (or resumes) an unfinished crawl """
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        row = self.connection.execute('SELECT status FROM crawls WHERE crawl = ?',
+                                      (self.crawl,)).fetchone()
+        joined = row is not None and row[0] == RUNNING
+        if not joined:
+            for table in ('queue', 'seen', 'seen_datasets', 'workers'):
+                self.connection.execute(f'DELETE FROM {table} WHERE crawl = ?', (self.crawl,))
+            self.connection.execute('INSERT OR REPLACE INTO crawls (crawl, status, started_at) '
+                                    'VALUES (?, ?, ?)', (self.crawl, RUNNING, time.time()))
+        self.connection.execute('INSERT OR REPLACE INTO workers (crawl, worker, heartbeat, busy) '
+                                'VALUES (?, ?, ?, 1)', (self.crawl, self.worker, time.time()))
+        self.connection.execute('COMMIT')
+        return joined
+
+    def seen(self, fingerprint):
+        """ adds 'fingerprint' to the seen-set. Returns True if it was already there """
+
+        cursor = self._transaction([('INSERT OR IGNORE INTO seen (crawl, fingerprint) VALUES (?, ?)',
+                                     (self.crawl, fingerprint))])
+        return cursor.rowcount == 0
+
+    def dataset_seen(self, key):
+        """ adds 'key' to the seen-set of the datasets. Returns True if it was already there """
+
+        cursor = self._transaction([('INSERT OR IGNORE INTO seen_datasets (crawl, key) VALUES (?, ?)',
+                                     (self.crawl, key))])
+        return cursor.rowcount == 0
+
+    def push(self, requests):
+        """ adds the (priority, serialized request) 'requests' to the frontier """
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.connection.executemany('INSERT INTO queue (crawl, priority, request) VALUES (?, ?, ?)',
+                                    [(self.crawl, priority, data) for priority, data in requests])
+        self.connection.execute('COMMIT')
+
+    def claim(self, count):
+        """ claims (at most) 'count' requests for the worker, the highest priority
+        first. Returns a list of (frontier id, serialized request) """
+
+        now = time.time()
+        self.connection.execute('BEGIN IMMEDIATE')
+        rows = self.connection.execute('''SELECT id, request FROM queue
+                                          WHERE crawl = ? AND worker IS NULL
+                                          ORDER BY priority DESC, id LIMIT ?''',
+                                       (self.crawl, count)).fetchall()
+        if rows:
+            self.connection.executemany('UPDATE queue SET worker = ?, claimed_at = ? WHERE id = ?',
+                                        [(self.worker, now, row[0]) for row in rows])
+            # a worker with claimed requests is busy (it may push more requests)
+            self.connection.execute('INSERT OR REPLACE INTO workers (crawl, worker, heartbeat, busy) '
+                                    'VALUES (?, ?, ?, 1)', (self.crawl, self.worker, now))
+        self.connection.execute('COMMIT')
+        return [(row[0], bytes(row[1])) for row in rows]
+
+    def done(self, frontier_ids):
+        """ removes the requests the worker is done with from the frontier """
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.connection.executemany('DELETE FROM queue WHERE id = ? AND worker = ?',
+                                    [(frontier_id, self.worker) for frontier_id in frontier_ids])
+        self.connection.execute('COMMIT')
+
+    def unclaim(self, frontier_ids):
+        """ puts requests claimed by the worker back in the frontier """
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.connection.executemany('UPDATE queue SET worker = NULL, claimed_at = NULL '
+                                    'WHERE id = ? AND worker = ?',
+                                    [(frontier_id, self.worker) for frontier_id in frontier_ids])
+        self.connection.execute('COMMIT')
+
+    def heartbeat(self, busy=None):
+        """ records that the worker is alive (and, unless 'busy' is None, whether it is busy) """
+
+        if busy is None:
+            self._transaction([('UPDATE workers SET heartbeat = ? WHERE crawl = ? AND worker = ?',
+                                (time.time(), self.crawl, self.worker))])
+            return
+        self._transaction([('INSERT OR REPLACE INTO workers (crawl, worker, heartbeat, busy) '
+                            'VALUES (?, ?, ?, ?)', (self.crawl, self.worker, time.time(), int(busy)))])
+
+    def release(self):
+        """ removes whatever the (idle) worker has left claimed from the frontier
+        (e.g. requests dropped by a downloader middleware) and marks the worker idle """
+
+        self._transaction([('DELETE FROM queue WHERE crawl = ? AND worker = ?', (self.crawl, self.worker)),
+                           ('INSERT OR REPLACE INTO workers (crawl, worker, heartbeat, busy) '
+                            'VALUES (?, ?, ?, 0)', (self.crawl, self.worker, time.time()))])
+
+    def has_pending(self):
+        """ checks if the frontier has requests waiting to be claimed """
+
+        return self.connection.execute('SELECT 1 FROM queue WHERE crawl = ? AND worker IS NULL LIMIT 1',
+                                       (self.crawl,)).fetchone() is not None
+
+    def pending_count(self):
+        """ returns the number of requests waiting to be claimed """
+
+        return self.connection.execute('SELECT COUNT(*) FROM queue WHERE crawl = ? AND worker IS NULL',
+                                       (self.crawl,)).fetchone()[0]
+
+    def busy_workers(self):
+        """ returns the number of other workers which are busy (and alive) """
+
+        return self.connection.execute('''SELECT COUNT(*) FROM workers
+                                          WHERE crawl = ? AND worker != ? AND busy = 1
+                                          AND heartbeat >= ?''',
+                                       (self.crawl, self.worker,
+                                        time.time() - self.worker_timeout)).fetchone()[0]
+
+    def requeue_dead(self):
+        """ puts the requests claimed by dead workers back in the frontier.
+        Returns the number of requests put back """
+
+        deadline = time.time() - self.worker_timeout
+        self.connection.execute('BEGIN IMMEDIATE')
+        dead = [row[0] for row in self.connection.execute(
+                    'SELECT worker FROM workers WHERE crawl = ? AND worker != ? AND heartbeat < ?',
+                    (self.crawl, self.worker, deadline)).fetchall()]
+        requeued = 0
+        for worker in dead:
+            requeued += self.connection.execute('UPDATE queue SET worker = NULL, claimed_at = NULL '
+                                                'WHERE crawl = ? AND worker = ?',
+                                                (self.crawl, worker)).rowcount
+            self.connection.execute('DELETE FROM workers WHERE crawl = ? AND worker = ?',
+                                    (self.crawl, worker))
+        self.connection.execute('COMMIT')
+        return requeued
+
+    def finish(self):
+        """ marks the crawl finished (the next worker to start begins a new crawl) """
+
+        self._transaction([('UPDATE crawls SET status = ? WHERE crawl = ?', (FINISHED, self.crawl))])
+
+    def leave(self, requeue=False):
+        """ unregisters the worker. With 'requeue', the requests it
+        has claimed are put back in the frontier """
+
+        statements = [('DELETE FROM workers WHERE crawl = ? AND worker = ?', (self.crawl, self.worker))]
+        if requeue:
+            statements.insert(0, ('UPDATE queue SET worker = NULL, claimed_at = NULL '
+                                  'WHERE crawl = ? AND worker = ?', (self.crawl, self.worker)))
+        self._transaction(statements)
+
+    def close(self):
+        self.connection.close()
+
+
+class RedisFrontier():
+    """ class represents a crawl frontier kept on a Redis server, so workers
+    on several machines can share it. The keys of a crawl are prefixed
+    with 'edscrapers:frontier:<crawl>:' """
+
+    def __init__(self, url, crawl, worker, worker_timeout=DEFAULT_WORKER_TIMEOUT):
+        self.url = url
+        self.crawl = crawl
+        self.worker = worker
+        self.worker_timeout = worker_timeout
+        self.redis = _redis().Redis.from_url(url)
+
+        prefix = f'edscrapers:frontier:{crawl}:'
+        self.status_key = prefix + 'status'
+        self.counter_key = prefix + 'counter' # gives every request a unique id
+        self.queue_key = prefix + 'queue' # sorted set of the requests waiting to be claimed
+        self.requests_key = prefix + 'requests' # hash of the serialized requests, by id
+        self.seen_key = prefix + 'seen' # set of the seen fingerprints
+        self.seen_datasets_key = prefix + 'seen_datasets' # set of the keys of the seen datasets
+        self.workers_key = prefix + 'workers' # hash of the worker heartbeats
+        self.busy_key = prefix + 'busy' # set of the busy workers
+        self.claims_prefix = prefix + 'claims:' # sets of the ids claimed by every worker
+
+    def _claims_key(self, worker=None):
+        return self.claims_prefix + (worker or self.worker)
+
+    def open(self):
+        joined = self.redis.get(self.status_key) == RUNNING.encode()
+        if not joined:
+            keys = [self.counter_key, self.queue_key, self.requests_key, self.seen_key,
+                    self.seen_datasets_key, self.workers_key, self.busy_key] + list(self.redis.scan_iter(self.claims_prefix + '*'))
+            self.redis.delete(*keys)
+            self.redis.set(self.status_key, RUNNING)
+        self.heartbeat(busy=True)
+        return joined
+
+    def seen(self, fingerprint):
+        return self.redis.sadd(self.seen_key, fingerprint) == 0
+
+    def dataset_seen(self, key):
+        return self.redis.sadd(self.seen_datasets_key, key) == 0
+
+    def push(self, requests):
+        first_id = self.redis.incrby(self.counter_key, len(requests)) - len(requests) + 1
+        pipeline = self.redis.pipeline()
+        scores = dict()
+        for frontier_id, (priority, data) in enumerate(requests, start=first_id):
+            pipeline.hset(self.requests_key, frontier_id, data)
+            # the highest priority first, then the oldest request first
+            scores[frontier_id] = -priority * 1e12 + frontier_id
+        pipeline.zadd(self.queue_key, scores)
+        pipeline.execute()
+
+    def claim(self, count):
+        popped = [int(member) for member, _ in self.redis.zpopmin(self.queue_key, count)]
+        pipeline = self.redis.pipeline()
+        if popped:
+            pipeline.sadd(self._claims_key(), *popped)
+            pipeline.sadd(self.busy_key, self.worker)
+        pipeline.hset(self.workers_key, self.worker, time.time())
+        pipeline.execute()
+        if not popped:
+            return []
+        return list(zip(popped, self.redis.hmget(self.requests_key, popped)))
+
+    def done(self, frontier_ids):
+        pipeline = self.redis.pipeline()
+        pipeline.srem(self._claims_key(), *frontier_ids)
+        pipeline.hdel(self.requests_key, *frontier_ids)
+        pipeline.execute()
+
+    def _requeue(self, worker, frontier_ids=None):
+        if frontier_ids is None:
+            frontier_ids = [int(member) for member in self.redis.smembers(self._claims_key(worker))]
+        if not frontier_ids:
+            return 0
+        # the requeued requests are claimed before any other
+        pipeline = self.redis.pipeline()
+        pipeline.srem(self._claims_key(worker), *frontier_ids)
+        pipeline.zadd(self.queue_key, {frontier_id: -1e15 + frontier_id for frontier_id in frontier_ids})
+        pipeline.execute()
+        return len(frontier_ids)
+
+    def unclaim(self, frontier_ids):
+        self._requeue(self.worker, list(frontier_ids))
+
+    def heartbeat(self, busy=None):
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self.workers_key, self.worker, time.time())
+        if busy is True:
+            pipeline.sadd(self.busy_key, self.worker)
+        elif busy is False:
+            pipeline.srem(self.busy_key, self.worker)
+        pipeline.execute()
+
+    def release(self):
+        frontier_ids = list(self.redis.smembers(self._claims_key()))
+        if frontier_ids:
+            self.done(frontier_ids)
+        self.heartbeat(busy=False)
+
+    def has_pending(self):
+        return self.redis.zcard(self.queue_key) > 0
+
+    def pending_count(self):
+        return self.redis.zcard(self.queue_key)
+
+    def _live_workers(self):
+        deadline = time.time() - self.worker_timeout
+        return {worker.decode(): float(heartbeat) >= deadline
+                for worker, heartbeat in self.redis.hgetall(self.workers_key).items()}
+
+    def busy_workers(self):
+        busy = {worker.decode() for worker in self.redis.smembers(self.busy_key)}
+        return sum(1 for worker, alive in self._live_workers().items()
+                   if alive and worker != self.worker and worker in busy)
+
+    def requeue_dead(self):
+        requeued = 0
+        for worker, alive in self._live_workers().items():
+            if not alive and worker != self.worker:
+                requeued += self._requeue(worker)
+                self.redis.hdel(self.workers_key, worker)
+                self.redis.srem(self.busy_key, worker)
+        return requeued
+
+    def finish(self):
+        self.redis.set(self.status_key, FINISHED)
+
+    def leave(self, requeue=False):
+        if requeue:
+            self._requeue(self.worker)
+        self.redis.hdel(self.workers_key, self.worker)
+        self.redis.srem(self.busy_key, self.worker)
+
+    def close(self):
+        self.redis.close()
+
+
+def _redis():
+    """ function returns the (optional) redis module """
+
+    try:
+        import redis
+    except ImportError:
+        raise ValueError("a 'redis://' FRONTIER_URL requires the 'redis' package (pip install redis)")
+    return redis
+
+
+class FrontierSeenSet():
+    """ class represents the seen-set of the datasets shared by all the workers
+    of a crawl, kept in their frontier. It is used like the seen-sets of
+    scrapers/base/seen.py by the DuplicatesPipeline of a worker. The keys are
+    kept as 64 bit hashes, like in an exact seen-set """
+
+    def __init__(self, frontier):
+        self.frontier = frontier
+        self.count = 0 # the keys added by this worker
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key):
+        """ adds 'key' to the seen-set. Returns True if it was already seen (by any worker) """
+
+        key_hash = hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+        seen = self.frontier.dataset_seen(key_hash)
+        if not seen:
+            self.count += 1
+        return seen
+
+    def close(self):
+        pass # the frontier is closed by the FrontierScheduler
+
+
+class FrontierDupeFilter(CanonicalDupeFilter):
+    """ dupefilter which checks the requests against the seen-set shared by
+    all the workers of the crawl (once bound to the frontier by the
+    `FrontierScheduler`). The fingerprints this worker has already
+    checked are also kept in memory, so they are not checked again.
+    Like the CanonicalDupeFilter, the requests are fingerprinted by their
+    canonical url (see scrapers/base/canonical.py) """
+
+    def __init__(self, path=None, debug=False):
+        # the seen-set is kept in the frontier, not in the JOBDIR
+        super().__init__(None, debug)
+        self.frontier = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(debug=settings.getbool('DUPEFILTER_DEBUG'))
+
+    def bind(self, frontier):
+        """ makes the dupefilter check the requests against the seen-set of 'frontier' """
+        self.frontier = frontier
+
+    def request_seen(self, request):
+        fingerprint = self.request_fingerprint(request)
+        if fingerprint in self.fingerprints:
+            self.count_saved(fingerprint, request)
+            return True
+        self.add_fingerprint(fingerprint, request)
+        if self.frontier is None:
+            return False
+        return self.frontier.seen(fingerprint)
+
+
+class FrontierScheduler(Scheduler):
+    """ scrapy scheduler which keeps the requests of the crawl in the shared
+    frontier (see the module documentation).
+
+    The requests are pushed to the frontier in batches of FRONTIER_BATCH_SIZE,
+    and claimed from it in batches of the same size. Requests which can not
+    be serialized (e.g. with a callback which is not a spider method) are
+    kept in memory, like the scrapy scheduler does. The frontier stats are
+    recorded as 'scheduler/enqueued/frontier', 'scheduler/dequeued/frontier'
+    and 'frontier/...' """
+
+    def __init__(self, dupefilter, jobdir=None, crawler=None, **kwargs):
+        # the frontier is persistent, so there is no disk queue (JOBDIR)
+        super().__init__(dupefilter, jobdir=None, crawler=crawler, **kwargs)
+        settings = crawler.settings
+        self.frontier_url = settings.get('FRONTIER_URL') or DEFAULT_PATH
+        self.worker = worker_id(settings)
+        self.batch_size = max(1, settings.getint('FRONTIER_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+        self.worker_timeout = settings.getfloat('FRONTIER_WORKER_TIMEOUT', DEFAULT_WORKER_TIMEOUT)
+        self.frontier = None
+        self.claimed = deque() # claimed (frontier id, serialized request), not yet handed to the engine
+        self.pushes = [] # (priority, serialized request) not yet pushed to the frontier
+        self.done_ids = [] # frontier ids of the requests this worker is done with
+        self._last_heartbeat = 0.0
+
+    def open(self, spider):
+        self.spider = spider
+        self.mqs = self._mq()
+        self.dqs = None
+        self.frontier = open_frontier(self.frontier_url, spider.name, self.worker, self.worker_timeout)
+        joined = self.frontier.open()
+        requeued = self.frontier.requeue_dead()
+        self.stats.set_value('frontier/worker', self.worker, spider=spider)
+        self.stats.inc_value('frontier/requeued', requeued, spider=spider)
+        spider.logger.info(f"Worker {self.worker} {'joined' if joined else 'started'} "
+                           f"the {spider.name} crawl ({self.frontier.pending_count()} requests in the frontier)")
+
+        if isinstance(self.df, FrontierDupeFilter):
+            self.df.bind(self.frontier)
+        self.crawler.signals.connect(self._request_done, signal=signals.response_received)
+        self.crawler.signals.connect(self._request_done, signal=signals.request_left_downloader)
+        return self.df.open()
+
+    def close(self, reason):
+        self._sync()
+        if reason != 'finished':
+            # interrupted: the requests this worker claimed go back to the frontier
+            self.frontier.unclaim([frontier_id for frontier_id, _ in self.claimed])
+        self.frontier.leave(requeue=reason != 'finished')
+        self.frontier.close()
+        return self.df.close(reason)
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        try:
+            data = pickle.dumps(request_to_dict(request, self.spider), protocol=4)
+        except (ValueError, TypeError, AttributeError, pickle.PicklingError) as exc:
+            if self.logunser:
+                self.spider.logger.warning(f'Unable to serialize request {request} ({exc}), '
+                                           f'keeping it in memory')
+                self.logunser = False
+            self.stats.inc_value('scheduler/unserializable', spider=self.spider)
+            self._mqpush(request)
+            self.stats.inc_value('scheduler/enqueued/memory', spider=self.spider)
+        else:
+            self.pushes.append((request.priority, data))
+            if len(self.pushes) >= self.batch_size:
+                self._sync()
+            self.stats.inc_value('scheduler/enqueued/frontier', spider=self.spider)
+        self.stats.inc_value('scheduler/enqueued', spider=self.spider)
+        return True
+
+    def next_request(self):
+        request = self.mqs.pop()
+        if request:
+            self.stats.inc_value('scheduler/dequeued/memory', spider=self.spider)
+            self.stats.inc_value('scheduler/dequeued', spider=self.spider)
+            return request
+
+        if not self.claimed:
+            self._sync()
+            self.claimed.extend(self.frontier.claim(self.batch_size))
+            self._last_heartbeat = time.monotonic()
+        if not self.claimed:
+            return None
+
+        frontier_id, data = self.claimed.popleft()
+        request = request_from_dict(pickle.loads(data), self.spider)
+        request.meta[FRONTIER_KEY] = frontier_id
+        self.stats.inc_value('scheduler/dequeued/frontier', spider=self.spider)
+        self.stats.inc_value('scheduler/dequeued', spider=self.spider)
+        return request
+
+    def __len__(self):
+        return len(self.mqs) + len(self.claimed) + len(self.pushes)
+
+    def has_pending_requests(self):
+        if len(self):
+            return True
+        self._sync()
+        if self.frontier.has_pending():
+            return True
+
+        engine = self.crawler.engine
+        if engine.downloader.active or not engine.scraper.slot.is_idle():
+            return True
+        # this worker is idle: it is done with every request it claimed
+        self.frontier.release()
+        self.done_ids = []
+        if self.frontier.requeue_dead():
+            return True
+        if self.frontier.busy_workers():
+            # the busy workers may still push requests, so wait for them
+            self.stats.inc_value('frontier/idle_waits', spider=self.spider)
+            return True
+        self.frontier.finish()
+        return False
+
+    def _request_done(self, request, spider, response=None):
+        frontier_id = request.meta.get(FRONTIER_KEY)
+        if frontier_id is not None and spider is self.spider:
+            self.done_ids.append(frontier_id)
+            if len(self.done_ids) >= self.batch_size:
+                self._sync()
+
+    def _sync(self):
+        """ pushes the waiting requests to the frontier, removes the requests
+        this worker is done with and, every HEARTBEAT_INTERVAL, records that the worker is alive """
+
+        if self.pushes:
+            self.frontier.push(self.pushes)
+            self.stats.inc_value('frontier/pushed', len(self.pushes), spider=self.spider)
+            self.pushes = []
+        if self.done_ids:
+            self.frontier.done(self.done_ids)
+            self.done_ids = []
+        if time.monotonic() - self._last_heartbeat > HEARTBEAT_INTERVAL:
+            self.frontier.heartbeat()
+            self._last_heartbeat = time.monotonic()
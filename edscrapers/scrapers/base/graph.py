@@ -1,95 +1,421 @@
 """ module contains necessary classes and functions for
 the graphs used by edscrapers """
 
+import time
+import contextlib
 from pathlib import Path
 import multiprocessing as mp
-from datetime import datetime
 
 import igraph
 import pandas as pd
 
+from edscrapers.scrapers.base import exports
+from edscrapers.scrapers.base import timing
+
+# the graph of every worker of a crawl is written to '<name>.worker-<worker id>.pickle'
+WORKER_GRAPH_INFIX = '.worker-'
+
+class ScraperGraph(igraph.Graph):
+    """ class represents the (directed) graph of a crawl.
+
+    igraph looks vertices up by name (e.g. `graph.vs.find(name=url)`) with a
+    scan of all the vertices. A crawl looks up the vertex of every response and
+    every dataset, so on large crawls (hundreds of thousands of vertices) the
+    lookups would make the crawl slower as it grows.
+    This graph keeps a hash index of vertex names, which is kept in sync when
+    vertices are added or deleted. Use `find_vertex()` to look a vertex up
+    by name. `add_edge()` and `add_edges()` resolve vertex names with the index.
+
+    NOTE: vertex names must only be set through `add_vertex()`, as the index
+    is not updated when the 'name' attribute of a vertex is changed directly
+
+    igraph also does work proportional to the size of the graph for every
+    `add_vertices()`/`add_edges()` call, however few vertices/edges are added.
+    So the crawl stages its vertices and edges with `stage_vertex()` and
+    `stage_edge()`, which only buffer them, and `flush()` adds the buffered
+    vertices and edges with a single `add_vertices()` and `add_edges()` call.
+    Staged vertices get their final index straight away and are found by
+    `find_vertex()` (as a `StagedVertex`). Every other method which changes
+    the graph flushes it first, but reading the graph directly (e.g. `graph.vs`)
+    does not, so call `flush()` before doing so """
+
+    def __init__(self, *args, **kwds):
+        super().__init__(*args, **kwds)
+        self.rebuild_name_index()
+        self._staged_vertices = [] # attribute dicts of the staged vertices
+        self._staged_edges = [] # (source index, target index) of the staged edges
+        self._last_flush = time.monotonic()
+        # the flushes done so far, recorded in the crawl stats (see GraphMiddleWare)
+        self.flush_stats = {'flushes': 0, 'vertices': 0, 'edges': 0,
+                            'seconds': 0.0, 'max_seconds': 0.0}
+
+    def __reduce__(self):
+        """ support for pickling. The name index is not pickled, it is
+        rebuilt when the graph is loaded. Neither is the lock attached to the graph """
+
+        self.flush()
+        constructor, parameters, state = super().__reduce__()
+        state = {key: value for key, value in state.items()
+                 if key not in ('_name_index', '_staged_vertices', '_staged_edges',
+                                '_last_flush', 'flush_stats', 'graph_lock')}
+        return (constructor, parameters, state)
+
+    @classmethod
+    def from_graph(cls, graph):
+        """ returns a ScraperGraph copy of the igraph.Graph 'graph' """
+
+        if isinstance(graph, ScraperGraph):
+            graph.flush()
+        return cls(graph.vcount(), graph.get_edgelist(), graph.is_directed(),
+                   {attr: graph[attr] for attr in graph.attributes()},
+                   {attr: graph.vs[attr] for attr in graph.vs.attribute_names()},
+                   {attr: graph.es[attr] for attr in graph.es.attribute_names()})
+
+    def rebuild_name_index(self):
+        """ (re)builds the name index from the vertices of the graph """
+
+        if 'name' in self.vs.attribute_names():
+            self._name_index = {name: index for index, name in enumerate(self.vs['name'])
+                                if name is not None}
+        else:
+            self._name_index = dict()
+
+    def vertex_index(self, name):
+        """ returns the index of the vertex called 'name' or None if there is no such vertex """
+        return self._name_index.get(name)
+
+    def find_vertex(self, name):
+        """ returns the vertex called 'name' (a `StagedVertex` if the vertex
+        is staged) or None if there is no such vertex """
+
+        index = self._name_index.get(name)
+        if index is None:
+            return None
+        if index >= self.vcount():
+            return StagedVertex(self, index)
+        return self.vs[index]
+
+    def has_vertex(self, name):
+        """ checks if the graph has a vertex called 'name' """
+        return name in self._name_index
+
+    def _resolve(self, vertex):
+        """ returns the index of 'vertex' (an index, a Vertex or a vertex name) """
+
+        if isinstance(vertex, str):
+            index = self._name_index.get(vertex)
+            if index is None:
+                raise ValueError(f"no such vertex: '{vertex}'")
+            return index
+        if isinstance(vertex, (igraph.Vertex, StagedVertex)):
+            return vertex.index
+        return vertex
+
+    def staged_attributes(self, index):
+        """ returns the attribute dict of the staged vertex 'index'
+        or None if the vertex is not (or no longer) staged """
+
+        position = index - self.vcount()
+        if 0 <= position < len(self._staged_vertices):
+            return self._staged_vertices[position]
+        return None
+
+    def staged_count(self):
+        """ returns the number of staged vertices and edges """
+        return len(self._staged_vertices) + len(self._staged_edges)
+
+    def stage_vertex(self, name=None, **kwds):
+        """ stages a vertex with the provided attributes.
+        Returns the vertex (as a `StagedVertex`) """
+
+        index = self.vcount() + len(self._staged_vertices)
+        attributes = dict(kwds, name=name)
+        self._staged_vertices.append(attributes)
+        if name is not None:
+            self._name_index[name] = index
+        return StagedVertex(self, index)
+
+    def stage_edge(self, source, target):
+        """ stages an edge between 'source' and 'target'
+        (an index, a vertex or a vertex name) """
+        self._staged_edges.append((self._resolve(source), self._resolve(target)))
+
+    def flush(self):
+        """ adds the staged vertices and edges to the graph """
+
+        if not self._staged_vertices and not self._staged_edges:
+            self._last_flush = time.monotonic()
+            return
+        start = time.perf_counter()
+        # take the staged vertices and edges first, so the
+        # graph methods called below see nothing staged
+        vertices, self._staged_vertices = self._staged_vertices, []
+        edges, self._staged_edges = self._staged_edges, []
+
+        if vertices:
+            first_index = self.vcount()
+            super().add_vertices(len(vertices))
+            added = self.vs[first_index:]
+            attribute_names = set()
+            for attributes in vertices:
+                attribute_names.update(attributes)
+            for attribute_name in attribute_names:
+                added[attribute_name] = [attributes.get(attribute_name) for attributes in vertices]
+        if edges:
+            super().add_edges(edges)
+
+        elapsed = time.perf_counter() - start
+        self._last_flush = time.monotonic()
+        self.flush_stats['flushes'] += 1
+        self.flush_stats['vertices'] += len(vertices)
+        self.flush_stats['edges'] += len(edges)
+        self.flush_stats['seconds'] += elapsed
+        self.flush_stats['max_seconds'] = max(self.flush_stats['max_seconds'], elapsed)
+
+    def maybe_flush(self, max_staged, max_interval):
+        """ flushes the graph if more than 'max_staged' vertices and edges are
+        staged or the last flush was more than 'max_interval' seconds ago.
+        Returns True if the graph was flushed """
+
+        if not self._staged_vertices and not self._staged_edges:
+            return False
+        if self.staged_count() >= max_staged or\
+            time.monotonic() - self._last_flush >= max_interval:
+            self.flush()
+            return True
+        return False
+
+    def add_vertex(self, name=None, **kwds):
+        self.flush()
+        vertex = super().add_vertex(name=name, **kwds)
+        if name is not None:
+            self._name_index[name] = vertex.index
+        return vertex
+
+    def add_vertices(self, n):
+        self.flush()
+        super().add_vertices(n)
+        if not isinstance(n, int):
+            # vertices were added by name
+            self.rebuild_name_index()
+
+    def add_edge(self, source, target, **kwds):
+        self.flush()
+        return super().add_edge(self._resolve(source), self._resolve(target), **kwds)
+
+    def add_edges(self, es):
+        self.flush()
+        super().add_edges([(self._resolve(source), self._resolve(target)) for source, target in es])
+
+    def delete_vertices(self, vertices):
+        self.flush()
+        super().delete_vertices(vertices)
+        # the remaining vertices are renumbered
+        self.rebuild_name_index()
+
+
+class StagedVertex():
+    """ class represents a vertex returned by `ScraperGraph.stage_vertex()`
+    and `ScraperGraph.find_vertex()`. Its attributes are read and set like
+    those of an igraph.Vertex, in the staging buffer until the graph is
+    flushed and in the graph afterwards """
+
+    __slots__ = ('graph', 'index')
+
+    def __init__(self, graph, index):
+        self.graph = graph
+        self.index = index
+
+    def _vertex(self):
+        return self.graph.vs[self.index]
+
+    def __getitem__(self, attribute_name):
+        attributes = self.graph.staged_attributes(self.index)
+        if attributes is None:
+            return self._vertex()[attribute_name]
+        if attribute_name not in attributes and attribute_name not in self.graph.vs.attribute_names():
+            raise KeyError(f"Attribute does not exist: '{attribute_name}'")
+        return attributes.get(attribute_name)
+
+    def __setitem__(self, attribute_name, value):
+        attributes = self.graph.staged_attributes(self.index)
+        if attributes is None:
+            self._vertex()[attribute_name] = value
+        else:
+            attributes[attribute_name] = value
+
+    def attribute_names(self):
+        attributes = self.graph.staged_attributes(self.index)
+        if attributes is None:
+            return self._vertex().attribute_names()
+        return sorted(set(self.graph.vs.attribute_names()).union(attributes))
+
+
+@contextlib.contextmanager
+def hold_lock(graph, stats=None, spider=None):
+    """ context manager which holds the lock attached to 'graph' and, if
+    scrapy 'stats' are provided, records how long the lock was waited for
+    and held ('graph/lock_wait_seconds', 'graph/lock_hold_seconds',
+    'graph/lock_hold_max_seconds' and 'graph/lock_holds').
+    With a 'spider', the waits and holds are also timed as the 'graph_lock.wait'
+    and 'graph_lock.hold' sections (see scrapers/base/timing.py) """
+
+    start = time.perf_counter()
+    with graph.graph_lock:
+        acquired = time.perf_counter()
+        try:
+            yield graph
+        finally:
+            released = time.perf_counter()
+    if stats is not None:
+        stats.inc_value('graph/lock_holds', spider=spider)
+        stats.inc_value('graph/lock_wait_seconds', count=acquired - start, start=0.0, spider=spider)
+        stats.inc_value('graph/lock_hold_seconds', count=released - acquired, start=0.0, spider=spider)
+        stats.max_value('graph/lock_hold_max_seconds', released - acquired, spider=spider)
+    if timing.enabled and spider is not None:
+        timing.record('graph_lock.wait', acquired - start, spider.name)
+        timing.record('graph_lock.hold', released - acquired, spider.name)
+
+
+def _merge_attribute(current_value, value):
+    """ function returns the merged value of a vertex attribute found in two graphs """
+
+    if current_value is None:
+        return value
+    if isinstance(current_value, set) and isinstance(value, set):
+        return current_value | value
+    return current_value
+
+
+def merge_graphs(graphs):
+    """ function merges crawl 'graphs' (e.g. the graphs of the workers of
+    a crawl, see scrapers/base/frontier.py) into a new ScraperGraph.
+
+    Vertices are merged by name. The attributes of a vertex found in several
+    graphs are taken from the first graph which has them set (so pages added
+    without a title by a worker get the title from the worker which crawled
+    them), except for sets (e.g. the datasets of a page), which are merged.
+    Edges found in several graphs are only added once. The vertex labels
+    (e.g. 'P12' or 'D40') are renumbered after the index of the merged vertices """
+
+    merged = ScraperGraph(directed=True)
+    edges = set()
+    for graph in graphs:
+        if isinstance(graph, ScraperGraph):
+            graph.flush()
+        attribute_names = graph.vs.attribute_names()
+        # the merged index of every vertex of 'graph'
+        indexes = []
+        for vertex in graph.vs:
+            attributes = {attribute_name: vertex[attribute_name] for attribute_name in attribute_names}
+            name = attributes.pop('name', None)
+            merged_vertex = merged.find_vertex(name) if name is not None else None
+            if merged_vertex is None:
+                merged_vertex = merged.stage_vertex(name=name, **attributes)
+                label = attributes.get('label')
+                if isinstance(label, str) and label[:1] in ('P', 'D') and label[1:].isdigit():
+                    merged_vertex['label'] = f"{label[0]}{merged_vertex.index}"
+            else:
+                for attribute_name, value in attributes.items():
+                    if attribute_name == 'label':
+                        continue
+                    current_value = merged_vertex[attribute_name]\
+                                    if attribute_name in merged_vertex.attribute_names() else None
+                    merged_vertex[attribute_name] = _merge_attribute(current_value, value)
+            indexes.append(merged_vertex.index)
+
+        for source, target in graph.get_edgelist():
+            edge = (indexes[source], indexes[target])
+            if edge not in edges:
+                edges.add(edge)
+                merged.stage_edge(*edge)
+    merged.flush()
+    return merged
+
+
 class GraphWrapper():
-    """ class provides the singleton
-    graph object to be used by a scraper or transformer.
+    """ class creates, loads and writes the graph objects
+    used by the scrapers and transformers.
+
+    Every spider (see `GraphItemPipeline.open_spider()`) and every transformer
+    run gets its own graph object from `create_graph()` or `load_graph()`,
+    so spiders and transformers running in the same process do not share
+    their graphs or their locks. The graph object is passed explicitly to
+    `write_graph()` and `create_graph_page_legend()`.
 
     All methods in this class are designed to be thread/process safe.
-    However, when using the singleton graph object provided by this class,
+    However, when using a graph object provided by this class,
     ALWAYS access the graph object from within the
-    Lock object (conveniently) attached to the singleton graph object """
+    Lock object (conveniently) attached to the graph object ('graph.graph_lock') """
 
-    graph = igraph.Graph(directed=True)
-        
-    # create a process Lock for the
-    # graph to ensure that accessing the graph is process/thread safe
-    # ALWAYS USE THE LOCK WHILE ACCESSING THE GRAPH
-    graph_lock = mp.Lock()
-    graph.graph_lock = graph_lock # make the proccess lock accessible from the graph object
-
-    # add the default base vertex
-    with graph.graph_lock:
-        graph.add_vertex(name='base_vertex', label='START', title='START POINT', color='orange', shape=1)
-    
+    @classmethod
+    def _attach_lock(cls, graph):
+        # create a process Lock for the
+        # graph to ensure that accessing the graph is process/thread safe
+        # ALWAYS USE THE LOCK WHILE ACCESSING THE GRAPH
+        graph.graph_lock = mp.Lock()
+        return graph
 
     @classmethod
-    def get_graph(cls):
-        """ returns the singleton graph object """
+    def create_graph(cls):
+        """ returns a new graph object, holding the default base vertex """
 
-        with cls.graph_lock:
-            return cls.graph
+        graph = cls._attach_lock(ScraperGraph(directed=True))
+        # add the default base vertex
+        with graph.graph_lock:
+            graph.add_vertex(name='base_vertex', label='START', title='START POINT', color='orange', shape=1)
+        return graph
 
     @classmethod
-    def write_graph(cls, file_dir_path, file_stem_name,
+    def write_graph(cls, graph, file_dir_path, file_stem_name,
                     graph_width=2800, graph_height=2800,
-                    vertex_size=32, font_size=26):
-        """ write the graph to files """
+                    vertex_size=32, font_size=26,
+                    formats=None, background=None, svg_max_vertices=None):
+        """ write 'graph' to files.
+
+        The latest graph is always written to '<file_stem_name>.pickle' (the
+        file loaded by the transformers). The other exports ('formats', default
+        is GRAPH_EXPORT_FORMATS) are written by a background process unless
+        'background' is False (see scrapers/base/exports.py) """
+
+        formats = exports.export_formats(formats) # fail before writing anything
 
         # make the file directory if it doesn't already exist
         file_dir_path = Path(file_dir_path)
         file_dir_path.mkdir(parents=True, exist_ok=True) 
+        pickle_path = Path(file_dir_path, f'{file_stem_name}.pickle')
 
-        # make a dated directory (for storing all the dated output)
-        dated_dir_path = Path(file_dir_path,
-                          f'{datetime.now().year}-{datetime.now().month:02d}-{datetime.now().day:02d}')
-        dated_dir_path.mkdir(parents=True, exist_ok=True)
-
-        with cls.graph.graph_lock:
-            # destroy access to the lock object, so it's not pickled
-            del cls.graph.graph_lock
-            # write the graph to a dated file in the dated directory
-            cls.graph.write_pickle(fname=Path(dated_dir_path, 
-            f'{datetime.now().year}-{datetime.now().month:02d}-{datetime.now().day:02d}.{file_stem_name}.pickle'),
-            version=4)
+        with graph.graph_lock:
             # write the graph to a general file in 'file_dir_path'
-            # this general file will ALWAYS hold the latest graph
-            cls.graph.write_pickle(fname=Path(file_dir_path, 
-            f'{file_stem_name}.pickle'),
-            version=4)
-            # write the general file as svg
-            cls.graph.write_svg(fname=open(Path(file_dir_path, 
-                                                      f'{file_stem_name}.svg'), mode='wt'),
-                                            width=graph_width, height=graph_height,
-                                            vertex_size=vertex_size, font_size=font_size,
-                                            edge_colors=['black']*cls.graph.ecount(),
-                                            edge_stroke_widths=[4]*cls.graph.ecount())
-            
-            #reinstate the previously destroyed process lock since pickling is complete
-            cls.graph.graph_lock = cls.graph_lock
+            # this general file will ALWAYS hold the latest graph.
+            # NOTE: the staged vertices and edges are added, and the lock is
+            # left out, when pickling (see `ScraperGraph.__reduce__()`)
+            graph.write_pickle(fname=pickle_path, version=4)
+
+        # the other exports (e.g. the dated pickle and the svg) are made from the pickle
+        return exports.start_export(pickle_path, file_dir_path, file_stem_name,
+                                    formats=formats, background=background,
+                                    svg_max_vertices=svg_max_vertices,
+                                    graph_width=graph_width, graph_height=graph_height,
+                                    vertex_size=vertex_size, font_size=font_size)
 
     
     @classmethod
-    def create_graph_page_legend(cls, file_dir_path, file_stem_name):
-        """ create a csv that provides more details about the pages on the graph """
+    def create_graph_page_legend(cls, graph, file_dir_path, file_stem_name):
+        """ create a csv that provides more details about the pages on 'graph' """
 
         # create the file_dir_path if it doesn't already exist
         file_dir_path = Path(file_dir_path)
         file_dir_path.mkdir(parents=True, exist_ok=True)
 
-        with cls.graph.graph_lock:
+        with graph.graph_lock:
+            # add the vertices and edges still staged by the crawl
+            graph.flush()
             # get the VertexSequence for the pages we want to create legends for
             try:
-                vertex_seq = cls.graph.vs.select(is_dataset_eq=None) # get vertices NOT flagged as dataset
+                vertex_seq = graph.vs.select(is_dataset_eq=None) # get vertices NOT flagged as dataset
             except:
-                vertex_seq = cls.graph.vs # since no dataset vertex, select all the vertices
+                vertex_seq = graph.vs # since no dataset vertex, select all the vertices
                 
             # create a dataframe that will contain the info to be written to csv
             df = pd.DataFrame(columns=['Page Label', 'Page Title', 'Page URL'])
@@ -102,18 +428,38 @@ class GraphWrapper():
                       header=True, index=False)
 
     @classmethod
-    def load_graph(cls, file_dir_path, file_stem_name):
-        """ loads a graph from file into the singleton Graph object for this class """
+    def worker_stem_name(cls, file_stem_name, worker):
+        """ returns the file stem name of the graph of the worker 'worker' of a crawl """
+        return f'{file_stem_name}{WORKER_GRAPH_INFIX}{worker}'
 
+    @classmethod
+    def merge_worker_graphs(cls, file_dir_path, file_stem_name, keep=False, **write_options):
+        """ merges the graphs written by the workers of a crawl (see scrapers/base/frontier.py)
+        into the graph of the crawl, and writes it like `write_graph()` does.
+        Unless 'keep', the worker graphs are deleted once merged.
+        Returns the merged graph or None if there is no worker graph """
+
+        worker_paths = sorted(Path(file_dir_path).glob(f'{file_stem_name}{WORKER_GRAPH_INFIX}*.pickle'))
+        if not worker_paths:
+            return None
+        graph = cls._attach_lock(merge_graphs(igraph.Graph.Read_Pickle(fname=str(path))
+                                              for path in worker_paths))
+        cls.write_graph(graph, file_dir_path, file_stem_name, **write_options)
+        cls.create_graph_page_legend(graph, file_dir_path, file_stem_name)
+        if not keep:
+            for path in worker_paths:
+                path.unlink()
+        return graph
 
-        with cls.graph_lock:
-            # destroy access to the lock object, so the
-            # old graph object can be easily garbage collected
-            if getattr(cls.graph, 'graph_lock', None):
-                del cls.graph.graph_lock
-            # load the new graph object from the provided file
-            cls.graph = igraph.Graph.Read_Pickle(fname=Path(file_dir_path, 
-            f'{file_stem_name}.pickle'))
-            # attach the Lock object to the newly loaded graph object
-            cls.graph.graph_lock = cls.graph_lock
+    @classmethod
+    def load_graph(cls, file_dir_path, file_stem_name):
+        """ loads a graph from file and returns it as a new graph object """
 
+        # load the new graph object from the provided file
+        graph = igraph.Graph.Read_Pickle(fname=Path(file_dir_path, 
+        f'{file_stem_name}.pickle'))
+        if not isinstance(graph, ScraperGraph):
+            # graphs written before the name index existed are plain igraph graphs
+            graph = ScraperGraph.from_graph(graph)
+        # attach a Lock object to the newly loaded graph object
+        return cls._attach_lock(graph)
@@ -14,6 +14,10 @@ from urllib.parse import urlparse
 from urllib.parse import urljoin
 from scrapy.linkextractors.lxmlhtml import LxmlLinkExtractor
 from edscrapers.scrapers.base.models import Resource, Collection, Source
+from edscrapers.scrapers.base import classifier
+from edscrapers.scrapers.base import documents
+from edscrapers.scrapers.base import memo
+from edscrapers.scrapers.base import timing
 
 import pathlib
 import importlib
@@ -31,58 +35,36 @@ TOTAL_BACKOFF_TIME = sum(itertools.accumulate(itertools.repeat(RATE_LIMIT_WINDOW
                                     NUMBER_OF_RETRIES_AFTER_LIMIT+1)))
 
 def get_data_extensions():
-    return {
-        '.xls': 'Excel data file',
-        '.csv': 'Comma delimited text file',
-        '.sas': 'SAS syntax file',
-        '.dat': 'Generic data file',
-        '.spss': 'SPSS syntax',  # This may be an incorrect extension, but we will continue to search for it
-        '.db.': 'Generic data base',
-        '.sql': 'Structured query language file',
-        '.xml': 'Extensible Markup language',
-        '.zip': 'File containing compressed files',
-        '.txt': 'Text files',
-
-        '.xlsx': 'Excel data file',
-        '.sps': 'SPSS syntax',
-        '.sav': 'SPSS data',
-        '.dat': 'Stata data',
-        '.do': 'Stata syntax',
-        '.r': 'R script',
-        '.rdata': 'R data',
-        '.rda': 'R data',
-        '.sd2': 'SAS data',
-        '.sd7': 'SAS data',
-        '.sas7bdat': 'SAS data'
-    }
+    return dict(classifier.DATA_EXTENSIONS)
 
 def get_document_extensions():
-    return {
-        '.docx': 'Word document',
-        '.doc': 'Word document',
-        '.pdf': 'PDF file'
-    }
+    return dict(classifier.DOCUMENT_EXTENSIONS)
 
 def get_avoidable_extensions():
-    return {
-        '.jpg': 'JPG image file',
-        '.jpeg': 'JPEG image file',
-        '.png': 'PNG image file',
-        '.ppt': 'MS PowerPoint file',
-        '.pptx': 'MS PowerPoint file',
-        '.mp3': 'MP3 audio file',
-    }
+    return dict(classifier.AVOIDABLE_EXTENSIONS)
+
+# link extractors and suffix matchers used by `get_all_resources()`,
+# built once per deny list / set of extensions
+_resource_link_extractors = dict()
+_resource_matchers = dict()
 
 def get_all_resources(res, dataset, extensions, deny_list=[]):
-    for link in LxmlLinkExtractor(deny_extensions=[], deny=deny_list).extract_links(res):
-        for extension in extensions.keys():
-            if link.url.endswith(extension):
-                resource = Resource(
-                    source_url = res.url,
-                    url = link.url,
-                    name = link.text,
-                )
-                dataset['resources'].append(resource)
+    deny_list = tuple(deny_list)
+    if deny_list not in _resource_link_extractors:
+        _resource_link_extractors[deny_list] = LxmlLinkExtractor(deny_extensions=[], deny=deny_list)
+    extensions = tuple(extensions.keys())
+    if extensions not in _resource_matchers:
+        _resource_matchers[extensions] = classifier.SuffixMatcher(extensions, ignore_case=False)
+
+    matcher = _resource_matchers[extensions]
+    for link in _resource_link_extractors[deny_list].extract_links(res):
+        if matcher.match(link.url):
+            resource = Resource(
+                source_url = res.url,
+                url = link.url,
+                name = link.text,
+            )
+            dataset['resources'].append(resource)
 
 def get_variables(object, filter=None):
     """Extract variables from object to dict using name filter.
@@ -104,25 +86,6 @@ def get_meta_value(soup, meta_name):
     return meta_tag['content']
 
 
-@backoff.on_exception(backoff.expo, Exception,
-                      max_time=TOTAL_BACKOFF_TIME,
-                      max_tries=NUMBER_OF_RETRIES_AFTER_LIMIT) # exponential backoff
-@ratelimit.limits(calls=NUMBER_OF_CALLS_PER_LIMIT_WINDOWS,
-                  period=RATE_LIMIT_WINDOW) # apply rate-limit throttling
-def get_resource_headers(source_url, url):
-    headers = dict()
-    #return headers
-    if urlparse(url).scheme:
-        raw_headers = requests.head(url).headers
-    else:
-        raw_headers = requests.head(urljoin(source_url, url)).headers
-
-    headers['content-type'] = raw_headers.get('Content-Type', None)
-    headers['last-modified'] = raw_headers.get('Last-Modified', None)
-    headers['content-length'] = raw_headers.get('Content-Length', None)
-
-    return headers
-
 def retrieve_crawlers_allowed_domains(except_crawlers=[]) -> list:
     """ function retireves all 'allowed_domains'
     (domains which are allowed to be scraped) from the available
@@ -166,13 +129,9 @@ def retrieve_crawlers_allowed_domains(except_crawlers=[]) -> list:
     return list(allowed_domains) # return allowed_domains
 
 
-@backoff.on_exception(backoff.expo, Exception,
-                      max_time=TOTAL_BACKOFF_TIME,
-                      max_tries=NUMBER_OF_RETRIES_AFTER_LIMIT) # exponential backoff
-@ratelimit.limits(calls=NUMBER_OF_CALLS_PER_LIMIT_WINDOWS,
-                  period=RATE_LIMIT_WINDOW) # apply rate-limit throttling
+@timing.timed('collection')
 def extract_dataset_collection_from_url(collection_url,
-                                        namespace, source_url=None):
+                                        namespace, source_url=None, memos=None):
     """ function is used to generate/extract a dataset 'Collection' from
     the provided collection_url.
     A collection is created based on the Collection model in
@@ -191,6 +150,10 @@ def extract_dataset_collection_from_url(collection_url,
     Collection belongs to) should be extracted/generated.
     if not specified, it is assumed that the Collection has no source
 
+    - memos: the lookup memos of the crawl (see edscrapers.scrapers.base.memo).
+    The Source of the Collection is memoized for the crawl, so a source page is
+    only downloaded once. default is None (nothing is memoized)
+
     Returns a edscrapers.scrapers.base.models.Collection object.
     If any of the required parameters are not present, None is return
     """
@@ -212,6 +175,27 @@ def extract_dataset_collection_from_url(collection_url,
             # collection_url and source_url are the same, so this is not a valid collection
             return None
 
+    collection = _download_dataset_collection(collection_url, namespace)
+    if collection is None:
+        return None
+
+    # if source_url was specified and it's an absolute url
+    if source_url and urlparse(source_url).scheme:
+        # generate the Source for this collection
+        collection['source'] = extract_dataset_source_from_url(source_url, namespace, memos)
+    
+    return collection
+
+
+@timing.timed('collection.download') # includes the rate limit sleeps and the retries
+@backoff.on_exception(backoff.expo, Exception,
+                      max_time=TOTAL_BACKOFF_TIME,
+                      max_tries=NUMBER_OF_RETRIES_AFTER_LIMIT) # exponential backoff
+@ratelimit.limits(calls=NUMBER_OF_CALLS_PER_LIMIT_WINDOWS,
+                  period=RATE_LIMIT_WINDOW) # apply rate-limit throttling
+def _download_dataset_collection(collection_url, namespace):
+    """ function downloads the page at 'collection_url' and creates its
+    Collection (without a Source) """
 
     # make a request for html page contained in the provided url
     res = requests.get(collection_url, verify=False)
@@ -234,23 +218,107 @@ def extract_dataset_collection_from_url(collection_url,
     else:
       collection['collection_title'] = '[no title]'
 
+    collection['collection_id'] =\
+        f'{hashlib.md5(collection["collection_url"].encode("utf-8")).hexdigest()}-{hashlib.md5(namespace.encode("utf-8")).hexdigest()}'
+
+    return collection
+
+
+@timing.timed('collection')
+def extract_dataset_collection_from_response(res, namespace, network_fallback=None):
+    """ function is used to generate/extract a dataset 'Collection' from
+    the page contained in the provided (already downloaded) response, and the
+    'Source' of the Collection from the page which referred to it (i.e. the Referer).
+
+    Unlike `extract_dataset_collection_from_url()`, no page is downloaded again:
+    - the Collection title is read from the parsed document of the response
+    (see edscrapers.scrapers.base.documents)
+    - the Source title is read from `res.meta['referer_title']` which is set
+    by the GraphMiddleWare from the crawl graph (or the http cache)
+
+    PARAMETERS
+    - res: the scrapy Response containing the Collection page
+
+    - namespace: see `extract_dataset_collection_from_url()`
+
+    - network_fallback: if True and the title of the referring page is not known,
+    the Source is downloaded with `extract_dataset_source_from_url()`. If False,
+    the Source gets the title '[no title]'. default is the
+    'COLLECTION_NETWORK_FALLBACK' setting of the crawl, kept in
+    `res.meta['collection_network_fallback']` by the GraphMiddleWare
+    (False for a response which is not part of a crawl)
+
+    Returns a edscrapers.scrapers.base.models.Collection object.
+    If any of the required parameters are not present, None is return
+    """
+
+    # check the required parameters
+    if (res is None) or (not namespace):
+        return None
+
+    collection_url = res.url
+    # if collection_url is not an absolute url
+    if not urlparse(collection_url).scheme:
+        return None
+
+    request = getattr(res, 'request', None)
+    source_url = str(request.headers.get(b'Referer', b''), encoding='utf-8') if request else ''
+
+    # cleanup the collection_url i.e. remove all query parameters
+    collection_url = url_query_param_cleanup(collection_url, include_query_param=[])
+    # compare collection_url and source_url
+    if source_url and urlparse(source_url).scheme: # first make sure source_url is valid
+        # now the comparison
+        if collection_url == url_query_param_cleanup(source_url, include_query_param=[]):
+            # collection_url and source_url are the same, so this is not a valid collection
+            return None
+
+    # ensure that the response text gotten is a string
+    if not isinstance(getattr(res, 'text', None), str):
+        return None
+
+    collection = Collection()
+    collection['collection_url'] = collection_url
+    # get the collection title
+    collection['collection_title'] = documents.get_title(res)
+
     collection['collection_id'] =\
         f'{hashlib.md5(collection["collection_url"].encode("utf-8")).hexdigest()}-{hashlib.md5(namespace.encode("utf-8")).hexdigest()}'
 
     # if source_url was specified and it's an absolute url
     if source_url and urlparse(source_url).scheme:
-        # generate the Source for this collection
-        collection['source'] = extract_dataset_source_from_url(source_url, namespace)
-    
+        source_title = res.meta.get('referer_title') if request else None
+        if network_fallback is None:
+            network_fallback = res.meta.get('collection_network_fallback', False) if request else False
+
+        if source_title is None and network_fallback:
+            # generate the Source for this collection by downloading it
+            collection['source'] = extract_dataset_source_from_url(source_url, namespace,
+                                                                   memo.get_memos(res))
+        else:
+            collection['source'] = create_dataset_source(source_url, source_title or '[no title]',
+                                                         namespace)
+
     return collection
 
 
-@backoff.on_exception(backoff.expo, Exception,
-                      max_time=TOTAL_BACKOFF_TIME,
-                      max_tries=NUMBER_OF_RETRIES_AFTER_LIMIT) # exponential backoff
-@ratelimit.limits(calls=NUMBER_OF_CALLS_PER_LIMIT_WINDOWS,
-                  period=RATE_LIMIT_WINDOW) # apply rate-limit throttling
-def extract_dataset_source_from_url(source_url, namespace):
+def create_dataset_source(source_url, source_title, namespace):
+    """ function creates a dataset 'Source' for the page at 'source_url'
+    with the provided 'source_title'. See `extract_dataset_source_from_url()`
+    for the meaning of 'namespace' """
+
+    source = Source()
+    # cleanup the source_url i.e. remove all query parameters
+    source['source_url'] = url_query_param_cleanup(source_url, include_query_param=[])
+    source['source_title'] = source_title
+    source['source_id'] =\
+        f'{hashlib.md5(source["source_url"].encode("utf-8")).hexdigest()}-{hashlib.md5(namespace.encode("utf-8")).hexdigest()}'
+
+    return source
+
+
+@timing.timed('source')
+def extract_dataset_source_from_url(source_url, namespace, memos=None):
     """ function is used to generate/extract a dataset 'Source' from
     the provided source_url.
     A source is created based on the Source model in
@@ -265,6 +333,10 @@ def extract_dataset_source_from_url(source_url, namespace):
     A Source's unique id (source_id) is created using an
     encoding algorithm which combines the 'source_url' and 'namespace'.
 
+    - memos: the lookup memos of the crawl (see edscrapers.scrapers.base.memo).
+    Sources are memoized for the crawl, so a page is only downloaded once.
+    default is None (nothing is memoized)
+
     Returns a edscrapers.scrapers.base.models.Source object.
     If any of the required parameters are not present, None is return
     """
@@ -275,7 +347,20 @@ def extract_dataset_source_from_url(source_url, namespace):
 
     # cleanup the source_url i.e. remove all query parameters
     source_url = url_query_param_cleanup(source_url, include_query_param=[])
-    
+
+    return _memoized(memos.sources if memos is not None else None, (source_url, namespace), Source,
+                     lambda: _download_dataset_source(source_url, namespace))
+
+
+@timing.timed('source.download') # includes the rate limit sleeps and the retries
+@backoff.on_exception(backoff.expo, Exception,
+                      max_time=TOTAL_BACKOFF_TIME,
+                      max_tries=NUMBER_OF_RETRIES_AFTER_LIMIT) # exponential backoff
+@ratelimit.limits(calls=NUMBER_OF_CALLS_PER_LIMIT_WINDOWS,
+                  period=RATE_LIMIT_WINDOW) # apply rate-limit throttling
+def _download_dataset_source(source_url, namespace):
+    """ function downloads the page at 'source_url' and creates its Source """
+
     # make a request for html page contained in the provided url
     res = requests.get(source_url, verify=False)
 
@@ -303,6 +388,23 @@ def extract_dataset_source_from_url(source_url, namespace):
     return source
 
 
+def _memoized(lookup_memo, key, item_class, lookup):
+    """ function returns the item memoized for 'key' in 'lookup_memo'.
+    If there is none (or no memo), 'lookup()' is called and the item it returns is memoized.
+    A failed lookup (None) is not memoized, so it is tried again.
+    A new item is returned on every call, so callers can modify it """
+
+    if lookup_memo is None:
+        return lookup()
+    value = lookup_memo.get(key)
+    if value is memo.MISSING or value is None: # None is left by older crawls
+        item = lookup()
+        if item is not None:
+            lookup_memo.set(key, dict(item))
+        return item
+    return item_class(value)
+
+
 def url_query_param_cleanup(url: str, include_query_param: list=None,
                          exclude_query_param: list=None) -> str:
     """ function helps to remove querystring name/value pairs from the provided url.
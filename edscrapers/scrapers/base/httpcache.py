@@ -0,0 +1,317 @@
+""" module provides a compact storage for the scrapy http cache
+(opted into with the HTTPCACHE_STORAGE setting, see scrapers/base/config.py).
+
+scrapy's FilesystemCacheStorage writes a directory and six small files for
+every cached response, so a full ed.gov crawl leaves millions of inodes under
+the cache directory, and just walking it takes minutes. The
+`SQLiteCacheStorage` keeps all the responses cached by a spider in a single
+SQLite file ('<HTTPCACHE_DIR>/<spider name>.sqlite'):
+- the response bodies are compressed (HTTPCACHE_COMPRESSION: 'zlib' by
+  default, 'zstd' with the optional 'zstandard' package, or '' for none).
+  Every entry records its compression, so changing it keeps the cache readable
+- the file is read through a memory map (of up to HTTPCACHE_MMAP_SIZE bytes),
+  so cached responses are read without a read() call per page
+- the file is in WAL mode, so the worker processes of a crawl
+  (see scrapers/base/frontier.py) share it
+
+`eds cache stats` reports the size of the cache of every spider,
+`eds cache prune` removes the expired (or the oldest) entries and shrinks
+the files, and `eds cache import` moves a filesystem cache into SQLite files """
+
+import time
+import zlib
+import pickle
+import shutil
+import sqlite3
+import pathlib
+
+from scrapy.http.headers import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from scrapy.utils.request import request_fingerprint
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+# suffix of the cache files
+CACHE_SUFFIX = '.sqlite'
+
+# the supported compressions of the response bodies
+COMPRESSIONS = (None, 'zlib', 'zstd')
+DEFAULT_COMPRESSION = 'zlib'
+# zlib compression level: a cache is written once per page and read many
+# times, so the level is a trade-off between the crawl cpu and the file size
+ZLIB_LEVEL = 6
+
+# default number of bytes of a cache file read through a memory map
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+
+
+def check_compression(compression):
+    """ function ensures the provided compression is supported
+    (an empty string means no compression). Returns the compression or raises ValueError """
+
+    compression = compression or None
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown http cache compression '{compression}'. "
+                         f"Expected one of {[c for c in COMPRESSIONS if c]}")
+    if compression == 'zstd':
+        _zstd() # fail early if zstandard is not installed
+    return compression
+
+
+def _zstd():
+    """ function returns the (optional) zstandard module """
+
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("'zstd' http cache compression requires the 'zstandard' package "
+                         "(pip install zstandard)")
+    return zstandard
+
+
+def _compress(data, compression):
+    if compression == 'zlib':
+        return zlib.compress(data, ZLIB_LEVEL)
+    if compression == 'zstd':
+        return _zstd().ZstdCompressor().compress(data)
+    return data
+
+
+def _decompress(data, compression):
+    if compression == 'zlib':
+        return zlib.decompress(data)
+    if compression == 'zstd':
+        return _zstd().ZstdDecompressor().decompress(data)
+    return data
+
+
+def cache_path(cache_dir, spider_name):
+    """ function returns the path of the cache file of 'spider_name' """
+    return pathlib.Path(cache_dir, f'{spider_name}{CACHE_SUFFIX}')
+
+
+def connect(path, mmap_size=DEFAULT_MMAP_SIZE):
+    """ function opens (creating it if needed) the cache file at 'path' """
+
+    pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+    # every statement is its own transaction (isolation_level=None), so
+    # the write lock is never held between two responses
+    connection = sqlite3.connect(str(path), timeout=60, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+    connection.execute('''CREATE TABLE IF NOT EXISTS responses (
+                              fingerprint TEXT PRIMARY KEY,
+                              url TEXT,
+                              method TEXT,
+                              status INTEGER,
+                              response_url TEXT,
+                              headers BLOB,
+                              request_headers BLOB,
+                              body BLOB,
+                              compression TEXT,
+                              body_size INTEGER,
+                              stored_size INTEGER,
+                              timestamp REAL)''')
+    connection.execute('CREATE INDEX IF NOT EXISTS responses_timestamp ON responses (timestamp)')
+    return connection
+
+
+def _store(connection, fingerprint, url, method, status, response_url,
+           headers, request_headers, body, compression, timestamp=None):
+    """ function stores a response (with raw 'headers' and 'request_headers') in a cache file """
+
+    stored_body = _compress(body, compression)
+    connection.execute('''INSERT OR REPLACE INTO responses
+                          (fingerprint, url, method, status, response_url, headers, request_headers,
+                           body, compression, body_size, stored_size, timestamp)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                       (fingerprint, url, method, status, response_url, headers, request_headers,
+                        stored_body, compression or '', len(body), len(stored_body),
+                        timestamp if timestamp is not None else time.time()))
+
+
+class SQLiteCacheStorage():
+    """ scrapy http cache storage which keeps the responses of a spider in
+    a single SQLite file (see the module documentation). Like the scrapy
+    storages, it honours HTTPCACHE_DIR and HTTPCACHE_EXPIRATION_SECS """
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.compression = check_compression(settings.get('HTTPCACHE_COMPRESSION', DEFAULT_COMPRESSION))
+        self.mmap_size = settings.getint('HTTPCACHE_MMAP_SIZE', DEFAULT_MMAP_SIZE)
+        self.connection = None
+
+    def open_spider(self, spider):
+        path = cache_path(self.cachedir, spider.name)
+        self.connection = connect(path, self.mmap_size)
+        spider.logger.debug(f'Using SQLite cache storage in {path}')
+
+    def close_spider(self, spider):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def retrieve_response(self, spider, request):
+        """ returns the cached response to 'request' or None if there is none (or it expired) """
+
+        row = self.connection.execute('''SELECT status, response_url, headers, body, compression, timestamp
+                                         FROM responses WHERE fingerprint = ?''',
+                                      (request_fingerprint(request),)).fetchone()
+        if row is None:
+            return None # not cached
+        status, url, raw_headers, body, compression, timestamp = row
+        if 0 < self.expiration_secs < time.time() - timestamp:
+            return None # expired
+
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, headers=headers, status=status,
+                       body=_decompress(bytes(body), compression or None))
+
+    def store_response(self, spider, request, response):
+        """ stores 'response' (to 'request') in the cache """
+
+        _store(self.connection, request_fingerprint(request), request.url, request.method,
+               response.status, response.url, headers_dict_to_raw(response.headers),
+               headers_dict_to_raw(request.headers), response.body, self.compression)
+
+
+def cache_files(cache_dir, names=None):
+    """ function returns the cache files in 'cache_dir', optionally
+    only those of the spiders called 'names' """
+
+    paths = sorted(pathlib.Path(cache_dir).glob(f'*{CACHE_SUFFIX}'))
+    if names:
+        paths = [path for path in paths if path.stem in names]
+    return paths
+
+
+def _file_size(path):
+    """ function returns the size of a cache file, with its write-ahead log """
+
+    return sum(pathlib.Path(f'{path}{suffix}').stat().st_size
+               for suffix in ('', '-wal') if pathlib.Path(f'{path}{suffix}').exists())
+
+
+def cache_stats(cache_dir, names=None, max_age=None):
+    """ function returns the stats of the cache of every spider (see `cache_files()`):
+    the number of entries, their (uncompressed) body size, their stored size,
+    the size of the file, the time of the oldest and newest entries and,
+    if 'max_age' (in seconds) is provided, the number of entries older than that """
+
+    stats = []
+    for path in cache_files(cache_dir, names):
+        connection = connect(path)
+        entries, body_bytes, stored_bytes, oldest, newest = connection.execute(
+            '''SELECT COUNT(*), COALESCE(SUM(body_size), 0), COALESCE(SUM(stored_size), 0),
+                      MIN(timestamp), MAX(timestamp) FROM responses''').fetchone()
+        spider_stats = {'spider': path.stem, 'entries': entries, 'body_bytes': body_bytes,
+                        'stored_bytes': stored_bytes, 'file_bytes': _file_size(path),
+                        'oldest': oldest, 'newest': newest}
+        if max_age:
+            spider_stats['expired'] = connection.execute('SELECT COUNT(*) FROM responses WHERE timestamp < ?',
+                                                         (time.time() - max_age,)).fetchone()[0]
+        connection.close()
+        stats.append(spider_stats)
+    return stats
+
+
+def prune(cache_dir, names=None, max_age=None, max_size=None):
+    """ function removes the entries older than 'max_age' seconds and then, while
+    the stored size of a cache is over 'max_size' bytes, its oldest entries.
+    The files are then shrunk. Returns, for every spider, the number of
+    removed entries and the size of its file before and after """
+
+    pruned = []
+    for path in cache_files(cache_dir, names):
+        size_before = _file_size(path)
+        connection = connect(path)
+        removed = 0
+        if max_age:
+            removed += connection.execute('DELETE FROM responses WHERE timestamp < ?',
+                                          (time.time() - max_age,)).rowcount
+        if max_size:
+            # keep the newest entries which fit in 'max_size'
+            kept_size = 0
+            cutoff = None
+            cursor = connection.execute('SELECT stored_size, timestamp FROM responses ORDER BY timestamp DESC')
+            for stored_size, timestamp in cursor:
+                kept_size += stored_size
+                if kept_size > max_size:
+                    cutoff = timestamp
+                    break
+            cursor.close()
+            if cutoff is not None:
+                removed += connection.execute('DELETE FROM responses WHERE timestamp <= ?',
+                                              (cutoff,)).rowcount
+        if removed:
+            # give the space of the removed entries back to the filesystem
+            connection.execute('VACUUM')
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        connection.close()
+        pruned.append({'spider': path.stem, 'removed': removed,
+                       'file_bytes_before': size_before, 'file_bytes_after': _file_size(path)})
+    return pruned
+
+
+def import_filesystem_cache(cache_dir, names=None, compression=DEFAULT_COMPRESSION, remove=False):
+    """ function moves the responses of scrapy's filesystem cache storage
+    (the '<cache_dir>/<spider name>/' directories) into the SQLite cache files.
+    With 'remove', the imported directories are deleted.
+    Returns the number of responses imported for every spider """
+
+    compression = check_compression(compression)
+    imported = dict()
+    for spider_dir in sorted(path for path in pathlib.Path(cache_dir).iterdir() if path.is_dir()):
+        if names and spider_dir.name not in names:
+            continue
+        connection = connect(cache_path(cache_dir, spider_dir.name))
+        count = 0
+        connection.execute('BEGIN')
+        for meta_path in spider_dir.glob('*/*/pickled_meta'):
+            entry_dir = meta_path.parent
+            try:
+                with open(meta_path, 'rb') as meta_file:
+                    meta = pickle.load(meta_file)
+                with open(entry_dir / 'response_body', 'rb') as body_file:
+                    body = body_file.read()
+                with open(entry_dir / 'response_headers', 'rb') as headers_file:
+                    headers = headers_file.read()
+            except (OSError, pickle.UnpicklingError, EOFError):
+                continue # an incomplete entry (e.g. left by an interrupted crawl)
+            request_headers = b''
+            if (entry_dir / 'request_headers').exists():
+                with open(entry_dir / 'request_headers', 'rb') as headers_file:
+                    request_headers = headers_file.read()
+            # the entry directories are named after the request fingerprints
+            _store(connection, entry_dir.name, meta['url'], meta.get('method', 'GET'), meta['status'],
+                   meta.get('response_url', meta['url']), headers, request_headers, body, compression,
+                   timestamp=meta.get('timestamp', meta_path.stat().st_mtime))
+            count += 1
+        connection.execute('COMMIT')
+        connection.close()
+        imported[spider_dir.name] = count
+
+        if remove:
+            shutil.rmtree(spider_dir)
+    return imported
+
+
+def iter_responses(path):
+    """ function yields every response of the cache file at 'path', as
+    a dict of its 'url', 'response_url', 'status', 'headers', 'request_headers'
+    (both scrapy Headers) and 'body' """
+
+    connection = connect(path)
+    try:
+        for url, response_url, status, headers, request_headers, body, compression in connection.execute(
+                '''SELECT url, response_url, status, headers, request_headers, body, compression
+                   FROM responses ORDER BY url'''):
+            yield {'url': url, 'response_url': response_url, 'status': status,
+                   'headers': Headers(headers_raw_to_dict(headers)),
+                   'request_headers': Headers(headers_raw_to_dict(request_headers or b'')),
+                   'body': _decompress(bytes(body), compression or None)}
+    finally:
+        connection.close()
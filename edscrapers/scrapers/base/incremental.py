@@ -0,0 +1,138 @@
+""" module provides what the incremental crawl mode (`eds scrape --incremental`)
+needs to recrawl a site without parsing its unchanged pages again:
+
+- `RevalidatingPolicy`: a scrapy http cache policy which revalidates every
+  cached page with a conditional request (If-None-Match/If-Modified-Since,
+  using the validators of the cached response). A '304 Not Modified' answer
+  is replaced by the cached page, so unchanged pages are not downloaded again
+- `PageStore`: a persistent (SQLite) store which keeps, for every page
+  crawled by a scraper, the hash of the page body, its title and the
+  datasets the parser yielded for it. When the body of a page has not changed, the
+  `IncrementalMiddleware` (see scrapers/base/middlewares.py) yields the
+  stored datasets instead of parsing the page, so the output is complete
+  while only the changed pages are parsed
+
+The store is kept under ED_OUTPUT_PATH (or the INCREMENTAL_STORE_PATH setting) """
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import pathlib
+
+from scrapy import Item
+from scrapy.extensions.httpcache import RFC2616Policy
+
+from edscrapers.scrapers.base import models
+
+# default location of the page store database
+DEFAULT_PATH = os.path.join(os.getenv('ED_OUTPUT_PATH', '.'), 'scrapy', 'incremental.sqlite')
+
+# key used to tag the scrapy Items in the stored datasets
+ITEM_KEY = '__item__'
+
+# the states of a crawled page
+UNCHANGED = 'unchanged' # the page body is the one stored
+CHANGED = 'changed' # the page body differs from the one stored
+NEW = 'new' # there is nothing stored for the page
+
+
+class RevalidatingPolicy(RFC2616Policy):
+    """ http cache policy which never serves a cached page without asking the
+    server whether the page has changed (with the validators of the cached page).
+    Pages are cached when they carry validators (ETag/Last-Modified) or
+    an expiration time, as in the RFC2616 policy """
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+
+def body_hash(response):
+    """ function returns the hash of the body of 'response' """
+    return hashlib.sha1(response.body).hexdigest()
+
+
+def to_record(value):
+    """ function converts a (scrapy Item) value to json-serializable data,
+    keeping the class of every Item, so it can be restored by `from_record()` """
+
+    if isinstance(value, Item):
+        return {ITEM_KEY: type(value).__name__,
+                'fields': {key: to_record(field) for key, field in value.items()}}
+    if isinstance(value, dict):
+        return {key: to_record(field) for key, field in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [to_record(field) for field in value]
+    return value
+
+
+def from_record(value):
+    """ function restores the value converted by `to_record()` """
+
+    if isinstance(value, dict):
+        if ITEM_KEY in value:
+            item_class = getattr(models, value[ITEM_KEY])
+            return item_class(**{key: from_record(field) for key, field in value['fields'].items()})
+        return {key: from_record(field) for key, field in value.items()}
+    if isinstance(value, list):
+        return [from_record(field) for field in value]
+    return value
+
+
+class PageStore():
+    """ class represents the page store (the body hash and datasets of every crawled page) """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.counts = {UNCHANGED: 0, CHANGED: 0, NEW: 0, 'stored': 0}
+
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # the store may be shared by several scraper processes: every page is
+        # stored in a transaction of its own (isolation_level=None), so the
+        # write lock is never held between two pages
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS pages (
+                                        spider TEXT,
+                                        url TEXT,
+                                        body_hash TEXT,
+                                        title TEXT,
+                                        datasets TEXT,
+                                        crawled_at REAL,
+                                        PRIMARY KEY (spider, url))''')
+
+    def lookup(self, spider_name, url, page_hash):
+        """ returns a tuple of (page state, stored page) for the page at 'url'
+        whose body hash is 'page_hash'. The page state is one of UNCHANGED,
+        CHANGED or NEW. The stored page (a dict of the page 'title' and
+        'datasets') is only returned for UNCHANGED pages """
+
+        row = self.connection.execute('''SELECT body_hash, title, datasets FROM pages
+                                         WHERE spider = ? AND url = ?''', (spider_name, url)).fetchone()
+        if row is None:
+            self.counts[NEW] += 1
+            return NEW, None
+        if row[0] != page_hash:
+            self.counts[CHANGED] += 1
+            return CHANGED, None
+        self.counts[UNCHANGED] += 1
+        return UNCHANGED, {'title': row[1],
+                           'datasets': [from_record(dataset) for dataset in json.loads(row[2])]}
+
+    def store(self, spider_name, url, page_hash, title, datasets):
+        """ stores the body hash and the title of the page at 'url' and the datasets parsed from it """
+
+        self.connection.execute('''INSERT OR REPLACE INTO pages
+                                   (spider, url, body_hash, title, datasets, crawled_at)
+                                   VALUES (?, ?, ?, ?, ?, ?)''',
+                                (spider_name, url, page_hash, title,
+                                 json.dumps([to_record(dataset) for dataset in datasets], default=str),
+                                 time.time()))
+        self.counts['stored'] += 1
+
+    def close(self):
+        """ closes the store """
+        self.connection.close()
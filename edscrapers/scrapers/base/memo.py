@@ -0,0 +1,145 @@
+""" module provides crawl-scoped memos for lookups which need the network
+(i.e. downloading a Source page to get its title, see
+`helpers.extract_dataset_source_from_url()`).
+
+A memo maps a key (e.g. (url, namespace)) to a json serializable value.
+It keeps the most recently used entries in memory (bounded by 'maxsize') and,
+when configured with a path, writes every entry through to an SQLite file so
+that evicted entries can be read back and a resumed crawl reuses the lookups
+of the interrupted one. Failed lookups are not memoized, so they are tried again.
+
+Every crawl has its own memos (`CrawlMemos`), created from the crawl settings
+by the `LookupMemoExtension` (see edscrapers.scrapers.base.extensions), which
+also records their hit ratios in the scrapy stats. The extension attaches the
+memos to every response of the crawl, so the parsers (which only get the
+response) look up the memos of their own crawl with `get_memos()`, even when
+several crawls run in the same process """
+
+import json
+import sqlite3
+import pathlib
+import weakref
+
+from collections import OrderedDict
+
+# default number of entries kept in memory by a memo
+DEFAULT_MAXSIZE = 1024
+
+# returned by `LookupMemo.get()` when a key is not memoized
+MISSING = object()
+
+
+class LookupMemo():
+    """ class represents a bounded (LRU) memo with optional persistence """
+
+    def __init__(self, name, maxsize=DEFAULT_MAXSIZE, path=None):
+        self.name = name
+        self.entries = OrderedDict()
+        self.counts = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self.connection = None
+        self.configure(maxsize, path)
+
+    def configure(self, maxsize=DEFAULT_MAXSIZE, path=None):
+        """ sets the size bound of the memo and the SQLite file it is
+        persisted to (None keeps the memo in memory only) """
+
+        self.close()
+        self.maxsize = maxsize
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+        if path is not None:
+            pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+            # the memo file may be shared by scrapers running at the same time: every
+            # entry is written in a transaction of its own (isolation_level=None), so
+            # the write lock is never held between two lookups
+            self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS lookup_memo (
+                                            name TEXT,
+                                            key TEXT,
+                                            value TEXT,
+                                            PRIMARY KEY (name, key))''')
+
+    def get(self, key, default=MISSING):
+        """ returns the value memoized for 'key' or 'default' if there is none """
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.counts['hits'] += 1
+            return self.entries[key]
+
+        if self.connection is not None:
+            row = self.connection.execute('SELECT value FROM lookup_memo WHERE name = ? AND key = ?',
+                                          (self.name, json.dumps(key))).fetchone()
+            if row is not None:
+                self.counts['disk_hits'] += 1
+                value = json.loads(row[0])
+                self._remember(key, value)
+                return value
+
+        self.counts['misses'] += 1
+        return default
+
+    def set(self, key, value):
+        """ memoizes the (json serializable) 'value' for 'key' """
+
+        self._remember(key, value)
+        if self.connection is not None:
+            self.connection.execute('INSERT OR REPLACE INTO lookup_memo (name, key, value) VALUES (?, ?, ?)',
+                                    (self.name, json.dumps(key), json.dumps(value)))
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.counts['evictions'] += 1
+
+    def hit_ratio(self):
+        """ returns the ratio of lookups answered by the memo (from memory or disk) """
+
+        lookups = self.counts['hits'] + self.counts['disk_hits'] + self.counts['misses']
+        if lookups == 0:
+            return 0.0
+        return (self.counts['hits'] + self.counts['disk_hits']) / lookups
+
+    def close(self):
+        """ closes the SQLite file (if any) """
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class CrawlMemos():
+    """ class holds the lookup memos of a crawl """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, path=None):
+        # memo for the dataset Sources, keyed by (source_url, namespace)
+        self.sources = LookupMemo('sources', maxsize, path)
+
+    def __iter__(self):
+        return iter((self.sources,))
+
+    def close(self):
+        for lookup_memo in self:
+            lookup_memo.close()
+
+
+# the memos of the crawl of every response
+_responses = weakref.WeakKeyDictionary()
+
+
+def set_memos(res, memos):
+    """ function attaches the memos of a crawl to the provided response """
+    _responses[res] = memos
+
+
+def get_memos(res):
+    """ function returns the memos of the crawl of the provided response,
+    or None if the response is not part of a crawl with memos """
+
+    if res is None:
+        return None
+    return _responses.get(res)
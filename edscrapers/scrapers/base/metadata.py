@@ -0,0 +1,180 @@
+""" module provides a persistent (SQLite) cache for the metadata of resources
+(i.e. the headers returned for a HEAD request of a resource url).
+
+The same resource urls are linked from many pages and by many scrapers, and
+get probed again on every crawl. The cache keeps the content-type,
+last-modified, content-length and etag of every resource (keyed by the
+absolute resource url) under ED_OUTPUT_PATH, so that:
+- entries younger than the cache ttl are used without any network call
+- older entries are revalidated with a conditional
+  (If-None-Match/If-Modified-Since) HEAD request
+- entries can be read when transforming the scraped output
+  (e.g. the datajson 'headerMetadata') without any network call
+
+The number of cache hits, misses and revalidations is kept by the
+cache object (see `ResourceMetadataCache.counts`) """
+
+import os
+import time
+import atexit
+import sqlite3
+import pathlib
+
+from urllib.parse import urlparse
+from urllib.parse import urljoin
+
+# default location of the cache database
+DEFAULT_PATH = os.path.join(os.getenv('ED_OUTPUT_PATH', '.'), 'scrapy', 'resource_metadata.sqlite')
+# default time (in seconds) a cached entry is used without revalidation. default is 7 days
+DEFAULT_TTL = float(os.getenv('RESOURCE_METADATA_TTL', 7 * 24 * 60 * 60))
+
+# the cache states of a lookup
+FRESH = 'hit' # the entry can be used as is
+STALE = 'stale' # the entry exists but must be revalidated
+MISS = 'miss' # there is no entry for the url
+
+# maps the columns of the cache to the name of the http headers they store
+HEADER_COLUMNS = {
+    'content_type': 'Content-Type',
+    'last_modified': 'Last-Modified',
+    'content_length': 'Content-Length',
+    'etag': 'ETag',
+}
+
+
+class ResourceMetadataCache():
+    """ class represents the resource metadata cache """
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.counts = {'hit': 0, 'miss': 0, 'stale': 0, 'revalidated': 0, 'stored': 0}
+
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # the cache may be shared by several scraper processes: every statement is
+        # its own transaction (isolation_level=None), so the write lock is never
+        # held between two writes
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS resource_metadata (
+                                        url TEXT PRIMARY KEY,
+                                        content_type TEXT,
+                                        last_modified TEXT,
+                                        content_length TEXT,
+                                        etag TEXT,
+                                        status INTEGER,
+                                        fetched_at REAL)''')
+
+    def get(self, url):
+        """ returns the cached entry (as a dict) for 'url', regardless of
+        its age, or None if the url is not cached.
+        This does not affect the hit/miss counts """
+
+        row = self.connection.execute('''SELECT content_type, last_modified, content_length,
+                                                etag, status, fetched_at
+                                         FROM resource_metadata WHERE url = ?''', (url,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('content_type', 'last_modified', 'content_length',
+                         'etag', 'status', 'fetched_at'), row))
+
+    def lookup(self, url):
+        """ returns a tuple of (cache state, cached entry) for 'url'.
+        The cache state is one of FRESH, STALE or MISS """
+
+        entry = self.get(url)
+        if entry is None:
+            self.counts['miss'] += 1
+            return MISS, None
+        if self.ttl is not None and time.time() - entry['fetched_at'] > self.ttl:
+            self.counts['stale'] += 1
+            return STALE, entry
+        self.counts['hit'] += 1
+        return FRESH, entry
+
+    def store(self, url, headers, status=200):
+        """ stores the metadata for 'url' taken from the http 'headers'
+        (any mapping with a case-insensitive `get()` e.g. scrapy or requests headers,
+        whose values are either str or bytes) """
+
+        values = [_header_value(headers, header) for header in HEADER_COLUMNS.values()]
+        self.connection.execute('''INSERT OR REPLACE INTO resource_metadata
+                                   (url, content_type, last_modified, content_length,
+                                    etag, status, fetched_at)
+                                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                (url, *values, status, time.time()))
+        self.counts['stored'] += 1
+
+    def revalidated(self, url):
+        """ marks the cached entry for 'url' as fresh
+        (i.e. the server answered a conditional request with '304 Not Modified') """
+
+        self.connection.execute('UPDATE resource_metadata SET fetched_at = ? WHERE url = ?',
+                                (time.time(), url))
+        self.counts['revalidated'] += 1
+
+    def close(self):
+        """ closes the cache """
+        self.connection.close()
+
+
+def resource_url(source_url, url):
+    """ returns the absolute url (the cache key) of a resource linked as 'url'
+    from the page at 'source_url', or None if it is not a http url """
+
+    if not url:
+        return None
+    url = urljoin(source_url or '', url.strip())
+    if urlparse(url).scheme not in ('http', 'https'):
+        return None
+    return url
+
+
+def conditional_headers(entry):
+    """ returns the request headers for revalidating a cached 'entry' """
+
+    headers = dict()
+    if entry is None:
+        return headers
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def resource_headers(entry):
+    """ returns the 'headers' dict kept for a Resource from a cached 'entry' """
+
+    if entry is None:
+        return None
+    return {
+        'content-type': entry['content_type'],
+        'last-modified': entry['last_modified'],
+        'content-length': entry['content_length'],
+    }
+
+
+def _header_value(headers, name):
+    """ returns the value of header 'name' as str (or None if the header is not set) """
+
+    value = headers.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    return str(value)
+
+
+# cache shared by the callers of `get_cache()` in this process
+_cache = None
+
+def get_cache():
+    """ returns the process-wide cache, opening it at DEFAULT_PATH on first use """
+
+    global _cache
+    if _cache is None:
+        _cache = ResourceMetadataCache()
+        atexit.register(_cache.close)
+    return _cache
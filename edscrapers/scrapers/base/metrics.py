@@ -0,0 +1,186 @@
+""" module provides the crawl metrics written by the MetricsExtension
+(see scrapers/base/extensions.py), so long crawls can be watched live and
+runs can be compared without reading the logs.
+
+Every METRICS_INTERVAL seconds (and when the spider closes) a sample of the
+crawl is taken, holding:
+- the pages, items and response bytes so far, and their rates (per second)
+  over the last interval
+- the size of the scheduler queue and the requests being downloaded
+- the (current and max) resident memory of the process
+- a histogram of the download latency of every host. Responses served by
+  the http cache are not downloaded, so they are left out
+
+Every sample is:
+- appended to ED_OUTPUT_PATH/metrics/<spider>-<run start>.jsonl, a json
+  object per line (the last sample of a run also holds the scrapy stats)
+- written to ED_OUTPUT_PATH/metrics/<spider>.prom in the Prometheus text
+  format, which replaces the previous sample. Point the textfile collector of
+  the Prometheus node exporter to the metrics directory to scrape it
+
+The files of the workers of a crawl (see scrapers/base/frontier.py) are
+named '<spider>.<worker>...' and their samples are labelled with the worker """
+
+import os
+import sys
+import json
+import pathlib
+from datetime import datetime
+
+try:
+    import resource # not available on Windows
+except ImportError:
+    resource = None
+
+# the upper bounds (in seconds) of the download latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# prefix of the Prometheus metric names
+PREFIX = 'eds'
+
+# default directory of the metrics files
+DEFAULT_DIR = os.path.join(os.getenv('ED_OUTPUT_PATH', '.'), 'metrics')
+
+
+class Histogram():
+    """ class represents a (Prometheus style) histogram of observed values """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets) # non-cumulative count per bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                return
+
+    def cumulative(self):
+        """ returns the (upper bound, cumulative count) of every bucket, ending with '+Inf' """
+
+        buckets = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            buckets.append((_format_bound(bound), total))
+        buckets.append(('+Inf', self.count))
+        return buckets
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': round(self.sum, 6),
+                'buckets': dict(self.cumulative())}
+
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+
+def memory_usage():
+    """ function returns the (current, max) resident memory of the
+    process in bytes. Either can be None where it is not available """
+
+    current = None
+    try:
+        with open('/proc/self/statm') as statm: # Linux
+            current = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    maximum = None
+    if resource is not None:
+        maximum = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin': # kilobytes, except on macOS
+            maximum *= 1024
+    return current, maximum
+
+
+class MetricsWriter():
+    """ class writes the samples of the crawl of a spider to its metrics files """
+
+    def __init__(self, spider_name, directory=None, worker=None, started=None):
+        """ PARAMETERS:
+        - spider_name: the name of the spider
+
+        - directory: the metrics directory. default is ED_OUTPUT_PATH/metrics
+
+        - worker: the worker id, for the workers of a crawl
+
+        - started: the start time of the crawl (a datetime). default is now """
+
+        self.spider_name = spider_name
+        self.worker = worker
+        self.directory = pathlib.Path(directory or DEFAULT_DIR)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        started = started or datetime.now()
+        stem = spider_name if worker is None else f'{spider_name}.{worker}'
+        self.jsonl_path = self.directory / f"{stem}-{started.strftime('%Y%m%d-%H%M%S')}.jsonl"
+        self.prom_path = self.directory / f'{stem}.prom'
+        self.labels = {'spider': spider_name}
+        if worker is not None:
+            self.labels['worker'] = worker
+
+    def write(self, sample):
+        """ appends 'sample' (a dict, see `MetricsExtension.sample()`)
+        to the json-lines file and writes it to the Prometheus textfile """
+
+        with open(self.jsonl_path, 'a') as jsonl_file:
+            jsonl_file.write(json.dumps(sample, default=str) + '\n')
+
+        # the textfile is replaced at once, so it is never read half written
+        temporary_path = self.prom_path.with_name(self.prom_path.name + '.tmp')
+        with open(temporary_path, 'w') as prom_file:
+            prom_file.write(self.prometheus_text(sample))
+        os.replace(temporary_path, self.prom_path)
+
+    def prometheus_text(self, sample):
+        """ returns 'sample' in the Prometheus text exposition format """
+
+        lines = []
+
+        def metric(name, metric_type, help_text, value):
+            if value is None:
+                return
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} {metric_type}')
+            lines.append(f'{PREFIX}_{name}{self._labels()} {value}')
+
+        metric('pages_total', 'counter', 'Pages (responses) received', sample['pages'])
+        metric('items_total', 'counter', 'Items (datasets) scraped', sample['items'])
+        metric('response_bytes_total', 'counter', 'Bytes of the responses received', sample['bytes'])
+        metric('pages_per_second', 'gauge', 'Pages received per second over the last interval',
+               sample['pages_per_sec'])
+        metric('items_per_second', 'gauge', 'Items scraped per second over the last interval',
+               sample['items_per_sec'])
+        metric('bytes_per_second', 'gauge', 'Response bytes received per second over the last interval',
+               sample['bytes_per_sec'])
+        metric('scheduler_queue_size', 'gauge', 'Requests waiting in the scheduler', sample['scheduler_queue'])
+        metric('requests_in_progress', 'gauge', 'Requests being downloaded', sample['in_progress'])
+        metric('memory_rss_bytes', 'gauge', 'Resident memory of the crawl process', sample['rss_bytes'])
+        metric('memory_max_rss_bytes', 'gauge', 'Max resident memory of the crawl process',
+               sample['max_rss_bytes'])
+        metric('elapsed_seconds', 'gauge', 'Seconds since the spider opened', sample['elapsed'])
+
+        if sample['latency']:
+            name = f'{PREFIX}_download_latency_seconds'
+            lines.append(f'# HELP {name} Download latency of the responses, per host')
+            lines.append(f'# TYPE {name} histogram')
+            for host, histogram in sorted(sample['latency'].items()):
+                for bound, count in histogram['buckets'].items():
+                    lines.append(f'{name}_bucket{self._labels(host=host, le=bound)} {count}')
+                lines.append(f'{name}_sum{self._labels(host=host)} {histogram["sum"]}')
+                lines.append(f'{name}_count{self._labels(host=host)} {histogram["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _labels(self, **labels):
+        labels = dict(self.labels, **labels)
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _escape(value):
+    """ escapes a Prometheus label value """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
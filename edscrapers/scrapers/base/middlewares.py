@@ -1,7 +1,26 @@
+import os
 import re
+import pickle
+import logging
+import functools
+from urllib.parse import urlparse
+
+from scrapy import Request, signals
+from scrapy.exceptions import NotConfigured, DontCloseSpider
+from scrapy.http import TextResponse
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
 from scrapy.spidermiddlewares.offsite import OffsiteMiddleware
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.utils.python import to_unicode
+
+from edscrapers.scrapers.base import documents
+from edscrapers.scrapers.base import metadata
+from edscrapers.scrapers.base import incremental
+from edscrapers.scrapers.base import timing
+from edscrapers.scrapers.base.graph import hold_lock
+from edscrapers.scrapers.base.models import Dataset
 
-import bs4
+logger = logging.getLogger(__name__)
 
 class RegexOffsiteMiddleware(OffsiteMiddleware):
     def get_host_regex(self, spider):
@@ -20,47 +39,587 @@ class RegexOffsiteMiddleware(OffsiteMiddleware):
             return re.compile(regex)
 
 
+class DocumentCacheMiddleware():
+    """ spider middleware which selects the html parsing backend for each response
+    and frees the parsed documents cached for a response
+    (see edscrapers.scrapers.base.documents) once the response
+    leaves the spider middleware chain.
+
+    The backend is taken from the 'html_parser_backend' attribute of the
+    spider, or from the 'HTML_PARSER_BACKEND' setting if the spider does not
+    define one.
+    The number of parses done and avoided during the crawl is recorded in the
+    scrapy stats as 'documents/parsed' and 'documents/reused' """
+
+    def __init__(self, stats, backend=documents.DEFAULT_BACKEND):
+        self.stats = stats
+        self.backend = documents.check_backend(backend)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats,
+                   crawler.settings.get('HTML_PARSER_BACKEND', documents.DEFAULT_BACKEND))
+
+    def spider_backend(self, spider):
+        """ returns the html parsing backend to use for the provided spider """
+        backend = getattr(spider, 'html_parser_backend', None)
+        if backend:
+            return documents.check_backend(backend)
+        return self.backend
+
+    def process_spider_input(self, response, spider):
+        documents.set_backend(response, self.spider_backend(spider))
+
+    def process_spider_output(self, response, result, spider):
+        # the parsers are generators, so the cached document is still in use
+        # until the output of the spider callback has been fully consumed
+        try:
+            for item_or_request in result:
+                yield item_or_request
+        finally:
+            self._release(response, spider)
+
+    def process_spider_exception(self, response, exception, spider):
+        self._release(response, spider)
+
+    def _release(self, response, spider):
+        parsed, reused = documents.release(response)
+        if parsed:
+            self.stats.inc_value('documents/parsed', count=parsed, spider=spider)
+        if reused:
+            self.stats.inc_value('documents/reused', count=reused, spider=spider)
+
+
+class ResourceHeadersMiddleware():
+    """ spider middleware which adds the 'headers' (content-type, last-modified
+    and content-length) of every resource of the Datasets yielded by the parsers.
+
+    Instead of blocking the parse callback with a http call per resource, the
+    headers are fetched with scrapy HEAD requests. Each Dataset is held back
+    until all of its resources' HEAD requests have completed (or failed/timed out),
+    and is then emitted to the item pipelines. Pages keep being crawled at full
+    concurrency in the meantime.
+
+    HEAD requests are sent on their own download slot per host
+    (so they never queue behind page downloads) and a resource linked
+    from several pages at the same time is only requested once.
+
+    Resource headers are kept in the resource metadata cache
+    (see edscrapers.scrapers.base.metadata). Cached headers younger than the
+    cache ttl are used without a HEAD request, older ones are revalidated with a
+    conditional HEAD request. Cache usage is recorded in the scrapy stats as
+    'resource_metadata/hit', 'resource_metadata/miss', 'resource_metadata/stale'
+    and 'resource_metadata/revalidated'
+
+    The spider is kept open (on spider_idle) while Datasets are waiting. A
+    Dataset whose HEAD requests were all dropped is released when the spider is idle,
+    with the headers of its unanswered resources set to None, through a 'data:'
+    request (so it goes through the item pipelines like any other item).
+    The number of resources left without headers is recorded in the scrapy
+    stats as 'resource_headers/released'.
+
+    The HEAD requests can not be kept in a JOBDIR (their callbacks are bound to
+    this middleware), so when the spider closes before they are all answered (e.g.
+    an interrupted crawl, or CLOSESPIDER_* limits), the Datasets still waiting are
+    saved in the JOBDIR, and emitted (with the headers they have) when the crawl
+    is resumed ('resource_headers/saved'). Without a JOBDIR they are lost, and counted
+    as 'resource_headers/lost_datasets'.
+    A failure of the resource metadata cache is logged, and never holds a Dataset back.
+    This middleware must come after the scrapy DepthMiddleware (900), so the
+    HEAD requests are never dropped by DEPTH_LIMIT.
+
+    Settings:
+    - RESOURCE_HEADERS_ENABLED: fetch the resource headers. default is True
+    - RESOURCE_HEADERS_TIMEOUT: download timeout (in seconds) for a HEAD request.
+    default is 30
+    - RESOURCE_METADATA_CACHE_ENABLED: use the resource metadata cache. default is True
+    - RESOURCE_METADATA_TTL: time (in seconds) cached headers are used without
+    revalidation. default is 7 days """
+
+    # meta key which identifies the requests sent by this middleware (they are not pages)
+    META_KEY = 'resource_headers_url'
+    # file of the JOBDIR the Datasets still waiting when the spider closes are saved to
+    SAVED_FILE = 'resource_headers_waiting.pickle'
+    # url of the requests which release Datasets (no download is made)
+    RELEASE_URL = 'data:,'
+
+    def __init__(self, stats, enabled=True, timeout=30, cache=None, crawler=None, job_dir=None):
+        self.crawler = crawler
+        self.stats = stats
+        self.enabled = enabled
+        self.timeout = timeout
+        self.cache = cache # the resource metadata cache (or None)
+        self.job_dir = job_dir
+        # resources waiting for a HEAD request, keyed by the requested url
+        self.waiting = dict()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        enabled = crawler.settings.getbool('RESOURCE_HEADERS_ENABLED', True)
+        cache = None
+        if enabled and crawler.settings.getbool('RESOURCE_METADATA_CACHE_ENABLED', True):
+            cache = metadata.ResourceMetadataCache(
+                        ttl=crawler.settings.getfloat('RESOURCE_METADATA_TTL', metadata.DEFAULT_TTL))
+        middleware = cls(crawler.stats, enabled=enabled,
+                         timeout=crawler.settings.getfloat('RESOURCE_HEADERS_TIMEOUT', 30),
+                         cache=cache, crawler=crawler, job_dir=crawler.settings.get('JOBDIR'))
+        crawler.signals.connect(middleware.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_start_requests(self, start_requests, spider):
+        # the Datasets saved by the interrupted crawl are emitted first
+        datasets = self.load_saved()
+        if datasets:
+            spider.logger.info(f'Emitting {len(datasets)} datasets saved by the interrupted crawl')
+            yield self.release_request(lambda response: self.release_saved(datasets))
+        for request in start_requests:
+            yield request
+
+    def spider_idle(self, spider):
+        if not self.waiting:
+            return
+        # the spider is idle, so no HEAD request is left to answer the resources still waiting
+        urls = list(self.waiting)
+        self.crawler.engine.crawl(self.release_request(lambda response: self.release(urls, spider)), spider)
+        raise DontCloseSpider
+
+    def release_request(self, callback):
+        """ creates a request which calls 'callback' without downloading anything """
+
+        return Request(self.RELEASE_URL, callback=callback, dont_filter=True, priority=1,
+                       meta={self.META_KEY: None, 'dont_cache': True, 'dont_obey_robotstxt': True})
+
+    def release(self, urls, spider):
+        """ sets the headers of the resources waiting for 'urls' to None.
+        Returns the Datasets which have no more resources waiting """
+
+        released = []
+        for url in urls:
+            if url in self.waiting:
+                self.stats.inc_value('resource_headers/released', count=len(self.waiting[url]), spider=spider)
+                released.extend(self.complete(url, None))
+        return released
+
+    def load_saved(self):
+        """ returns the Datasets saved in the JOBDIR by the interrupted crawl """
+
+        if not self.enabled or not self.job_dir:
+            return []
+        path = os.path.join(self.job_dir, self.SAVED_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as saved_file:
+            return pickle.load(saved_file)
+
+    def release_saved(self, datasets):
+        # once emitted, the Datasets are no longer kept in the JOBDIR
+        os.remove(os.path.join(self.job_dir, self.SAVED_FILE))
+        return datasets
+
+    def spider_closed(self, spider):
+        if self.waiting:
+            self.save_waiting(spider)
+        if self.cache is not None:
+            self.cache.close()
+            spider.logger.info('Resource metadata cache: %(hit)d hits, %(miss)d misses, '
+                               '%(stale)d stale (%(revalidated)d revalidated)', self.cache.counts)
+
+    def save_waiting(self, spider):
+        """ saves the Datasets still waiting in the JOBDIR (with the headers of
+        their unanswered resources set to None), so the resumed crawl emits them """
+
+        datasets = []
+        for url in list(self.waiting):
+            datasets.extend(self.complete(url, None))
+        if not self.job_dir:
+            self.stats.inc_value('resource_headers/lost_datasets', count=len(datasets), spider=spider)
+            spider.logger.warning(f'{len(datasets)} datasets still waiting for resource headers are lost '
+                                  f'(the crawl is not resumable)')
+            return
+
+        # the Datasets saved by a previous run and not emitted yet are kept
+        datasets = self.load_saved() + datasets
+        with open(os.path.join(self.job_dir, self.SAVED_FILE), 'wb') as saved_file:
+            pickle.dump(datasets, saved_file, protocol=4)
+        self.stats.set_value('resource_headers/saved', len(datasets), spider=spider)
+        spider.logger.info(f'{len(datasets)} datasets still waiting for resource headers are saved '
+                           f'for the resumed crawl')
+
+    def process_spider_output(self, response, result, spider):
+
+        for item_or_request in result:
+            if not self.enabled or not isinstance(item_or_request, Dataset):
+                yield item_or_request
+                continue
+
+            dataset = _PendingDataset(item_or_request)
+            for resource in item_or_request.get('resources', []):
+                if 'headers' in resource: # the headers have already been set
+                    continue
+
+                url = self.resource_url(item_or_request, resource)
+                if url is None: # no HEAD request can be made for this resource
+                    resource['headers'] = None
+                    continue
+
+                dataset.pending += 1
+                if url in self.waiting: # a HEAD request for this url is already in-flight
+                    self.waiting[url].append((dataset, resource))
+                    self.stats.inc_value('resource_headers/coalesced', spider=spider)
+                    continue
+
+                entry = None
+                if self.cache is not None:
+                    state, entry = self._cached(self.cache.lookup, url, default=(metadata.MISS, None))
+                    self.stats.inc_value(f'resource_metadata/{state}', spider=spider)
+                    if state == metadata.FRESH: # no need for a HEAD request
+                        resource['headers'] = metadata.resource_headers(entry)
+                        dataset.pending -= 1
+                        continue
+
+                self.waiting[url] = [(dataset, resource)]
+                self.stats.inc_value('resource_headers/requested', spider=spider)
+                yield self.head_request(url, entry)
+
+            if dataset.pending == 0: # nothing to wait for
+                yield item_or_request
+            else:
+                self.stats.inc_value('resource_headers/datasets_delayed', spider=spider)
+
+    def resource_url(self, dataset, resource):
+        """ returns the absolute url for the HEAD request of a resource or
+        None if the resource url is not a http url """
+
+        return metadata.resource_url(resource.get('source_url') or dataset.get('source_url'),
+                                     resource.get('url'))
+
+    def head_request(self, url, entry=None):
+        """ creates the HEAD request for a resource url.
+        If a (stale) cache 'entry' is provided, the request is a
+        conditional request which revalidates the entry """
+
+        meta = {self.META_KEY: url,
+                'download_slot': f'resource-headers:{urlparse(url).netloc}',
+                'download_timeout': self.timeout}
+        if self.cache is not None:
+            # the metadata cache replaces the http cache for HEAD requests
+            meta['dont_cache'] = True
+            meta['handle_httpstatus_list'] = [304]
+
+        return Request(url, method='HEAD',
+                       headers=metadata.conditional_headers(entry),
+                       callback=self.headers_received,
+                       errback=self.headers_failed,
+                       dont_filter=True, # the same resource may be linked from many pages
+                       priority=1,
+                       meta=meta)
+
+    def headers_received(self, response):
+        """ callback for successful HEAD requests """
+
+        url = response.meta[self.META_KEY]
+        if response.status == 304: # the cached headers are still valid
+            self._cached(self.cache.revalidated, url)
+            self.stats.inc_value('resource_metadata/revalidated')
+            entry = self._cached(self.cache.get, url)
+            if entry is not None:
+                return self.complete(url, metadata.resource_headers(entry))
+            return self.complete(url, self.extract_headers(response.headers))
+
+        if self.cache is not None:
+            self._cached(self.cache.store, url, response.headers, response.status)
+        return self.complete(url, self.extract_headers(response.headers))
+
+    def headers_failed(self, failure):
+        """ errback for failed HEAD requests.
+        For http error responses (e.g. 404) the headers of the error response are used,
+        otherwise (e.g. timeouts, dns errors) the headers are set to None """
+
+        if failure.check(HttpError):
+            response = failure.value.response
+            if self.cache is not None:
+                self._cached(self.cache.store, response.meta[self.META_KEY], response.headers, response.status)
+            return self.complete(response.meta[self.META_KEY],
+                                 self.extract_headers(response.headers))
+
+        self.stats.inc_value('resource_headers/failed')
+        return self.complete(failure.request.meta[self.META_KEY], None)
+
+    def _cached(self, cache_call, *args, default=None):
+        """ returns the result of the resource metadata cache call 'cache_call',
+        or 'default' if the cache fails (e.g. a locked or corrupt database) """
+
+        try:
+            return cache_call(*args)
+        except Exception as exc:
+            logger.error(f'Resource metadata cache error ({cache_call.__name__}): {exc}')
+            self.stats.inc_value('resource_metadata/errors')
+            return default
+
+    def extract_headers(self, raw_headers):
+        """ returns the resource headers kept for a resource """
+
+        headers = dict()
+        for name in ('Content-Type', 'Last-Modified', 'Content-Length'):
+            value = raw_headers.get(name)
+            headers[name.lower()] = to_unicode(value, errors='replace') if value is not None else None
+        return headers
+
+    def complete(self, url, headers):
+        """ sets the headers for all resources waiting for 'url'.
+        Returns the Datasets which have no more resources waiting """
+
+        completed = []
+        for dataset, resource in self.waiting.pop(url, []):
+            resource['headers'] = headers
+            dataset.pending -= 1
+            if dataset.pending == 0:
+                completed.append(dataset.dataset)
+        return completed
+
+
+class _PendingDataset():
+    """ class holds a Dataset waiting for the headers of its resources """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.pending = 0 # number of resources still waiting for headers
+
+
 class GraphMiddleWare():
-    
+    """ spider middleware which adds every page crawled (and the link it was
+    reached from) to the crawl graph.
+
+    The vertices and edges are staged (see `ScraperGraph.stage_vertex()`)
+    and added to the graph in batches, once 'GRAPH_FLUSH_SIZE' vertices and
+    edges are staged or 'GRAPH_FLUSH_INTERVAL' seconds after the last batch.
+    How long the graph lock is held and the cost of the batches are recorded
+    in the scrapy stats ('graph/lock_*' and 'graph/flush_*').
+
+    In worker mode (FRONTIER_ENABLED, see scrapers/base/frontier.py) the
+    graph of a worker only holds the pages it crawled, so the page a link
+    was found on may have been crawled by another worker. Such pages are
+    added without a title, and get it when the graphs are merged.
+
+    The title of the page a response was reached from is kept in its meta
+    ('referer_title'), with whether the parsers may download that page when
+    its title is not known ('collection_network_fallback', the
+    COLLECTION_NETWORK_FALLBACK setting of the crawl), see
+    `helpers.extract_dataset_collection_from_response()` """
+
+    # meta key holding the title of the page
+    TITLE_KEY = 'page_title'
+    # meta key holding whether the title of the referring page may be downloaded
+    NETWORK_FALLBACK_KEY = 'collection_network_fallback'
+
+    def __init__(self, stats, flush_size=500, flush_interval=5.0, partial_graph=False,
+                 network_fallback=False):
+        self.stats = stats
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.partial_graph = partial_graph
+        self.network_fallback = network_fallback
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler.stats,
+                         flush_size=crawler.settings.getint('GRAPH_FLUSH_SIZE', 500),
+                         flush_interval=crawler.settings.getfloat('GRAPH_FLUSH_INTERVAL', 5.0),
+                         partial_graph=crawler.settings.getbool('FRONTIER_ENABLED', False),
+                         network_fallback=crawler.settings.getbool('COLLECTION_NETWORK_FALLBACK', False))
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_closed(self, spider):
+        graph = getattr(spider, 'scraper_graph', None)
+        if graph is None or not hasattr(graph, 'flush_stats'):
+            return
+        flush_stats = graph.flush_stats
+        self.stats.set_value('graph/flushes', flush_stats['flushes'], spider=spider)
+        self.stats.set_value('graph/flushed_vertices', flush_stats['vertices'], spider=spider)
+        self.stats.set_value('graph/flushed_edges', flush_stats['edges'], spider=spider)
+        self.stats.set_value('graph/flush_seconds', round(flush_stats['seconds'], 6), spider=spider)
+        self.stats.set_value('graph/flush_max_seconds', round(flush_stats['max_seconds'], 6), spider=spider)
+        for key in ('graph/lock_wait_seconds', 'graph/lock_hold_seconds', 'graph/lock_hold_max_seconds'):
+            value = self.stats.get_value(key, spider=spider)
+            if value is not None:
+                self.stats.set_value(key, round(value, 6), spider=spider)
+
     def process_spider_input(self, response, spider):
 
+        # responses for resource HEAD requests are not pages, so they are not part of the graph
+        if ResourceHeadersMiddleware.META_KEY in response.meta:
+            return
+
+        response.meta[self.NETWORK_FALLBACK_KEY] = self.network_fallback
+
         # ensure that the response text gotten is a string
         #if not isinstance(getattr(response, 'text', None), str):
         #    raise TypeError("invalid response type gotten. Expected 'str' type")
 
-        try:
-            soup_parser = bs4.BeautifulSoup(response.text, 'html5lib')
-        except Exception as exc:
-            response_text = '<html><head><title>[no title]</title></head><body></body></html>'
-            soup_parser = bs4.BeautifulSoup(response_text, 'html5lib')
-            #raise exc
-
         current_vertex = None # holds the current vertex which represents the current Response
-        
-        with spider.scraper_graph.graph_lock:
+        referer = str(response.request.headers.get(b'Referer', b''), encoding='utf-8')
+
+        # get the page title before taking the lock, so the lock is not held while parsing.
+        # the parsed document is cached for the response, so the parsers reuse it
+        title = None
+        if not spider.scraper_graph.has_vertex(response.url):
+            with timing.scope(spider.name, __name__):
+                title = self.page_title(response)
+
+        with hold_lock(spider.scraper_graph, self.stats, spider) as graph:
             # check if this particular vertex already exist
-            try:
-                current_vertex = spider.scraper_graph.vs.find(name=response.url)
-            except:
-                pass
+            current_vertex = graph.find_vertex(response.url)
             if not current_vertex: # if the current vertex does NOTalready exist, create it
-                current_vertex = spider.scraper_graph.add_vertex(name=response.url, color='pink', shape=1)
+                current_vertex = graph.stage_vertex(name=response.url, color='pink', shape=1)
                 current_vertex['label'] = f"P{current_vertex.index}" # add label for the vertex
                 # set the title for the vertex
-                if soup_parser.head.find(name='title'):
-                    current_vertex['title'] = str(soup_parser.head.\
-                            find(name='title').string).strip()
-                else:
-                    current_vertex['title'] = '[no title]'
+                current_vertex['title'] = title if title is not None else self.page_title(response)
 
             if response.meta.get('depth', 0) == 0: # this is a response from a start url
-                spider.scraper_graph.add_edge(source='base_vertex', target=current_vertex['name'])
+                graph.stage_edge(source='base_vertex', target=current_vertex.index)
 
-            elif str(response.request.headers.get(b'Referer', b''), encoding='utf-8') == response.url:
+            elif referer == response.url:
                 # this is also a response from a start url
-                spider.scraper_graph.add_edge(source='base_vertex', target=current_vertex['name'])
+                graph.stage_edge(source='base_vertex', target=current_vertex.index)
             
             else:
                 # get the parent vertex this response
-                parent_vertex = spider.scraper_graph.vs.find(name=str(response.request.headers.get(b'Referer', b''), encoding='utf-8'))
-                spider.scraper_graph.add_edge(source=parent_vertex['name'], target=current_vertex['name'])
\ No newline at end of file
+                parent_vertex = graph.find_vertex(referer)
+                if parent_vertex is None and self.partial_graph:
+                    # the parent page was crawled by another worker
+                    parent_vertex = graph.stage_vertex(name=referer, color='pink', shape=1, title=None)
+                    parent_vertex['label'] = f"P{parent_vertex.index}"
+                if parent_vertex is None:
+                    raise ValueError('no such vertex')
+                graph.stage_edge(source=parent_vertex.index, target=current_vertex.index)
+                # keep the title of the parent page with the response, so parsers can
+                # create the dataset Source without downloading the parent page again
+                response.meta['referer_title'] = parent_vertex['title']
+
+            # add the staged vertices and edges to the graph, if it is time to
+            graph.maybe_flush(self.flush_size, self.flush_interval)
+
+        if response.meta.get('depth', 0) != 0 and not response.meta.get('referer_title'):
+            # the parent page has no title in the graph, so try the http cache
+            if referer and referer != response.url:
+                response.meta['referer_title'] = self.cached_title(spider, referer)
+
+    def page_title(self, response):
+        """ returns the title of the page in the response or '[no title]'
+        if the page has no title. The title is kept in the response meta
+        ('page_title'), where it may already be (see IncrementalMiddleware) """
+
+        if response.meta.get(self.TITLE_KEY) is None:
+            response.meta[self.TITLE_KEY] = documents.get_title(response)
+        return response.meta[self.TITLE_KEY]
+
+    def cached_title(self, spider, url):
+        """ returns the title of the page at 'url' from the http cache
+        or None if the page is not cached """
+
+        for middleware in spider.crawler.engine.downloader.middleware.middlewares:
+            if isinstance(middleware, HttpCacheMiddleware):
+                cached_response = middleware.storage.retrieve_response(spider, Request(url))
+                if cached_response is None or not isinstance(cached_response, TextResponse):
+                    return None
+                return documents.get_title(cached_response)
+        return None
+
+
+class IncrementalMiddleware():
+    """ spider middleware of the incremental crawl mode (see
+    edscrapers.scrapers.base.incremental), enabled by the INCREMENTAL_ENABLED setting.
+
+    The body of every page crawled through a rule of the spider is hashed.
+    When the hash matches the one stored from the previous crawl, the
+    datasets stored for the page are yielded instead of parsing the page
+    (the links of the page are still followed), and the stored title is used
+    by the GraphMiddleWare. Otherwise the page is parsed and its hash, title
+    and datasets are stored.
+    This middleware must come before the GraphMiddleWare.
+    The number of unchanged, changed and new pages is recorded in the scrapy
+    stats as 'incremental/unchanged', 'incremental/changed' and 'incremental/new'
+
+    Settings:
+    - INCREMENTAL_ENABLED: use the incremental crawl mode. default is False
+    - INCREMENTAL_STORE_PATH: the page store database.
+    default is ED_OUTPUT_PATH/scrapy/incremental.sqlite """
+
+    # meta keys holding the body hash and the stored datasets of an unchanged page
+    HASH_KEY = 'incremental_hash'
+    DATASETS_KEY = 'incremental_datasets'
+
+    def __init__(self, stats, store):
+        self.stats = stats
+        self.store = store
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('INCREMENTAL_ENABLED', False):
+            raise NotConfigured
+        store = incremental.PageStore(crawler.settings.get('INCREMENTAL_STORE_PATH') or
+                                      incremental.DEFAULT_PATH)
+        middleware = cls(crawler.stats, store)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        # a spider middleware can not skip the spider callback, so the
+        # callbacks of the (CrawlSpider) rules yield the stored datasets instead
+        for rule in getattr(spider, '_rules', []):
+            if rule.callback is not None:
+                rule.callback = self._wrap(rule.callback)
+
+    def spider_closed(self, spider):
+        self.store.close()
+        spider.logger.info('Incremental crawl: %(unchanged)d unchanged, %(changed)d changed '
+                           'and %(new)d new pages', self.store.counts)
+
+    def _wrap(self, callback):
+        @functools.wraps(callback)
+        def incremental_callback(response, **kwargs):
+            datasets = response.meta.get(self.DATASETS_KEY)
+            if datasets is not None: # the page has not changed
+                return datasets
+            return callback(response, **kwargs)
+        return incremental_callback
+
+    def process_spider_input(self, response, spider):
+
+        # only the pages parsed by the rule callbacks are skipped
+        if ResourceHeadersMiddleware.META_KEY in response.meta or 'rule' not in response.meta:
+            return
+        if response.status != 200:
+            return
+
+        page_hash = incremental.body_hash(response)
+        response.meta[self.HASH_KEY] = page_hash
+        state, page = self.store.lookup(spider.name, response.url, page_hash)
+        self.stats.inc_value(f'incremental/{state}', spider=spider)
+        if state == incremental.UNCHANGED:
+            response.meta[self.DATASETS_KEY] = page['datasets']
+            if page['title'] is not None:
+                response.meta[GraphMiddleWare.TITLE_KEY] = page['title']
+            self.stats.inc_value('incremental/reemitted_datasets', count=len(page['datasets']), spider=spider)
+
+    def process_spider_output(self, response, result, spider):
+
+        page_hash = response.meta.get(self.HASH_KEY)
+        if page_hash is None or self.DATASETS_KEY in response.meta:
+            # not a parsed page, or its stored datasets are being yielded
+            yield from result
+            return
+
+        datasets = []
+        for item_or_request in result:
+            if isinstance(item_or_request, Dataset):
+                # keep the dataset as yielded by the parser (the following
+                # middlewares and the pipelines change it)
+                datasets.append(incremental.to_record(item_or_request))
+            yield item_or_request
+        # the page was parsed without errors, so its datasets are complete
+        self.store.store(spider.name, response.url, page_hash,
+                         response.meta.get(GraphMiddleWare.TITLE_KEY), datasets)
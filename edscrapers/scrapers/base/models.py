@@ -39,13 +39,15 @@ class Dataset(Item):
     saved_as_file = Field()
     publisher = Field()
 
-    def toJSON(self):
+    def toJSON(self, indent=2):
         # dont convert the collection field to JSON
         if self.__dict__['_values'].get('collection', None):
             del self.__dict__['_values']['collection']
 
+        # a None 'indent' gives compact json (e.g. for the JSONL dataset store)
+        separators = (',', ':') if indent is None else None
         return json.dumps(self, default=lambda o: o.__dict__['_values'],
-                          sort_keys=False, indent=2)
+                          sort_keys=False, indent=indent, separators=separators)
 
 
 class Resource(Item):
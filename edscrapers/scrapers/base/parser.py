@@ -1,33 +1,63 @@
 """ file containers utility functions to be used by BeautifulSoup parser"""
 
-import edscrapers.scrapers.base.helpers as h
+from edscrapers.scrapers.base import classifier
+from edscrapers.scrapers.base import documents
 
 # contains list of data resources to exclude from dataset
-deny_list = ['site-list.xls']
+# (see edscrapers.scrapers.base.classifier)
+deny_list = classifier.DENY_LIST
 
 def resource_checker(tag_attr: str):
     """ function is used as a filter for BeautifulSoup to
     locate resource (i.e. DATA_EXTENSIONS) files"""
 
-    if tag_attr != '' and tag_attr is not None:
-        for extension in h.get_data_extensions().keys():
-            if tag_attr.lower().endswith(f'{extension}') and\
-                (tag_attr[tag_attr.rfind('/')+1:].lower() not in deny_list):
-                return True
-        # if code gets here, no resources found
-        return False
     # tag_attr does not match resource required, so return False
-    return False
+    if tag_attr == '' or tag_attr is None:
+        return False
+    return classifier.link_classifier.is_data(tag_attr)
 
 def document_checker(tag_attr: str):
     """ function is used as a filter for BeautifulSoup to
     locate document files (i.e. DOCUMENT_EXTENSIONS) files"""
 
-    if tag_attr != '' and tag_attr is not None:
-        for extension in h.get_document_extensions().keys():
-            if tag_attr.endswith(f'.{extension}'):
+    # tag_attr does not match resource required, so return False
+    if tag_attr == '' or tag_attr is None:
+        return False
+    return classifier.link_classifier.is_document(tag_attr)
+
+def has_resource_link(res):
+    """ function checks if the page in the provided response links to
+    any resource (i.e. DATA_EXTENSIONS) file.
+    When the 'parsel' backend is selected for the response, the check is done
+    with the native selector, so pages without resources are never parsed
+    into a BeautifulSoup document """
+
+    if documents.get_backend(res) == 'parsel':
+        selector = documents.get_selector(res)
+        if selector is None:
+            return False
+        for href in selector.xpath('//body//a/@href').getall():
+            if resource_checker(href):
                 return True
-        # if code gets here, no resources found
         return False
-    # tag_attr does not match resource required, so return False
-    return False
+
+    soup_parser = documents.get_soup(res)
+    return soup_parser.body.find(name='a', href=resource_checker,
+                                 recursive=True) is not None
+
+def get_meta_content(res, name: str):
+    """ function returns the content of the <meta> tag identified by 'name'
+    in the head of the page in the provided response or None if the tag
+    does not exist """
+
+    if documents.get_backend(res) == 'parsel':
+        selector = documents.get_selector(res)
+        if selector is None:
+            return None
+        return selector.xpath('//head/meta[@name=$name]/@content', name=name).get()
+
+    soup_parser = documents.get_soup(res)
+    try:
+        return soup_parser.head.find(name='meta', attrs={'name': name})['content']
+    except:
+        return None
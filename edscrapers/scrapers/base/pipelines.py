@@ -5,21 +5,105 @@ import hashlib
 from datetime import datetime
 from pathlib import Path
 from slugify import slugify
-from scrapy.exceptions import DropItem
+from scrapy.exceptions import DropItem, NotConfigured
+from twisted.internet.threads import deferToThread
 
 from edscrapers.cli import logger
-from edscrapers.scrapers.base.graph import GraphWrapper
+from edscrapers.scrapers.base.graph import GraphWrapper, hold_lock
+from edscrapers.scrapers.base import store
+from edscrapers.scrapers.base import exports
+from edscrapers.scrapers.base import writer
+from edscrapers.scrapers.base import frontier
+from edscrapers.scrapers.base import timing
+from edscrapers.scrapers.base import seen
+from edscrapers.scrapers.base import canonical
 
 
 
 class JsonWriterPipeline(object):
+    """ pipeline writes every dataset to the output directory, either as its
+    own json file (OUTPUT_MODE 'files', the default) or appended to the
+    sharded dataset store (OUTPUT_MODE 'jsonl', see scrapers/base/store.py).
+
+    Unless OUTPUT_WRITER_ENABLED is False, the datasets are written (and logged)
+    by a background writer (see scrapers/base/writer.py), so the crawl is not
+    stalled by the filesystem. The writer stats are recorded as 'writer/...'
+
+    In worker mode (see scrapers/base/frontier.py), the workers of a crawl
+    write to the same output directories. Every worker appends to shards
+    of its own ('datasets-<spider>.worker-<worker id>-*'), so the store
+    records of the workers never interleave """
+
+    def __init__(self, mode=store.FILES, shard_size=store.DEFAULT_SHARD_SIZE, compression=None,
+                 stats=None, writer_enabled=True, writer_threads=writer.DEFAULT_THREADS,
+                 writer_queue_size=writer.DEFAULT_QUEUE_SIZE, worker=None):
+        if mode not in store.OUTPUT_MODES:
+            raise ValueError(f"unknown output mode '{mode}'. Expected one of {list(store.OUTPUT_MODES)}")
+        self.mode = mode
+        self.shard_size = shard_size
+        self.compression = store.check_compression(compression)
+        self.dataset_store = None
+        self.directories = set() # the output directories already created
+
+        self.stats = stats
+        self.writer_enabled = writer_enabled
+        self.writer_threads = writer_threads
+        self.writer_queue_size = writer_queue_size
+        self.writer = None
+        self.worker = worker # the worker id, in worker mode
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(mode=settings.get('OUTPUT_MODE', store.FILES),
+                   shard_size=settings.getint('OUTPUT_SHARD_SIZE', store.DEFAULT_SHARD_SIZE),
+                   compression=settings.get('OUTPUT_COMPRESSION'),
+                   stats=crawler.stats,
+                   writer_enabled=settings.getbool('OUTPUT_WRITER_ENABLED', True),
+                   writer_threads=settings.getint('OUTPUT_WRITER_THREADS', writer.DEFAULT_THREADS),
+                   writer_queue_size=settings.getint('OUTPUT_WRITER_QUEUE_SIZE', writer.DEFAULT_QUEUE_SIZE),
+                   worker=frontier.worker_id(settings) if settings.getbool('FRONTIER_ENABLED') else None)
 
     def open_spider(self, spider):
-        Path(f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{spider.name}").\
-                                                  mkdir(parents=True, exist_ok=True)
+        self._mkdir(f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{spider.name}")
+        if self.mode == store.JSONL:
+            self.dataset_store = store.DatasetStore(os.getenv('ED_OUTPUT_PATH'),
+                                                    shard_size=self.shard_size,
+                                                    compression=self.compression)
+        if self.writer_enabled:
+            self.writer = writer.BackgroundWriter(name=f'{spider.name}-writer',
+                                                  threads=self.writer_threads,
+                                                  queue_size=self.writer_queue_size)
 
     def close_spider(self, spider):
-        pass
+        if self.writer is None:
+            self._close_store()
+            return None
+
+        # wait (off the reactor thread) until every queued dataset is written
+        closing = deferToThread(self.writer.close)
+        closing.addCallback(lambda _: self._record_writer_stats(spider))
+        closing.addBoth(lambda result: self._close_store() or result)
+        return closing
+
+    def _close_store(self):
+        if self.dataset_store is not None:
+            self.dataset_store.close()
+
+    def _record_writer_stats(self, spider):
+        if self.stats is None:
+            return
+        for name, value in self.writer.stats().items():
+            if name == 'max_queue_depth':
+                self.stats.max_value(f'writer/{name}', value, spider=spider)
+            else:
+                self.stats.set_value(f'writer/{name}', value, spider=spider)
+
+    def _mkdir(self, directory):
+        """ creates 'directory' (once per crawl) """
+        if directory not in self.directories:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+            self.directories.add(directory)
 
     def process_item(self, dataset, spider):
 
@@ -32,23 +116,53 @@ class JsonWriterPipeline(object):
                 name = dataset['publisher'].get('name', '')
             except:
                 name = dataset['publisher']
-            Path(f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{spider.name}/{name}").mkdir(parents=True, exist_ok=True)
-            file_path = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{spider.name}/{name}/{file_name}"
+            file_dir = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{spider.name}/{name}"
         else:
             if spider.name in ['oese', 'osers', 'oela', 'octae', 'ope', 'opepd']:
-                Path(f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/edgov/{spider.name}").mkdir(parents=True, exist_ok=True)
-                file_path = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/edgov/{spider.name}/{file_name}"
+                file_dir = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/edgov/{spider.name}"
             else:
-                file_path = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{spider.name}/{file_name}"
-        self._log(dataset)
-        logger.debug(f"Dumping to {file_path}")
-        with open(file_path, 'w') as output:
-            output.write(dataset.toJSON())
-        
+                file_dir = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{spider.name}"
+        file_path = f"{file_dir}/{file_name}"
+
+        # the shards a dataset is appended to (in 'jsonl' mode)
+        store_name = spider.name if self.worker is None else GraphWrapper.worker_stem_name(spider.name,
+                                                                                            self.worker)
+
+        # serialize the dataset now, as the following pipelines may change it
+        # while it is waiting to be written
+        logged_dataset = dict(dataset)
+        with timing.timer('json.serialize', spider.name, __name__):
+            data = dataset.toJSON(indent=None if self.mode == store.JSONL else 2)
+
         # add this attribute so that the saved (relative) location of datasets can be tracked
         dataset['saved_as_file'] = file_path[file_path.find("/scrapers/")+1 : ]
 
-        return dataset # return the dataset
+        # the writes (and the logging of the datasets) are timed as 'json.write'
+        write = timing.timed_function('json.write', spider.name, self._write, __name__)
+
+        if self.writer is None:
+            write(logged_dataset, file_dir, file_path, dataset['saved_as_file'], data, store_name)
+            return dataset # return the dataset
+
+        if self.stats is not None:
+            self.stats.max_value('writer/max_queue_depth', self.writer.queue_depth(), spider=spider)
+        # the returned Deferred only waits if the writer queue is full (backpressure)
+        return self.writer.submit_deferred(dataset, write, logged_dataset, file_dir,
+                                           file_path, dataset['saved_as_file'], data, store_name)
+
+    def _write(self, dataset, file_dir, file_path, saved_as_file, data, spider_name):
+        """ writes (and logs) a serialized dataset. Runs on a writer thread
+        when the background writer is enabled """
+
+        self._log(dataset)
+        if self.mode == store.JSONL:
+            logger.debug(f"Appending {saved_as_file} to the dataset store")
+            self.dataset_store.write(saved_as_file, data, spider_name=spider_name)
+        else:
+            self._mkdir(file_dir)
+            logger.debug(f"Dumping to {file_path}")
+            with open(file_path, 'w') as output:
+                output.write(data)
 
     def _log(self, d):
         logger.info("==================================================================================================")
@@ -61,6 +175,37 @@ class JsonWriterPipeline(object):
             logger.debug(f"\t{r['url']} > {r['name']}")
 
 class GraphItemPipeline:
+    """ pipeline adds every dataset to the crawl graph and writes the graph
+    when the spider closes.
+
+    In worker mode (see scrapers/base/frontier.py), every worker writes its
+    graph to '<spider>.worker-<worker id>.pickle' (without any other export),
+    and `eds merge-graphs` merges the graphs of the workers into the graph of the crawl """
+
+    def __init__(self, stats=None, flush_size=500, flush_interval=5.0,
+                 export_formats=None, export_background=None, svg_max_vertices=None, worker=None):
+        self.stats = stats
+        # the dataset vertices and edges are staged and added to the graph in
+        # batches, like those of the pages (see GraphMiddleWare)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # the graph exports written when the spider closes (see scrapers/base/exports.py)
+        self.export_formats = export_formats
+        self.export_background = export_background
+        self.svg_max_vertices = svg_max_vertices
+        self.worker = worker # the worker id, in worker mode
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats,
+                   flush_size=crawler.settings.getint('GRAPH_FLUSH_SIZE', 500),
+                   flush_interval=crawler.settings.getfloat('GRAPH_FLUSH_INTERVAL', 5.0),
+                   export_formats=crawler.settings.get('GRAPH_EXPORT_FORMATS'),
+                   export_background=crawler.settings.getbool('GRAPH_EXPORT_BACKGROUND', True),
+                   svg_max_vertices=crawler.settings.getint('GRAPH_SVG_MAX_VERTICES',
+                                                            exports.DEFAULT_SVG_MAX_VERTICES),
+                   worker=frontier.worker_id(crawler.settings)\
+                          if crawler.settings.getbool('FRONTIER_ENABLED') else None)
 
     def open_spider(self, spider):
         # create the folder for storing graph files
@@ -68,41 +213,64 @@ class GraphItemPipeline:
                                                   mkdir(parents=True, exist_ok=True)
         print("SPIDER STARTED")
         # setup the graph objet for this scraper
-        # set the graph object as a class attribute
-        if not hasattr(spider, 'scraper_graph'):
-            spider.__class__.scraper_graph = GraphWrapper.get_graph()
+        # every spider (instance) gets a graph of its own, so
+        # spiders running in the same process do not share graphs
+        if getattr(spider, 'scraper_graph', None) is None:
+            spider.scraper_graph = GraphWrapper.create_graph()
 
 
     def close_spider(self, spider):
         print("SPIDER CLOSED")
-        
-        # write the graph to files
+
+        # write the graph files off the reactor thread
+        return deferToThread(self._write_graph_files, spider)
+
+    def _write_graph_files(self, spider):
+        if self.worker is not None:
+            # the graph of a worker is only written to be merged (see `eds merge-graphs`)
+            GraphWrapper.write_graph(spider.scraper_graph,
+                                     file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), "graphs", f"{spider.name}"),
+                                     file_stem_name=GraphWrapper.worker_stem_name(spider.name, self.worker),
+                                     formats=[])
+            return
+
+        # write the graph to files. The exports other than the
+        # latest pickle are done by a background process
         # this method is explicitly thread/proccess safe, so no need for lock
-        GraphWrapper.write_graph(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
+        GraphWrapper.write_graph(spider.scraper_graph,
+                                 file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
                                                             "graphs", f"{spider.name}"),
-                                         file_stem_name=spider.name)
+                                         file_stem_name=spider.name,
+                                         formats=self.export_formats,
+                                         background=self.export_background,
+                                         svg_max_vertices=self.svg_max_vertices)
         
         # create the page legend file for this graph
         # this method is explicitly thread/proccess safe, so no need for lock
-        GraphWrapper.create_graph_page_legend(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
+        GraphWrapper.create_graph_page_legend(spider.scraper_graph,
+                                              file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
                                                             "graphs", f"{spider.name}"),
                                          file_stem_name=spider.name)
             
 
     def process_item(self, dataset, spider):
         
-        with spider.scraper_graph.graph_lock:
+        with hold_lock(spider.scraper_graph, self.stats, spider) as graph:
 
             # check if this dataset already exist, i.e. is this somehow a duplicate scrape of the dataset
-            try:
-                spider.scraper_graph.vs.find(name=dataset['saved_as_file'])
-                # if no error, it means this dataset vertex already exist, so exit method
+            if graph.has_vertex(dataset['saved_as_file']):
+                # this dataset vertex already exist, so exit method
                 return dataset
-            except ValueError: # if error it means this dataset vertex does NOT previously exists, so proceed
-                pass
             
             # find the vertex page that represents this dataset
-            parent_vertex = spider.scraper_graph.vs.find(name=dataset['source_url'])
+            parent_vertex = graph.find_vertex(dataset['source_url'])
+            if parent_vertex is None and spider.settings.get('JOBDIR'):
+                # the page was crawled by the interrupted run of a resumed crawl
+                # (see the saved datasets of the ResourceHeadersMiddleware)
+                parent_vertex = graph.stage_vertex(name=dataset['source_url'], color='pink', shape=1, title=None)
+                parent_vertex['label'] = f"P{parent_vertex.index}"
+            if parent_vertex is None:
+                raise ValueError(f"no such vertex: '{dataset['source_url']}'")
 
             # check if the parent_vertex has an attribute to track if its a dataset page or not
             if 'is_dataset_page' not in parent_vertex.attribute_names() or parent_vertex['is_dataset_page'] is None: # no attribute set
@@ -112,7 +280,7 @@ class GraphItemPipeline:
             parent_vertex['datasets'].add(dataset['saved_as_file'])
 
             # create the vertex to represent this dataset
-            current_vertex = spider.scraper_graph.add_vertex(name=dataset['saved_as_file'], color='blue', shape=1)
+            current_vertex = graph.stage_vertex(name=dataset['saved_as_file'], color='blue', shape=1)
             # change the vertex attribute to visually indicate it is a dataset
             current_vertex['label'] = f"D{current_vertex.index}"
             current_vertex['color'] = 'blue'
@@ -121,21 +289,95 @@ class GraphItemPipeline:
             current_vertex['dataset_url'] = dataset['source_url']
 
             #add the edge between the parent_vertex and current_vertex
-            spider.scraper_graph.add_edge(source=parent_vertex['name'],
-                                          target=current_vertex['name'])
+            graph.stage_edge(source=parent_vertex.index,
+                             target=current_vertex.index)
+
+            # add the staged vertices and edges to the graph, if it is time to
+            graph.maybe_flush(self.flush_size, self.flush_interval)
 
 
         return dataset
 
 
 class DuplicatesPipeline(object):
+    """ pipeline drops the datasets scraped before during the crawl, so the
+    duplicates are never written, nor added to the graph. It must come before
+    the JsonWriterPipeline.
 
-    def __init__(self):
-        self.ids_seen = set()
+    A dataset is a duplicate of another when they have the same key, which is the
+    key of the deduplicate transformer: the canonical form of its 'source_url'
+    (see scrapers/base/canonical.py), lowercased, and its 'name'.
+    The keys are remembered in a seen-set (see scrapers/base/seen.py) which,
+    in a resumable crawl (i.e. with a JOBDIR), is kept in the JOBDIR.
+    In worker mode, the workers share the seen-set kept in their frontier
+    (see `frontier.FrontierSeenSet`), so a dataset scraped by two workers is
+    only written once; DUPLICATES_SEEN_SET does not apply then.
+    The number of datasets dropped is recorded in the scrapy stats as 'duplicates/dropped'
 
-    def process_item(self, item, spider):
-        if item['id'] in self.ids_seen:
-            raise DropItem("Duplicate dataset found: %s" % item)
-        else:
-            self.ids_seen.add(item['source_url'])
-            return item
+    Settings:
+    - DUPLICATES_ENABLED: drop the duplicate datasets. default is True
+    - DUPLICATES_SEEN_SET: 'exact' or 'bloom'. default is 'exact'
+    - DUPLICATES_BLOOM_CAPACITY, DUPLICATES_BLOOM_ERROR_RATE: the number of datasets
+    a 'bloom' seen-set is sized for, and its rate of false duplicates """
+
+    def __init__(self, stats=None, seen_set_kind=seen.EXACT, job_dir=None,
+                 bloom_capacity=seen.DEFAULT_BLOOM_CAPACITY, bloom_error_rate=seen.DEFAULT_BLOOM_ERROR_RATE,
+                 worker=None):
+        if seen_set_kind not in seen.SEEN_SET_KINDS:
+            raise ValueError(f"unknown seen-set '{seen_set_kind}'. Expected one of {list(seen.SEEN_SET_KINDS)}")
+        self.stats = stats
+        self.seen_set_kind = seen_set_kind
+        self.job_dir = job_dir
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.worker = worker # the worker id, in worker mode
+        self.seen_set = None
+        self.canonicalizer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DUPLICATES_ENABLED', True):
+            raise NotConfigured
+        return cls(stats=crawler.stats,
+                   seen_set_kind=settings.get('DUPLICATES_SEEN_SET') or seen.EXACT,
+                   job_dir=settings.get('JOBDIR'),
+                   bloom_capacity=settings.getint('DUPLICATES_BLOOM_CAPACITY', seen.DEFAULT_BLOOM_CAPACITY),
+                   bloom_error_rate=settings.getfloat('DUPLICATES_BLOOM_ERROR_RATE',
+                                                      seen.DEFAULT_BLOOM_ERROR_RATE),
+                   worker=frontier.worker_id(settings) if settings.getbool('FRONTIER_ENABLED') else None)
+
+    def open_spider(self, spider):
+        # the keys of the deduplicate transformer (see transformers/deduplicate/transform.py)
+        self.canonicalizer = canonical.for_spider(None, spider.settings, lowercase=True)
+
+        if self.worker is not None:
+            # the frontier is opened by the FrontierScheduler before the pipelines
+            scheduler = spider.crawler.engine.slot.scheduler
+            if getattr(scheduler, 'frontier', None) is not None:
+                self.seen_set = frontier.FrontierSeenSet(scheduler.frontier)
+                return
+
+        path = None
+        if self.job_dir:
+            # the JOBDIR of `eds scrape --resume` is shared by the spiders
+            stem = spider.name if self.worker is None else GraphWrapper.worker_stem_name(spider.name,
+                                                                                         self.worker)
+            path = os.path.join(self.job_dir, f'datasets-{stem}.{self.seen_set_kind}')
+        self.seen_set = seen.open_seen_set(self.seen_set_kind, path,
+                                           capacity=self.bloom_capacity, error_rate=self.bloom_error_rate)
+
+    def close_spider(self, spider):
+        if self.seen_set is not None:
+            self.seen_set.close()
+
+    def dataset_key(self, dataset):
+        """ returns the key 'dataset' is deduplicated by """
+        return self.canonicalizer.key(dataset['source_url']) + '_' + dataset['name']
+
+    def process_item(self, dataset, spider):
+        if self.seen_set.add(self.dataset_key(dataset)):
+            if self.stats is not None:
+                self.stats.inc_value('duplicates/dropped', spider=spider)
+            raise DropItem(f"Duplicate dataset found: {dataset['source_url']} ({dataset['name']})")
+        return dataset
@@ -0,0 +1,210 @@
+""" module provides the per-host download policies of the scrapers.
+
+The DOWNLOAD_POLICIES setting (see scrapers/base/config.py) is a table of
+download policies keyed by host, so hosts which cope with parallel requests
+can be crawled faster than fragile ones, instead of applying the global
+DOWNLOAD_DELAY and AUTOTHROTTLE settings to every host. A policy may set:
+- 'concurrency': the number of requests downloaded at a time from the host
+- 'delay': the (minimum) delay in seconds between two requests to the host
+- 'autothrottle': throttle the host (default is AUTOTHROTTLE_ENABLED)
+- 'autothrottle_target': the number of requests autothrottle aims to have
+  in flight to the host (default is AUTOTHROTTLE_TARGET_CONCURRENCY)
+- 'max_size': the max size in bytes of a response from the host
+
+The policy of a host is the entry of the host itself or, if there is none,
+the entry of its closest parent domain (e.g. 'ed.gov' for 'www2.ed.gov').
+A crawler class can override the table with a 'download_policies' attribute
+of the same form. Its entries are merged over the entries of the setting
+(e.g. {'ocrdata.ed.gov': {'delay': 5}} only changes the delay).
+
+The policies are applied to the downloader slots of the hosts by the
+`DownloadPolicyMiddleware`, and the `PolicyAutoThrottle` extension (which
+replaces the scrapy AutoThrottle) throttles every host after its policy """
+
+import logging
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.extensions.throttle import AutoThrottle
+
+logger = logging.getLogger(__name__)
+
+# the settings a download policy may hold, and their types
+POLICY_KEYS = {
+    'concurrency': int,
+    'delay': float,
+    'autothrottle': bool,
+    'autothrottle_target': float,
+    'max_size': int,
+}
+
+
+def check_policies(policies):
+    """ function ensures the provided table of download policies is valid.
+    Returns the table, with the values of the policies converted to their
+    types, or raises ValueError """
+
+    checked = dict()
+    for host, policy in (policies or dict()).items():
+        if not isinstance(policy, dict):
+            raise ValueError(f"the download policy of '{host}' is not a dict")
+        unknown = set(policy) - set(POLICY_KEYS)
+        if unknown:
+            raise ValueError(f"unknown download policy setting(s) {sorted(unknown)} for '{host}'. "
+                             f"Expected some of {list(POLICY_KEYS.keys())}")
+        checked[host.lower()] = {key: POLICY_KEYS[key](value) for key, value in policy.items()}
+    return checked
+
+
+def spider_policies(settings, spider):
+    """ function returns the table of download policies of 'spider': the
+    DOWNLOAD_POLICIES setting, with the 'download_policies' attribute of the
+    spider merged over it """
+
+    policies = check_policies(settings.getdict('DOWNLOAD_POLICIES'))
+    for host, policy in check_policies(getattr(spider, 'download_policies', None)).items():
+        policies[host] = dict(policies.get(host, dict()), **policy)
+    return policies
+
+
+class DownloadPolicies():
+    """ class looks up the download policy of the hosts """
+
+    def __init__(self, policies):
+        self.policies = check_policies(policies)
+        self.hosts = dict() # the policy of every host looked up so far
+
+    def for_host(self, host):
+        """ returns the download policy of 'host' or None if it has none """
+
+        if host in self.hosts:
+            return self.hosts[host]
+
+        policy = None
+        if host:
+            labels = host.lower().split('.')
+            # the host itself, then its parent domains
+            for position in range(len(labels)):
+                policy = self.policies.get('.'.join(labels[position:]))
+                if policy is not None:
+                    break
+        self.hosts[host] = policy
+        return policy
+
+    def for_request(self, request):
+        """ returns the download policy of the host of 'request' or None """
+        return self.for_host(urlparse(request.url).hostname)
+
+
+class DownloadPolicyMiddleware():
+    """ downloader middleware which applies the download policy of the host
+    of every request to the downloader slot the request is sent on (its
+    'concurrency' and 'delay'), and the 'max_size' of the policy to the request.
+
+    It must come after the http cache middleware, so the requests
+    served from the cache do not get a slot.
+    The number of slots configured is recorded in the scrapy stats as
+    'download_policy/slots' """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.policies = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not (crawler.settings.getdict('DOWNLOAD_POLICIES') or
+                getattr(crawler.spidercls, 'download_policies', None)):
+            raise NotConfigured
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.policies = DownloadPolicies(spider_policies(self.crawler.settings, spider))
+        for host, policy in sorted(self.policies.policies.items()):
+            spider.logger.info(f'Download policy of {host}: {policy}')
+
+    def process_request(self, request, spider):
+        if self.policies is None:
+            return None
+        policy = self.policies.for_request(request)
+        if policy is None:
+            return None
+
+        if 'max_size' in policy:
+            request.meta.setdefault('download_maxsize', policy['max_size'])
+
+        # the slot is created here if it does not exist yet. Idle slots are
+        # dropped by the downloader, so a slot is (re)configured whenever it is new
+        key, slot = self.crawler.engine.downloader._get_slot(request, spider)
+        if getattr(slot, 'download_policy', None) is not policy:
+            if 'concurrency' in policy:
+                slot.concurrency = policy['concurrency']
+            if 'delay' in policy:
+                slot.delay = policy['delay']
+            slot.download_policy = policy
+            self.stats.inc_value('download_policy/slots', spider=spider)
+        return None
+
+
+class PolicyAutoThrottle(AutoThrottle):
+    """ extension which replaces the scrapy AutoThrottle, and throttles
+    every host after its download policy: hosts can be throttled (or not)
+    whatever the AUTOTHROTTLE_ENABLED setting, with a target concurrency
+    of their own, and the delay of a host never goes below the delay of its policy """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.enabled = settings.getbool('AUTOTHROTTLE_ENABLED')
+        policies = check_policies(settings.getdict('DOWNLOAD_POLICIES'))
+        policies.update(check_policies(getattr(crawler.spidercls, 'download_policies', None)))
+        if not self.enabled and not any(policy.get('autothrottle') for policy in policies.values()):
+            raise NotConfigured
+
+        self.crawler = crawler
+        self.debug = settings.getbool('AUTOTHROTTLE_DEBUG')
+        self.target_concurrency = settings.getfloat('AUTOTHROTTLE_TARGET_CONCURRENCY')
+        self.policies = DownloadPolicies(dict())
+        crawler.signals.connect(self._spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self._response_downloaded, signal=signals.response_downloaded)
+
+    def _spider_opened(self, spider):
+        self.policies = DownloadPolicies(spider_policies(self.crawler.settings, spider))
+        self.mindelay = self._min_delay(spider)
+        self.maxdelay = self._max_delay(spider)
+        if self.enabled:
+            # the hosts without a policy start at AUTOTHROTTLE_START_DELAY
+            spider.download_delay = self._start_delay(spider)
+
+    def _response_downloaded(self, response, request, spider):
+        policy = self.policies.for_request(request) or dict()
+        if not policy.get('autothrottle', self.enabled):
+            return
+        key, slot = self._get_slot(request, spider)
+        latency = request.meta.get('download_latency')
+        if latency is None or slot is None:
+            return
+
+        olddelay = slot.delay
+        self._adjust_delay(slot, latency, response, policy)
+        if self.debug:
+            logger.info(f'slot: {key} | delay: {slot.delay * 1000:.0f} ms '
+                        f'({(slot.delay - olddelay) * 1000:+.0f}) | latency: {latency * 1000:.0f} ms',
+                        extra={'spider': spider})
+
+    def _adjust_delay(self, slot, latency, response, policy=None):
+        """ the delay adjustment of the scrapy AutoThrottle, with the
+        target concurrency and the min delay of the 'policy' of the host """
+
+        policy = policy or dict()
+        # send a request every latency/N seconds to have N requests in flight
+        target_delay = latency / policy.get('autothrottle_target', self.target_concurrency)
+        # move towards the target delay, but increase it at once
+        new_delay = max(target_delay, (slot.delay + target_delay) / 2.0)
+        new_delay = min(max(policy.get('delay', self.mindelay), new_delay), self.maxdelay)
+        # error pages are usually small (and quick), so they never lower the delay
+        if response.status != 200 and new_delay <= slot.delay:
+            return
+        slot.delay = new_delay
@@ -0,0 +1,267 @@
+""" module provides the crawl priorities learned from the graph of the
+previous crawl of a scraper, so the branches of a site which yielded datasets
+are crawled first, and a crawl cut short (e.g. with CLOSESPIDER_TIMEOUT)
+still collects most of the datasets.
+
+The `PriorityModel` is built from the graph pickle of the previous crawl
+(ED_OUTPUT_PATH/graphs/<name>/<name>.pickle). Its pages are the vertices
+reached from the base vertex, and its hits are the pages which were
+dataset pages ('is_dataset_page'). The model keeps:
+- for every page: whether it was a dataset page, the rate of its
+  (page) children which were dataset pages, and the rate of dataset pages
+  in its branch (the pages first reached through it)
+- the rate of dataset pages of every url prefix (the host and up to
+  PRIORITY_PREFIX_LEVELS directories of the path), and of every depth
+
+The score of a link (from 0 to 1) is, for a page of the previous crawl,
+1 if it was a dataset page and the rate of its branch otherwise. For a new
+page, it is the weighted mean of the rates of its deepest known url prefix,
+of the page it was found on and of its depth. The urls are compared in their
+canonical form (see scrapers/base/canonical.py).
+
+The `PriorityMiddleware` adds the score of every link a spider follows,
+times PRIORITY_RANGE, to the priority of its request. It also records the
+yield curve of the crawl: the datasets scraped after every PRIORITY_YIELD_STEP
+pages, in the scrapy stats as 'priority/yield_curve' ([pages, datasets,
+seconds] points) and 'priority/half_datasets_pages' (the pages crawled when half
+the datasets of the crawl were scraped) """
+
+import os
+import time
+from pathlib import Path
+from collections import namedtuple
+
+from scrapy import Request, signals
+
+from edscrapers.scrapers.base import canonical
+from edscrapers.scrapers.base.graph import GraphWrapper
+from edscrapers.scrapers.base.middlewares import ResourceHeadersMiddleware
+
+# default number of path directories the prefixes are made of
+DEFAULT_PREFIX_LEVELS = 3
+# the pages a prefix (or a depth) needs before its own rate is trusted
+MIN_PAGES = 5
+# the weights of the estimates of the score of a new page
+PREFIX_WEIGHT = 0.5
+PARENT_WEIGHT = 0.3
+DEPTH_WEIGHT = 0.2
+
+# what the model knows of a page of the previous crawl
+PageStats = namedtuple('PageStats', ['is_dataset_page', 'child_rate', 'branch_rate'])
+
+
+def _rate(hits, pages, prior):
+    """ returns the rate of 'hits' in 'pages', smoothed towards 'prior' """
+    return (hits + prior * MIN_PAGES) / (pages + MIN_PAGES)
+
+
+class PriorityModel():
+    """ class represents the dataset page rates learned from the graph of a crawl """
+
+    def __init__(self, canonicalizer=None, prefix_levels=DEFAULT_PREFIX_LEVELS):
+        self.canonicalizer = canonicalizer or canonical.for_spider(None)
+        self.prefix_levels = prefix_levels
+        self.pages = dict() # canonical key: PageStats
+        self.prefixes = dict() # prefix: [pages, hits]
+        self.depths = [] # [pages, hits] of every depth
+        self.base_rate = 0.0
+
+    @classmethod
+    def from_graph(cls, graph, canonicalizer=None, prefix_levels=DEFAULT_PREFIX_LEVELS):
+        """ returns the model learned from the crawl graph 'graph' """
+
+        model = cls(canonicalizer, prefix_levels)
+        graph.flush()
+        names = graph.vs['name']
+        attributes = graph.vs.attributes()
+        is_dataset = graph.vs['is_dataset'] if 'is_dataset' in attributes else [None] * len(names)
+        is_hit = graph.vs['is_dataset_page'] if 'is_dataset_page' in attributes else [None] * len(names)
+        try:
+            base = names.index('base_vertex')
+        except ValueError:
+            return model
+
+        # the depth of the pages and the tree of the branches, from a breadth-first walk
+        vids, layers, parents = graph.bfs(base, mode='out')
+        vids = vids[:layers[-1]] # the vertices reached from the base vertex
+        depth = dict()
+        for layer in range(1, len(layers) - 1):
+            for vid in vids[layers[layer]:layers[layer + 1]]:
+                depth[vid] = layer - 1 # the start pages are at depth 0, like in scrapy
+        pages = [vid for vid in vids if vid != base and not is_dataset[vid]]
+        if not pages:
+            return model
+
+        # the pages and hits of the branch of every page, summed up from the leaves
+        branch_pages = dict.fromkeys(pages, 1)
+        branch_hits = {vid: 1 if is_hit[vid] else 0 for vid in pages}
+        for vid in reversed(pages):
+            parent = parents[vid]
+            if parent != vid and parent in branch_pages:
+                branch_pages[parent] += branch_pages[vid]
+                branch_hits[parent] += branch_hits[vid]
+
+        successors = graph.get_adjlist(mode='out')
+        for vid in pages:
+            children = [child for child in successors[vid] if child in branch_pages]
+            child_hits = sum(1 for child in children if is_hit[child])
+            key = model.canonicalizer.key(names[vid])
+            model.pages[key] = PageStats(bool(is_hit[vid]),
+                                         child_hits / len(children) if children else None,
+                                         branch_hits[vid] / branch_pages[vid])
+            hit = 1 if is_hit[vid] else 0
+            for prefix in model.url_prefixes(key):
+                counts = model.prefixes.setdefault(prefix, [0, 0])
+                counts[0] += 1
+                counts[1] += hit
+            page_depth = depth.get(vid, 0)
+            while len(model.depths) <= page_depth:
+                model.depths.append([0, 0])
+            model.depths[page_depth][0] += 1
+            model.depths[page_depth][1] += hit
+
+        model.base_rate = sum(1 for vid in pages if is_hit[vid]) / len(pages)
+        return model
+
+    @classmethod
+    def from_spider(cls, spider, settings, graph_path=None):
+        """ returns the model learned from the graph of the previous crawl of
+        'spider', or None if there is no such graph """
+
+        graph_path = Path(graph_path) if graph_path else\
+                     Path(os.getenv('ED_OUTPUT_PATH', '.'), 'graphs', spider.name, f'{spider.name}.pickle')
+        if not graph_path.exists():
+            return None
+        graph = GraphWrapper.load_graph(graph_path.parent, graph_path.stem)
+        return cls.from_graph(graph, canonical.for_spider(spider, settings),
+                              settings.getint('PRIORITY_PREFIX_LEVELS', DEFAULT_PREFIX_LEVELS))
+
+    def url_prefixes(self, key):
+        """ returns the prefixes of the canonical url 'key', shortest first:
+        its host and its directories, up to 'prefix_levels' of them """
+
+        segments = key.split('?', 1)[0].split('/')
+        directories = segments[:-1] # the last segment is the page
+        return ['/'.join(directories[:level])
+                for level in range(1, min(len(directories), self.prefix_levels + 1) + 1)]
+
+    def score(self, url, parent_url=None, depth=None):
+        """ returns the score (from 0 to 1) of the link to 'url', found on
+        'parent_url' at 'depth' (see the module documentation) """
+
+        key = self.canonicalizer.key(url)
+        page = self.pages.get(key)
+        if page is not None:
+            return 1.0 if page.is_dataset_page else page.branch_rate
+
+        estimates = []
+        for prefix in reversed(self.url_prefixes(key)):
+            counts = self.prefixes.get(prefix)
+            if counts is not None and counts[0] >= MIN_PAGES:
+                estimates.append((PREFIX_WEIGHT, _rate(counts[1], counts[0], self.base_rate)))
+                break
+        parent = self.pages.get(self.canonicalizer.key(parent_url)) if parent_url else None
+        if parent is not None and parent.child_rate is not None:
+            estimates.append((PARENT_WEIGHT, parent.child_rate))
+        if depth is not None and self.depths:
+            pages, hits = self.depths[min(depth, len(self.depths) - 1)]
+            estimates.append((DEPTH_WEIGHT, _rate(hits, pages, self.base_rate)))
+        if not estimates:
+            return self.base_rate
+        return sum(weight * rate for weight, rate in estimates) / sum(weight for weight, rate in estimates)
+
+
+class PriorityMiddleware():
+    """ spider middleware which raises the priority of the requests of the
+    links a spider follows by their score (see `PriorityModel`), and records
+    the yield curve of the crawl.
+
+    The number of requests raised is recorded in the scrapy stats as
+    'priority/raised'. This middleware must come after the CanonicalUrlMiddleware
+    (i.e. with a lower order), so it scores the stripped urls.
+
+    The yield curve is recorded whether the requests are prioritized or not,
+    so crawls with and without priorities can be compared.
+
+    Settings:
+    - PRIORITY_ENABLED: prioritize the requests. default is False
+    - PRIORITY_GRAPH_PATH: the graph pickle the model is learned from.
+    default is the graph of the previous crawl of the spider
+    - PRIORITY_RANGE: the priority of a link scored 1. default is 100
+    - PRIORITY_PREFIX_LEVELS: the path directories of the url prefixes. default is 3
+    - PRIORITY_YIELD_STEP: the pages between the points of the yield curve. default is 100 """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.enabled = settings.getbool('PRIORITY_ENABLED', False)
+        self.graph_path = settings.get('PRIORITY_GRAPH_PATH') or None
+        self.priority_range = settings.getint('PRIORITY_RANGE', 100)
+        self.yield_step = max(1, settings.getint('PRIORITY_YIELD_STEP', 100))
+        self.model = None
+        self.pages = 0
+        self.datasets = 0
+        self.yield_curve = []
+        self.started = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(middleware.response_received, signal=signals.response_received)
+        crawler.signals.connect(middleware.item_scraped, signal=signals.item_scraped)
+        return middleware
+
+    def spider_opened(self, spider):
+        if self.enabled:
+            self._learn(spider)
+        # the yield curve starts once the model is learned
+        self.started = time.monotonic()
+
+    def _learn(self, spider):
+        learning = time.monotonic()
+        self.model = PriorityModel.from_spider(spider, self.crawler.settings, self.graph_path)
+        if self.model is None:
+            spider.logger.info('No previous crawl graph: the requests are not prioritized')
+            return
+        self.stats.set_value('priority/model_pages', len(self.model.pages), spider=spider)
+        spider.logger.info(f'Priority model learned from {len(self.model.pages)} pages '
+                           f'({self.model.base_rate:.1%} dataset pages) in {time.monotonic() - learning:.1f}s')
+
+    def spider_closed(self, spider):
+        self._add_point()
+        self.stats.set_value('priority/yield_curve', self.yield_curve, spider=spider)
+        if not self.datasets:
+            return
+        for pages, datasets, seconds in self.yield_curve:
+            if datasets * 2 >= self.datasets:
+                self.stats.set_value('priority/half_datasets_pages', pages, spider=spider)
+                break
+
+    def response_received(self, response, request, spider):
+        # the resource HEAD requests are not pages
+        if ResourceHeadersMiddleware.META_KEY in request.meta:
+            return
+        self.pages += 1
+        if self.pages % self.yield_step == 0:
+            self._add_point()
+
+    def item_scraped(self, item, response, spider):
+        self.datasets += 1
+
+    def _add_point(self):
+        point = [self.pages, self.datasets, round(time.monotonic() - self.started, 3)]
+        if not self.yield_curve or self.yield_curve[-1][:2] != point[:2]:
+            self.yield_curve.append(point)
+
+    def process_spider_output(self, response, result, spider):
+        depth = response.meta.get('depth', 0) + 1
+        for element in result:
+            if self.model is not None and isinstance(element, Request) and not element.dont_filter:
+                priority = int(round(self.model.score(element.url, response.url, depth) * self.priority_range))
+                if priority:
+                    element.priority += priority
+                    self.stats.inc_value('priority/raised', spider=spider)
+            yield element
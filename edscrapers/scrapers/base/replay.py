@@ -0,0 +1,140 @@
+""" module provides the offline replay mode (`eds scrape NAME --replay`), which
+re-runs the parsers of a scraper over its http cache, e.g. after a parser has
+changed, without a single network call.
+
+`replay_settings()` turns the scrapy settings of a scrape into those of its replay:
+- pages are only read from the http cache (whatever their age) and the
+  requests which are not in the cache are dropped (see `ReplayCacheMiddleware`)
+- there is no download delay and no throttling, and more requests are
+  handled at a time (REPLAY_CONCURRENT_REQUESTS), as the pages are read from disk
+- the resource headers are taken from the resource metadata cache
+  (see scrapers/base/metadata.py) whatever their age, and the pages are
+  never downloaded to get the title of the Source of a Collection
+- the incremental mode is off, so every page is parsed again
+
+The replay writes the outputs and the crawl graph of the scraper, like a live
+crawl does. With `--replay -j N` the replay is split between N worker processes
+through a crawl frontier of its own (see scrapers/base/frontier.py), so the
+parsing is done on N cores, and the graphs of the workers are merged at the end.
+
+The requests missing from the cache are counted in the scrapy stats as
+'replay/missing' and, unless REPLAY_LIST_MISSING is False, listed (one url per
+line) in ED_OUTPUT_PATH/scrapy/replay/<spider>.missing.txt
+(<spider>.missing.<worker>.txt for the workers of a replay) """
+
+import os
+import pathlib
+
+from scrapy.exceptions import IgnoreRequest
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+
+# the http cache middleware of the scrapes, replaced by `ReplayCacheMiddleware`
+CACHE_MIDDLEWARE = 'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware'
+REPLAY_MIDDLEWARE = 'edscrapers.scrapers.base.replay.ReplayCacheMiddleware'
+
+# directory of the lists of missing requests
+DEFAULT_DIR = os.path.join(os.getenv('ED_OUTPUT_PATH', '.'), 'scrapy', 'replay')
+
+# default location of the crawl frontier of the replay workers,
+# so a replay never takes over the frontier of a live crawl
+DEFAULT_FRONTIER_PATH = os.path.join(os.getenv('ED_OUTPUT_PATH', '.'), 'scrapy', 'replay-frontier.sqlite')
+
+
+def replay_settings(settings):
+    """ function updates the scrapy 'settings' (a dict) of a scrape for its replay.
+    Returns the updated settings
+
+    PARAMETERS:
+    - settings: the scrapy settings of the scrape (e.g. SCRAPY_SETTINGS in scrapers/base/config.py) """
+
+    settings['REPLAY_ENABLED'] = True
+
+    # read the pages from the http cache only, whatever their age
+    settings['HTTPCACHE_ENABLED'] = True
+    settings['HTTPCACHE_IGNORE_MISSING'] = True
+    settings['HTTPCACHE_POLICY'] = 'scrapy.extensions.httpcache.DummyPolicy'
+    settings['HTTPCACHE_EXPIRATION_SECS'] = 0
+    middlewares = dict(settings.get('DOWNLOADER_MIDDLEWARES', {}))
+    order = middlewares.get(CACHE_MIDDLEWARE) or 1
+    middlewares[CACHE_MIDDLEWARE] = None
+    middlewares[REPLAY_MIDDLEWARE] = order
+    settings['DOWNLOADER_MIDDLEWARES'] = middlewares
+
+    # the pages are read from disk, so there is nothing to be polite to
+    settings['DOWNLOAD_DELAY'] = 0
+    settings['AUTOTHROTTLE_ENABLED'] = False
+    settings['CONCURRENT_REQUESTS'] = settings.get('REPLAY_CONCURRENT_REQUESTS', 64)
+    settings['CONCURRENT_REQUESTS_PER_DOMAIN'] = settings['CONCURRENT_REQUESTS']
+    settings['DOWNLOAD_POLICIES'] = dict()
+
+    # no network call for the resource headers or the Source titles
+    settings['RESOURCE_METADATA_TTL'] = float('inf')
+    settings['COLLECTION_NETWORK_FALLBACK'] = False
+
+    # every page is parsed again
+    settings['INCREMENTAL_ENABLED'] = False
+
+    if settings.get('FRONTIER_ENABLED') and not settings.get('FRONTIER_URL'):
+        settings['FRONTIER_URL'] = DEFAULT_FRONTIER_PATH
+
+    return settings
+
+
+class ReplayCacheMiddleware(HttpCacheMiddleware):
+    """ downloader middleware which serves every request from the http cache
+    (like the scrapy HttpCacheMiddleware with HTTPCACHE_IGNORE_MISSING)
+    and drops the requests which can not be served from it, including those
+    which are never cached (e.g. the HEAD requests of the resource headers
+    when the resource metadata cache is used), so nothing is downloaded.
+
+    The dropped requests are counted in the scrapy stats as 'replay/missing'
+    and listed in the REPLAY_MISSING_DIR directory when REPLAY_LIST_MISSING is True """
+
+    def __init__(self, settings, stats):
+        super().__init__(settings, stats)
+        self.list_missing = settings.getbool('REPLAY_LIST_MISSING', True)
+        self.missing_dir = settings.get('REPLAY_MISSING_DIR') or DEFAULT_DIR
+        self.worker = None
+        if settings.getbool('FRONTIER_ENABLED'):
+            # every worker of a replay lists the requests it missed
+            from edscrapers.scrapers.base.frontier import worker_id
+            self.worker = worker_id(settings)
+        self.missing = []
+
+    def process_request(self, request, spider):
+        try:
+            response = super().process_request(request, spider)
+        except IgnoreRequest: # not in the cache
+            response = None
+        if response is None: # the request would be downloaded
+            self._missed(request, spider)
+        return response
+
+    def _missed(self, request, spider):
+        """ records the request missing from the cache, and drops it """
+
+        self.stats.inc_value('replay/missing', spider=spider)
+        if self.list_missing:
+            self.missing.append(f'{request.method} {request.url}' if request.method != 'GET' else request.url)
+        raise IgnoreRequest(f'Not in the http cache: {request.url}')
+
+    def missing_path(self, spider):
+        """ returns the path of the list of the requests missed by 'spider' """
+
+        file_name = f'{spider.name}.missing.txt' if self.worker is None\
+                    else f'{spider.name}.missing.{self.worker}.txt'
+        return pathlib.Path(self.missing_dir, file_name)
+
+    def spider_closed(self, spider):
+        super().spider_closed(spider)
+        missing = self.stats.get_value('replay/missing', 0, spider=spider)
+        if not self.list_missing:
+            spider.logger.info(f'Replay: {missing} requests were not in the http cache')
+            return
+
+        path = self.missing_path(spider)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as missing_file:
+            for url in self.missing:
+                missing_file.write(f'{url}\n')
+        spider.logger.info(f'Replay: {missing} requests were not in the http cache (listed in {path})')
@@ -0,0 +1,282 @@
+""" module runs several scrapers at the same time (`eds scrape --all`
+or `eds scrape NAME NAME ...`).
+
+By default every scraper runs in a process of its own, taken from a pool of
+'jobs' processes (a Twisted reactor can not be restarted, so each process
+runs a single crawl). The processes are forked from the cli process, so the
+imports are paid once. With 'in_process' all the scrapers run on a single
+CrawlerProcess instead (and so share a single core). Either way every
+scraper keeps its own state (e.g. its crawl graph, its stats and its
+output pipelines) like it does when run on its own.
+The whole run takes about as long as the slowest scraper (when there are
+as many jobs as scrapers) instead of the sum of all the scrapers.
+
+The run has a global concurrency budget: the CONCURRENT_REQUESTS of every
+scraper is the budget divided by the number of scrapers running at a time.
+
+`run_workers()` (`eds scrape NAME --worker -j N`) runs N worker processes
+of a single scraper instead, which split its crawl through a shared crawl
+frontier (see scrapers/base/frontier.py). Their graphs are merged once all
+the workers are done.
+
+When the run is done, the pages and datasets scraped per second by every
+scraper (or worker) and by the whole run are logged and written to
+ED_OUTPUT_PATH/scrapy/runs/run-<date>-<time>.json """
+
+import os
+import copy
+import json
+import time
+import pathlib
+import importlib
+import multiprocessing as mp
+from datetime import datetime
+
+from edscrapers.cli import logger
+
+# default number of requests made at a time by all the scrapers of a run
+DEFAULT_CONCURRENCY = 32
+
+
+def scraper_names(spider_modules):
+    """ function returns the scraper names (as accepted by `eds scrape`, e.g. 'nces'
+    or 'edgov.osers') of the crawler modules listed in 'spider_modules' """
+
+    names = []
+    for module in spider_modules:
+        parts = module.split('.')
+        if parts[:2] == ['edscrapers', 'scrapers'] and parts[-1] == 'crawler':
+            names.append('.'.join(parts[2:-1]))
+    return names
+
+
+def scraper_settings(settings, name, concurrent_requests=None, resume=False):
+    """ function returns a copy of the scrapy 'settings' for the scraper 'name'.
+    When resuming, every scraper gets its own JOBDIR (under the JOBDIR in 'settings') """
+
+    settings = copy.deepcopy(settings)
+    if concurrent_requests is not None:
+        settings['CONCURRENT_REQUESTS'] = concurrent_requests
+    if resume and settings.get('JOBDIR'):
+        settings['JOBDIR'] = os.path.join(settings['JOBDIR'], name)
+        pathlib.Path(settings['JOBDIR']).mkdir(parents=True, exist_ok=True)
+    return settings
+
+
+def _report(name, stats, seconds, error=None):
+    """ function returns the throughput report of the scraper 'name' from its crawl 'stats' """
+
+    report = {'name': name, 'status': 'failed', 'seconds': round(seconds, 3)}
+    if stats is not None:
+        report['status'] = stats.get('finish_reason', 'finished')
+        report['pages'] = stats.get('response_received_count', 0)
+        report['datasets'] = stats.get('item_scraped_count', 0)
+        report['errors'] = stats.get('log_count/ERROR', 0)
+    if error is not None:
+        report['status'] = 'failed'
+        report['error'] = error
+    for count in ('pages', 'datasets'):
+        report[f'{count}_per_sec'] = round(report.get(count, 0) / report['seconds'], 3)\
+                                     if report['seconds'] else 0.0
+    return report
+
+
+def _crawl(task):
+    """ function runs the crawl of a single scraper (in a pool process).
+    Returns the throughput report of the scraper """
+
+    label, name, settings = task
+    # the reactor is already installed by the cli process (which imports scrapy), and the
+    # pool process inherits it unstarted, so it can run this one crawl on it
+    from scrapy.crawler import CrawlerProcess
+
+    start = time.monotonic()
+    try:
+        crawler_class = importlib.import_module(f'edscrapers.scrapers.{name}').Crawler
+        process = CrawlerProcess(settings)
+        crawler = process.create_crawler(crawler_class)
+        process.crawl(crawler)
+        process.start()
+    except Exception as exc:
+        logger.error(f'Scraper {label} failed: {exc}')
+        return _report(label, None, time.monotonic() - start, error=str(exc))
+    return _report(label, crawler.stats.get_stats(), time.monotonic() - start)
+
+
+def _crawl_in_process(tasks):
+    """ function runs the crawls of all the scrapers on a single CrawlerProcess.
+    Returns the throughput reports of the scrapers """
+
+    from scrapy.crawler import Crawler, CrawlerProcess
+    from scrapy.settings import Settings
+
+    # the process wide settings (e.g. the reactor thread pool) are those of the first scraper
+    process = CrawlerProcess(tasks[0][2])
+    crawlers = []
+    for label, name, settings in tasks:
+        crawler_class = importlib.import_module(f'edscrapers.scrapers.{name}').Crawler
+        crawler = Crawler(crawler_class, Settings(settings))
+        crawlers.append((label, crawler))
+        process.crawl(crawler)
+    process.start()
+
+    reports = []
+    for label, crawler in crawlers:
+        stats = crawler.stats.get_stats()
+        seconds = 0.0
+        if stats.get('start_time') and stats.get('finish_time'):
+            seconds = (stats['finish_time'] - stats['start_time']).total_seconds()
+        reports.append(_report(label, stats, seconds))
+    return reports
+
+
+def run_scrapers(names, settings, jobs=None, concurrency=DEFAULT_CONCURRENCY, resume=False,
+                 in_process=False):
+    """ function runs the scrapers called 'names' at the same time.
+    Returns the report of the run
+
+    PARAMETERS:
+    - names: the names of the scrapers (e.g. ['nces', 'edgov.osers'])
+
+    - settings: the scrapy settings shared by the scrapers
+
+    - jobs: the number of scrapers running at a time (default is one per scraper)
+
+    - concurrency: the number of requests made at a time by all the running scrapers
+
+    - resume: True if the scrapers resume their previous (interrupted) crawls
+
+    - in_process: True to run all the scrapers on a single CrawlerProcess
+    (in the calling process) instead of a process pool. 'jobs' is ignored """
+
+    if in_process:
+        jobs = len(names)
+    jobs = max(1, min(jobs or len(names), len(names)))
+    concurrent_requests = max(1, concurrency // jobs)
+    tasks = [(name, name, scraper_settings(settings, name, concurrent_requests, resume))
+             for name in names]
+
+    logger.info(f'Running {len(names)} scrapers, {jobs} at a time{" in process" if in_process else ""}, '
+                f'with {concurrent_requests} concurrent requests each')
+    return _run(tasks, jobs, concurrent_requests, in_process)
+
+
+def run_workers(name, settings, workers, concurrency=DEFAULT_CONCURRENCY):
+    """ function runs 'workers' worker processes of the scraper 'name', which
+    split the crawl through the shared crawl frontier (see scrapers/base/frontier.py),
+    then merges the graphs of the workers. Returns the report of the run
+
+    PARAMETERS:
+    - name: the name of the scraper (e.g. 'edgov')
+
+    - settings: the scrapy settings of the scraper, in worker mode
+
+    - workers: the number of worker processes
+
+    - concurrency: the number of requests made at a time by all the workers """
+
+    from edscrapers.scrapers.base import frontier
+
+    workers = max(1, workers)
+    concurrent_requests = max(1, concurrency // workers)
+    # every worker gets an id of its own, even when FRONTIER_WORKER_ID is set
+    worker_prefix = settings.get('FRONTIER_WORKER_ID') or frontier.worker_id()
+    tasks = []
+    for number in range(workers):
+        worker_settings = scraper_settings(settings, name, concurrent_requests)
+        worker_settings['FRONTIER_WORKER_ID'] = f'{worker_prefix}-{number}'
+        tasks.append((f'{name}[{number}]', name, worker_settings))
+
+    logger.info(f'Running {workers} workers of the {name} scraper, '
+                f'with {concurrent_requests} concurrent requests each')
+    run = _run(tasks, workers, concurrent_requests)
+    merge_graphs(name, settings)
+    return run
+
+
+def merge_graphs(name, settings, keep=False):
+    """ function merges the graphs written by the workers of the scraper 'name'
+    into its graph (see `GraphWrapper.merge_worker_graphs()`), and writes the
+    graph exports selected in 'settings'. Returns the merged graph or None """
+
+    # the graph module is imported here, as it is only needed in worker mode
+    from edscrapers.scrapers.base.graph import GraphWrapper
+
+    graph = GraphWrapper.merge_worker_graphs(pathlib.Path(os.getenv('ED_OUTPUT_PATH'), 'graphs', name), name,
+                                             keep=keep,
+                                             formats=settings.get('GRAPH_EXPORT_FORMATS'),
+                                             background=settings.get('GRAPH_EXPORT_BACKGROUND'),
+                                             svg_max_vertices=settings.get('GRAPH_SVG_MAX_VERTICES'))
+    if graph is None:
+        logger.warning(f'No worker graph to merge for {name}')
+    else:
+        logger.info(f'Merged the worker graphs of {name}: {graph.vcount()} vertices, {graph.ecount()} edges')
+    return graph
+
+
+def _run(tasks, jobs, concurrent_requests, in_process=False):
+    """ function runs the crawl 'tasks' (label, scraper name, settings),
+    'jobs' at a time. Returns the report of the run """
+
+    labels = [label for label, _, _ in tasks]
+    start = time.monotonic()
+    reports = []
+    if in_process:
+        reports = _crawl_in_process(tasks)
+    else:
+        # forked processes inherit the imports (and the loggers) of the cli process
+        context = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+        with context.Pool(processes=jobs, maxtasksperchild=1) as pool:
+            for report in pool.imap_unordered(_crawl, tasks):
+                logger.info(f"Scraper {report['name']} {report['status']} in {report['seconds']}s: "
+                            f"{report.get('pages', 0)} pages, {report.get('datasets', 0)} datasets")
+                reports.append(report)
+    seconds = round(time.monotonic() - start, 3)
+
+    reports.sort(key=lambda report: labels.index(report['name']))
+    pages = sum(report.get('pages', 0) for report in reports)
+    datasets = sum(report.get('datasets', 0) for report in reports)
+    run = {
+        'scrapers': reports,
+        'jobs': jobs,
+        'in_process': in_process,
+        'concurrent_requests': concurrent_requests,
+        'seconds': seconds,
+        # the time the scrapers would have taken one after another
+        'sequential_seconds': round(sum(report['seconds'] for report in reports), 3),
+        'pages': pages,
+        'datasets': datasets,
+        'pages_per_sec': round(pages / seconds, 3) if seconds else 0.0,
+        'datasets_per_sec': round(datasets / seconds, 3) if seconds else 0.0,
+        'failed': [report['name'] for report in reports if report['status'] != 'finished'],
+    }
+    log_report(run)
+    write_report(run)
+    return run
+
+
+def log_report(run):
+    """ function logs the throughput of every scraper and of the whole run """
+
+    logger.info(f"  {'scraper':<16} {'status':<10} {'seconds':>9} {'pages':>8} {'pages/s':>8} "
+                f"{'datasets':>9} {'datasets/s':>11}")
+    for report in run['scrapers']:
+        logger.info(f"  {report['name']:<16} {report['status']:<10} {report['seconds']:>9.1f} "
+                    f"{report.get('pages', 0):>8} {report['pages_per_sec']:>8.2f} "
+                    f"{report.get('datasets', 0):>9} {report['datasets_per_sec']:>11.2f}")
+    logger.info(f"  {'total':<16} {'':<10} {run['seconds']:>9.1f} {run['pages']:>8} "
+                f"{run['pages_per_sec']:>8.2f} {run['datasets']:>9} {run['datasets_per_sec']:>11.2f}")
+    logger.info(f"The run took {run['seconds']}s, the scrapers one after another "
+                f"would have taken {run['sequential_seconds']}s")
+
+
+def write_report(run):
+    """ function writes the report of the run to ED_OUTPUT_PATH/scrapy/runs """
+
+    runs_dir = pathlib.Path(os.getenv('ED_OUTPUT_PATH'), 'scrapy', 'runs')
+    runs_dir.mkdir(parents=True, exist_ok=True)
+    report_path = runs_dir / f"run-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(report_path, 'w') as report_file:
+        json.dump(run, report_file, indent=2)
+    logger.info(f'Run report written to {report_path}')
+    return report_path
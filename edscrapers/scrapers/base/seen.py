@@ -0,0 +1,152 @@
+""" module provides the seen-sets of the DuplicatesPipeline (see
+scrapers/base/pipelines.py), which remember the datasets scraped so far
+without keeping their keys in memory:
+
+- `ExactSeenSet`: a set of 64 bit hashes of the keys (about 70 bytes per
+  dataset). A false duplicate needs a hash collision, so there is none in practice
+- `BloomSeenSet`: a Bloom filter of a fixed size, computed from the number of
+  datasets it is sized for and the rate of false duplicates allowed (e.g. 18MB
+  for 10 million datasets and 0.1%). A dataset may (rarely) be taken
+  for a duplicate, but a duplicate is never missed
+
+A seen-set can be kept in a file, so a resumed crawl (`eds scrape --resume`)
+remembers the datasets of the interrupted one. The hashes of an exact
+seen-set are appended to its file as they are added, while a Bloom filter is
+written when it is closed """
+
+import os
+import math
+import struct
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# the kinds of seen-sets
+EXACT = 'exact'
+BLOOM = 'bloom'
+SEEN_SET_KINDS = (EXACT, BLOOM)
+
+# default size of a Bloom seen-set
+DEFAULT_BLOOM_CAPACITY = 10 * 1000 * 1000
+DEFAULT_BLOOM_ERROR_RATE = 0.001
+
+# header of the file of a Bloom seen-set: its number of bits and of hashes
+BLOOM_HEADER = struct.Struct('>QI')
+
+
+def _digest(key, size):
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=size).digest()
+
+
+class ExactSeenSet():
+    """ class represents a set of (the 64 bit hashes of) keys """
+
+    HASH_SIZE = 8
+
+    def __init__(self, path=None):
+        """ PARAMETERS:
+        - path: the file the seen-set is kept in. default is None (in memory only) """
+
+        self.hashes = set()
+        self.file = None
+        if path:
+            if os.path.exists(path):
+                with open(path, 'rb') as seen_file:
+                    data = seen_file.read()
+                # a partly written hash (of an interrupted crawl) is left out
+                end = len(data) - len(data) % self.HASH_SIZE
+                self.hashes.update(int.from_bytes(data[position:position + self.HASH_SIZE], 'big')
+                                   for position in range(0, end, self.HASH_SIZE))
+            self.file = open(path, 'ab')
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, key):
+        """ adds 'key' to the seen-set. Returns True if it was already seen """
+
+        digest = _digest(key, self.HASH_SIZE)
+        key_hash = int.from_bytes(digest, 'big')
+        if key_hash in self.hashes:
+            return True
+        self.hashes.add(key_hash)
+        if self.file is not None:
+            self.file.write(digest)
+        return False
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class BloomSeenSet():
+    """ class represents a Bloom filter of keys """
+
+    def __init__(self, path=None, capacity=DEFAULT_BLOOM_CAPACITY, error_rate=DEFAULT_BLOOM_ERROR_RATE):
+        """ PARAMETERS:
+        - path: the file the seen-set is kept in. default is None (in memory only)
+
+        - capacity: the number of keys the filter is sized for
+
+        - error_rate: the rate of false duplicates once 'capacity' keys are added.
+        The filter of an existing file keeps the size it was created with """
+
+        self.path = path
+        self.count = 0 # the keys added by this process
+        if path and os.path.exists(path):
+            with open(path, 'rb') as bloom_file:
+                self.num_bits, self.num_hashes = BLOOM_HEADER.unpack(bloom_file.read(BLOOM_HEADER.size))
+                self.bits = bytearray(bloom_file.read())
+            if len(self.bits) * 8 >= self.num_bits:
+                return
+            logger.warning(f'Ignoring the truncated Bloom seen-set {path}')
+
+        # the optimal number of bits and of hashes for 'capacity' keys
+        capacity = max(1, int(capacity))
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key):
+        """ adds 'key' to the seen-set. Returns True if it was (probably) already seen """
+
+        digest = _digest(key, 16)
+        # the positions of the key are derived from two hashes (Kirsch-Mitzenmacher)
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        seen = True
+        for position in range(self.num_hashes):
+            bit = (first + position * second) % self.num_bits
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self.bits[byte] & mask:
+                self.bits[byte] |= mask
+                seen = False
+        if not seen:
+            self.count += 1
+        return seen
+
+    def close(self):
+        if not self.path:
+            return
+        # the filter is replaced at once, so it is never left half written
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'wb') as bloom_file:
+            bloom_file.write(BLOOM_HEADER.pack(self.num_bits, self.num_hashes))
+            bloom_file.write(self.bits)
+        os.replace(temporary_path, self.path)
+
+
+def open_seen_set(kind=EXACT, path=None, capacity=DEFAULT_BLOOM_CAPACITY, error_rate=DEFAULT_BLOOM_ERROR_RATE):
+    """ function returns a seen-set of 'kind' ('exact' or 'bloom'), kept in
+    'path' (if any). 'capacity' and 'error_rate' size a Bloom seen-set """
+
+    if kind == EXACT:
+        return ExactSeenSet(path)
+    if kind == BLOOM:
+        return BloomSeenSet(path, capacity, error_rate)
+    raise ValueError(f"unknown seen-set '{kind}'. Expected one of {list(SEEN_SET_KINDS)}")
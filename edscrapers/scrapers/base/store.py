@@ -0,0 +1,292 @@
+""" module provides the sharded, append-only dataset store.
+
+By default (OUTPUT_MODE 'files') every scraped dataset is written by the
+`JsonWriterPipeline` to its own (pretty-printed) json file. Large crawls
+(e.g. edgov) produce hundreds of thousands of such files. With OUTPUT_MODE
+'jsonl' the datasets are instead appended, as compact json records, to
+size-rotated JSONL shards, one set of shards per spider and output directory:
+
+    ED_OUTPUT_PATH/scrapers/<spider or office>[/<publisher>]/
+        datasets-<spider>-00000.jsonl[.gz|.zst]
+        datasets-<spider>-00001.jsonl[.gz|.zst]
+        datasets-<spider>.idx
+
+Every record is keyed by the path the dataset would have had in 'files' mode
+(i.e. the 'saved_as_file' of the dataset), so the crawl graph and the
+transformers refer to datasets the same way in both modes. The '.idx' file
+is an append-only index with one json line per record:
+{"key": ..., "shard": ..., "offset": ..., "length": ..., "seq": ...}
+Records are never rewritten: updating a dataset appends a new record and a
+new index line. 'seq' is the time (in nanoseconds) the record was written,
+never repeated by a store, and the index line with the highest 'seq' for a
+key wins, whichever index file (i.e. spider) it is in.
+
+When compressed (OUTPUT_COMPRESSION 'gzip' or 'zstd'), every record is a
+separate gzip member / zstd frame, so a shard is still a valid .gz / .zst
+file while any record can be read on its own from its offset.
+zstd compression requires the optional 'zstandard' package.
+
+The transformers read the store through `traverse_output()`, `read_file()`
+and `write_file()` (see edscrapers.transformers.base.helpers), which handle
+both the json files and the store """
+
+import os
+import json
+import gzip
+import time
+import atexit
+import pathlib
+import threading
+
+# the output modes of the JsonWriterPipeline
+FILES = 'files'
+JSONL = 'jsonl'
+OUTPUT_MODES = (FILES, JSONL)
+
+# the supported compressions and the suffix of their shards
+COMPRESSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+# default size (in bytes) after which a shard is rotated. default is 64MB
+DEFAULT_SHARD_SIZE = 64 * 1024 * 1024
+
+# prefix of the shard and index files
+STORE_PREFIX = 'datasets'
+# suffix of the index files
+INDEX_SUFFIX = '.idx'
+
+
+def check_compression(compression):
+    """ function ensures the provided compression is supported
+    (an empty string means no compression). Returns the compression or raises ValueError """
+
+    compression = compression or None
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown output compression '{compression}'. "
+                         f"Expected one of {[c for c in COMPRESSIONS if c]}")
+    if compression == 'zstd':
+        _zstd() # fail early if zstandard is not installed
+    return compression
+
+
+def _zstd():
+    """ function returns the (optional) zstandard module """
+
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("'zstd' output compression requires the 'zstandard' package "
+                         "(pip install zstandard)")
+    return zstandard
+
+
+def _compress(data, compression):
+    if compression == 'gzip':
+        return gzip.compress(data)
+    if compression == 'zstd':
+        return _zstd().ZstdCompressor().compress(data)
+    return data
+
+
+def _decompress(data, compression):
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'zstd':
+        return _zstd().ZstdDecompressor().decompress(data)
+    return data
+
+
+def _shard_compression(shard_name):
+    """ function returns the compression of a shard, from its name """
+
+    for compression, suffix in COMPRESSIONS.items():
+        if suffix and shard_name.endswith(suffix):
+            return compression
+    return None
+
+
+class ShardWriter():
+    """ class appends records to the shards (and the index) of one spider
+    in one output directory """
+
+    def __init__(self, directory, spider_name, shard_size=DEFAULT_SHARD_SIZE, compression=None):
+        self.directory = pathlib.Path(directory)
+        self.spider_name = spider_name
+        self.shard_size = shard_size
+        self.compression = check_compression(compression)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index_file = open(self.directory / f'{STORE_PREFIX}-{spider_name}{INDEX_SUFFIX}', 'a')
+        # never append to the shards of a previous run, start a new shard instead
+        self.shard_number = len(list(self.directory.glob(f'{STORE_PREFIX}-{spider_name}-*.jsonl*')))
+        self.shard_file = None
+        self.shard_name = None
+        self.records = 0
+
+    def _open_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.shard_name = (f'{STORE_PREFIX}-{self.spider_name}-{self.shard_number:05d}.jsonl'
+                           f'{COMPRESSIONS[self.compression]}')
+        self.shard_file = open(self.directory / self.shard_name, 'ab')
+        self.shard_number += 1
+
+    def write(self, key, data, sequence):
+        """ appends the record 'data' (a json string) stored under 'key',
+        with the write sequence number 'sequence'. Returns the index entry of the record """
+
+        if self.shard_file is None or self.shard_file.tell() >= self.shard_size:
+            self._open_shard()
+
+        record = _compress(data.encode('utf-8') + b'\n', self.compression)
+        offset = self.shard_file.tell()
+        self.shard_file.write(record)
+        entry = {'key': key, 'shard': self.shard_name, 'offset': offset, 'length': len(record),
+                 'seq': sequence}
+        self.index_file.write(json.dumps(entry) + '\n')
+        self.records += 1
+        return entry
+
+    def flush(self):
+        if self.shard_file is not None:
+            self.shard_file.flush()
+        self.index_file.flush()
+
+    def close(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.shard_file = None
+        self.index_file.close()
+
+
+class DatasetStore():
+    """ class represents the dataset store under an output directory
+    (i.e. ED_OUTPUT_PATH). It writes records for any number of spiders and
+    output directories and reads records through the index files """
+
+    def __init__(self, output_dir=None, shard_size=DEFAULT_SHARD_SIZE, compression=None):
+        self.output_dir = pathlib.Path(output_dir or os.getenv('ED_OUTPUT_PATH'))
+        self.shard_size = shard_size
+        self.compression = check_compression(compression)
+        self.writers = dict() # ShardWriters, keyed by (directory, spider name)
+        self._index = None # maps record keys to their (directory, index entry)
+        self._sequence = 0 # the sequence number of the last record written
+        # records may be written from several threads (see scrapers/base/writer.py)
+        self.lock = threading.RLock()
+
+    def key(self, file_path):
+        """ returns the store key of 'file_path' (a path relative to the
+        output directory, as in the 'saved_as_file' of a dataset) """
+
+        file_path = str(file_path)
+        output_dir = str(self.output_dir)
+        if file_path.startswith(output_dir):
+            file_path = file_path[len(output_dir):]
+        return file_path.lstrip('/')
+
+    def write(self, key, data, spider_name='transformers'):
+        """ stores 'data' (a json string) under 'key'. The record is written
+        to the directory of 'key', into the shards of 'spider_name' """
+
+        key = self.key(key)
+        directory = (self.output_dir / key).parent
+        with self.lock:
+            writer = self.writers.get((directory, spider_name))
+            if writer is None:
+                writer = ShardWriter(directory, spider_name,
+                                     shard_size=self.shard_size, compression=self.compression)
+                self.writers[(directory, spider_name)] = writer
+            # the write time orders the records of all the processes writing
+            # to the store, and is never repeated (or set back) by this one
+            self._sequence = max(time.time_ns(), self._sequence + 1)
+            entry = writer.write(key, data, self._sequence)
+            if self._index is not None:
+                self._index[key] = (directory, entry)
+        return entry
+
+    def flush(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.flush()
+
+    def close(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.close()
+            self.writers = dict()
+
+    def index(self):
+        """ returns the index of the whole store, loading it on first use """
+
+        if self._index is None:
+            # records written before the index is loaded must be readable
+            self.flush()
+            self._index = dict()
+            for index_path in sorted(self.output_dir.joinpath('scrapers').rglob(f'*{INDEX_SUFFIX}')):
+                with open(index_path, 'r') as index_file:
+                    for line in index_file:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError: # an incomplete line left by an interrupted run
+                            continue
+                        # the latest record wins (the index lines written
+                        # before records had a 'seq' are in the order of the files)
+                        located = self._index.get(entry['key'])
+                        if located is None or entry.get('seq', 0) >= located[1].get('seq', 0):
+                            self._index[entry['key']] = (index_path.parent, entry)
+        return self._index
+
+    def has_index(self, prefix=''):
+        """ returns whether there are index files (i.e. records) under the
+        'prefix' directory, without loading the index """
+
+        directory = self.output_dir.joinpath(prefix.strip('/') or 'scrapers')
+        return any(True for index_path in directory.rglob(f'*{INDEX_SUFFIX}'))
+
+    def keys(self, prefix=''):
+        """ returns the (sorted) keys of the stored records, optionally
+        only those under the 'prefix' directory (e.g. 'scrapers/nces') """
+
+        prefix = prefix.strip('/')
+        return sorted(key for key in self.index()
+                      if not prefix or key.startswith(prefix + '/'))
+
+    def __contains__(self, key):
+        return self.key(key) in self.index()
+
+    def read(self, key):
+        """ returns the record stored under 'key' (as a json string) or None """
+
+        located = self.index().get(self.key(key))
+        if located is None:
+            return None
+        directory, entry = located
+        self.flush()
+        with open(directory / entry['shard'], 'rb') as shard_file:
+            shard_file.seek(entry['offset'])
+            record = shard_file.read(entry['length'])
+        return _decompress(record, _shard_compression(entry['shard'])).decode('utf-8')
+
+    def reload(self):
+        """ drops the loaded index, so records written by other processes are seen """
+        self._index = None
+
+
+# store shared by the readers and writers of this process, keyed by output directory
+_stores = dict()
+
+def get_store(output_dir=None):
+    """ returns the process-wide store for 'output_dir' (default is ED_OUTPUT_PATH).
+    Records written to this store use the OUTPUT_SHARD_SIZE and
+    OUTPUT_COMPRESSION environment variables """
+
+    output_dir = str(output_dir or os.getenv('ED_OUTPUT_PATH'))
+    if output_dir not in _stores:
+        _stores[output_dir] = DatasetStore(output_dir,
+                                           shard_size=int(os.getenv('OUTPUT_SHARD_SIZE', DEFAULT_SHARD_SIZE)),
+                                           compression=os.getenv('OUTPUT_COMPRESSION'))
+        atexit.register(_stores[output_dir].close)
+    return _stores[output_dir]
@@ -0,0 +1,275 @@
+""" module provides the timers of the hot paths of a crawl, which tell where
+the crawl time goes (e.g. html parsing, the resource header and Collection
+lookups, the graph lock or the json writes).
+
+The timers are off unless the TimingExtension (see scrapers/base/extensions.py)
+is enabled with the TIMING_ENABLED setting (or `eds scrape --timing`).
+When they are off, `timer()` returns a shared no-op context manager and
+`timed()` functions call the timed function straight away, so the hot paths
+only pay for a global lookup.
+
+Every timing is recorded for a spider and for the module the time was spent in:
+- the rule callbacks of a spider are wrapped (see `timed_callback()`), so the
+  time spent in a parser is recorded as the 'parse' section of its module.
+  The time of a dispatcher (e.g. nces/parser.py) and of the sub-parser it
+  hands the page to (e.g. nces/parsers/nces_parser2.py) are recorded apart
+- a timer run while a parser (or a `scope()`) is running is recorded for the
+  spider and the module of that parser, e.g. the 'html_parse.html5lib'
+  section of documents.get_soup()
+- the timers which are not run from a parser (e.g. the item pipelines) name their spider
+
+The timings are inclusive: the 'parse' section of a parser includes the
+'html_parse' and 'collection' sections it triggered.
+Timers are thread safe (the json writes are timed on the writer threads) """
+
+import time
+import functools
+import threading
+
+# the timers record nothing unless this is True (see `enable()`)
+enabled = False
+
+# module name used for the timings recorded outside of any parser
+NO_MODULE = '-'
+
+# the timings of every spider, keyed by spider name
+_timings = dict()
+_lock = threading.Lock()
+# the spider and the module code is running for (see `scope()`)
+_local = threading.local()
+
+
+class _NullTimer():
+    """ the timer returned by `timer()` when the timers are off """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+
+def enable(on=True):
+    """ function turns the timers on (or off) for the process """
+
+    global enabled
+    enabled = on
+
+
+def current_scope():
+    """ function returns the (spider name, module) code is running for
+    on this thread, or (None, None) """
+
+    return getattr(_local, 'scope', (None, None))
+
+
+class _Scope():
+    """ context manager which sets the spider and the module code is running for """
+
+    __slots__ = ('scope', 'previous')
+
+    def __init__(self, spider_name, module):
+        self.scope = (spider_name, module)
+
+    def __enter__(self):
+        self.previous = current_scope()
+        _local.scope = self.scope
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.scope = self.previous
+        return False
+
+
+def scope(spider_name, module=NO_MODULE):
+    """ function returns a context manager which records the timers
+    run inside it for 'spider_name' and 'module' """
+
+    if not enabled:
+        return _NULL_TIMER
+    return _Scope(spider_name, module)
+
+
+def record(section, seconds, spider_name=None, module=None):
+    """ function records 'seconds' spent in 'section'.
+
+    PARAMETERS:
+    - section: the name of the hot path (e.g. 'html_parse.html5lib')
+
+    - seconds: the time spent
+
+    - spider_name: the spider the time was spent for. default is the spider of the current scope
+
+    - module: the module the time was spent in. default is the module
+    of the current scope if it is the scope of 'spider_name' """
+
+    scope_spider, scope_module = current_scope()
+    if spider_name is None:
+        spider_name = scope_spider
+        if spider_name is None: # not run for a spider
+            return
+    if module is None:
+        module = scope_module if scope_spider == spider_name else NO_MODULE
+
+    with _lock:
+        sections = _timings.setdefault(spider_name, dict()).setdefault(module, dict())
+        timing = sections.get(section)
+        if timing is None:
+            sections[section] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+
+
+class _Timer():
+    """ context manager which records the time spent inside it """
+
+    __slots__ = ('section', 'spider_name', 'module', 'start')
+
+    def __init__(self, section, spider_name, module):
+        self.section = section
+        self.spider_name = spider_name
+        self.module = module
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.section, time.perf_counter() - self.start, self.spider_name, self.module)
+        return False
+
+
+def timer(section, spider_name=None, module=None):
+    """ function returns a context manager which records the time spent
+    inside it as 'section' (see `record()` for the parameters) """
+
+    if not enabled:
+        return _NULL_TIMER
+    return _Timer(section, spider_name, module)
+
+
+def timed(section):
+    """ decorator which records the time spent in the decorated function as 'section' """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Timer(section, None, None):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorator
+
+
+def timed_callback(callback, spider_name):
+    """ function returns the spider callback 'callback' wrapped, so the time
+    spent in it (and in the generator it returns, if any) is recorded as the
+    'parse' section of its module, and the timers run from it are recorded
+    for 'spider_name' and that module """
+
+    dispatcher = getattr(callback, '__module__', None) or NO_MODULE
+
+    @functools.wraps(callback)
+    def timing_callback(response, **kwargs):
+        with _Scope(spider_name, dispatcher), _Timer('parse', spider_name, dispatcher):
+            result = callback(response, **kwargs)
+        if result is None or not hasattr(result, '__next__'):
+            return result
+        # the parse is done as the generator is consumed. It is usually the
+        # generator of the sub-parser the dispatcher handed the page to
+        frame = getattr(result, 'gi_frame', None)
+        module = frame.f_globals.get('__name__', dispatcher) if frame is not None else dispatcher
+        return _timed_generator(result, spider_name, module)
+    return timing_callback
+
+
+def _timed_generator(generator, spider_name, module):
+    """ generator which records the time spent in all the steps of 'generator'
+    (an iterator), once it is exhausted (or closed), as a single 'parse' """
+
+    seconds = 0.0
+    try:
+        while True:
+            with _Scope(spider_name, module):
+                start = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+            yield item
+    finally:
+        if hasattr(generator, 'close'):
+            generator.close()
+        record('parse', seconds, spider_name, module)
+
+
+def timed_function(section, spider_name, function, module=None):
+    """ function returns 'function' wrapped so the time spent in it is recorded
+    as 'section' for 'spider_name' (e.g. for functions run on other threads).
+    Returns 'function' itself when the timers are off """
+
+    if not enabled:
+        return function
+
+    @functools.wraps(function)
+    def timing_function(*args, **kwargs):
+        with _Timer(section, spider_name, module or NO_MODULE):
+            return function(*args, **kwargs)
+    return timing_function
+
+
+def collect(spider_name, reset=True):
+    """ function returns the timings recorded for 'spider_name', as a dict:
+    - 'sections': the count, total and max seconds of every section
+    - 'modules': the same, for every module the time was spent in
+
+    PARAMETERS:
+    - spider_name: the name of the spider
+
+    - reset: forget the timings of the spider once collected. default is True """
+
+    with _lock:
+        modules = _timings.pop(spider_name, dict()) if reset else\
+                  {module: {section: list(timing) for section, timing in sections.items()}
+                   for module, sections in _timings.get(spider_name, dict()).items()}
+
+    totals = dict()
+    report_modules = dict()
+    for module, sections in sorted(modules.items()):
+        report_modules[module] = dict()
+        for section, (count, seconds, max_seconds) in sorted(sections.items()):
+            report_modules[module][section] = _timing(count, seconds, max_seconds)
+            total = totals.setdefault(section, [0, 0.0, 0.0])
+            total[0] += count
+            total[1] += seconds
+            total[2] = max(total[2], max_seconds)
+
+    return {
+        'spider': spider_name,
+        'sections': {section: _timing(*total) for section, total in sorted(totals.items())},
+        'modules': report_modules,
+    }
+
+
+def _timing(count, seconds, max_seconds):
+    return {'count': count, 'seconds': round(seconds, 6),
+            'avg_seconds': round(seconds / count, 6) if count else 0.0,
+            'max_seconds': round(max_seconds, 6)}
+
+
+def short_module_name(module):
+    """ function returns the name of 'module' relative to the scrapers package
+    (e.g. 'nces.parsers.nces_parser2'), as used in the scrapy stats """
+
+    for prefix in ('edscrapers.scrapers.', 'edscrapers.'):
+        if module.startswith(prefix):
+            return module[len(prefix):]
+    return module
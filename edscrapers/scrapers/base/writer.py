@@ -0,0 +1,163 @@
+""" module provides the background writer used by the item pipelines.
+
+Writing the scraped output (and logging every dataset) happens in the item
+pipelines, which run on the Twisted reactor thread. On slow (e.g. network)
+filesystems every write stalls the whole crawl. The `BackgroundWriter` runs
+the writes on a small pool of threads instead, fed through a bounded queue:
+- while the queue has room, an item is queued and passed on immediately, so
+  writes overlap with the downloads
+- once the queue is full, the pipeline gets a Deferred which fires when there
+  is room again. Scrapy waits for it before processing more items, which slows
+  the crawl down to the speed of the filesystem (backpressure)
+- the workers take up to 'batch_size' queued writes at a time
+
+`close()` blocks until every queued write is done, so it must be called from
+a thread (e.g. with `deferToThread()`) when called from the reactor """
+
+import time
+import queue
+import threading
+
+from twisted.internet import defer
+from twisted.internet.threads import deferToThread
+
+from edscrapers.cli import logger
+
+# default number of writes which can be waiting in the queue
+DEFAULT_QUEUE_SIZE = 1000
+# default number of writer threads
+DEFAULT_THREADS = 1
+# default number of queued writes a worker takes at a time
+DEFAULT_BATCH_SIZE = 50
+
+# put on the queue to stop a worker
+_STOP = object()
+
+
+class BackgroundWriter():
+    """ class represents the writer thread pool """
+
+    def __init__(self, name='writer', threads=DEFAULT_THREADS,
+                 queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE):
+        """ PARAMETERS:
+        - name: the name of the writer, used for the names of the threads and in logs
+
+        - threads: the number of writer threads. NOTE: writes run in the order they
+        were submitted only when there is a single thread
+
+        - queue_size: the number of writes which can be waiting in the queue
+
+        - batch_size: the number of queued writes a worker takes at a time """
+
+        self.name = name
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock() # protects the counts below
+        self.counts = {'queued': 0, 'written': 0, 'failed': 0, 'backpressure': 0,
+                       'max_queue_depth': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+        self.workers = [threading.Thread(target=self._work, name=f'{name}-{number}', daemon=True)
+                        for number in range(threads)]
+        for worker in self.workers:
+            worker.start()
+        self.closed = False
+
+    def submit(self, function, *args, **kwargs):
+        """ queues the call of 'function' with the provided arguments.
+        Returns None if the call was queued, otherwise (the queue is full) a
+        Deferred which fires once the call has been queued """
+
+        job = (time.monotonic(), function, args, kwargs)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.counts['backpressure'] += 1
+            return deferToThread(self._put, job)
+        self._queued()
+        return None
+
+    def submit_deferred(self, result, function, *args, **kwargs):
+        """ like `submit()`, but always returns a Deferred which fires with 'result'
+        (e.g. the item being processed by a pipeline) once the call is queued """
+
+        waiting = self.submit(function, *args, **kwargs)
+        if waiting is None:
+            return defer.succeed(result)
+        return waiting.addCallback(lambda _: result)
+
+    def _put(self, job):
+        self.queue.put(job)
+        self._queued()
+
+    def _queued(self):
+        with self.lock:
+            self.counts['queued'] += 1
+            self.counts['max_queue_depth'] = max(self.counts['max_queue_depth'],
+                                                 self.queue.qsize())
+
+    def _work(self):
+        while True:
+            batch = [self.queue.get()]
+            # a worker must take a single _STOP, so the batch ends at the first one
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            for job in batch:
+                if job is _STOP:
+                    stop = True
+                else:
+                    self._run(job)
+                self.queue.task_done()
+            if stop:
+                return
+
+    def _run(self, job):
+        queued_at, function, args, kwargs = job
+        try:
+            function(*args, **kwargs)
+            failed = False
+        except Exception as exc:
+            logger.error(f'{self.name}: {function.__name__} failed: {exc}')
+            failed = True
+
+        latency = time.monotonic() - queued_at
+        with self.lock:
+            self.counts['failed' if failed else 'written'] += 1
+            self.counts['latency_total'] += latency
+            self.counts['latency_max'] = max(self.counts['latency_max'], latency)
+
+    def queue_depth(self):
+        """ returns the number of writes waiting in the queue """
+        return self.queue.qsize()
+
+    def stats(self):
+        """ returns the writer counts, as recorded in the scrapy stats """
+
+        with self.lock:
+            counts = dict(self.counts)
+        done = counts['written'] + counts['failed']
+        return {
+            'queued': counts['queued'],
+            'written': counts['written'],
+            'failed': counts['failed'],
+            'backpressure': counts['backpressure'],
+            'queue_depth': self.queue_depth(),
+            'max_queue_depth': counts['max_queue_depth'],
+            'latency_avg': round(counts['latency_total'] / done, 6) if done else 0.0,
+            'latency_max': round(counts['latency_max'], 6),
+        }
+
+    def close(self):
+        """ waits until every queued write is done and stops the threads """
+
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.workers:
+            self.queue.put(_STOP)
+        for worker in self.workers:
+            worker.join()
@@ -7,10 +7,10 @@ import re
 import json
 import importlib
 
-import bs4
 
 from edscrapers.cli import logger
 from edscrapers.scrapers import base
+from edscrapers.scrapers.base import documents
 import edscrapers.scrapers.base.parser as base_parser
 from edscrapers.scrapers.dashboard import parsers
 from edscrapers.scrapers.base.models import Publisher
@@ -25,18 +25,16 @@ def parse(res):
 
     logger.debug(f'{res.url}')
 
-    soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
-
     publisher = Publisher()
     publisher['name'] = 'edgov'
     publisher['subOrganizationOf'] = None
 
     # check if the content contains any of the extensions
-    if soup_parser.body.find(name='a', href=base_parser.resource_checker,
-                             recursive=True) is None:
+    if not base_parser.has_resource_link(res):
         # no resource on this page, so return None
         return None
     # if code gets here, at least one resource was found
+    soup_parser = documents.get_soup(res)
     
     # check if the parser is working on EDGOV web page
     if soup_parser.body.find(name='div', recursive=True) is not None:
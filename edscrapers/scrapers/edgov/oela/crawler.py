@@ -4,7 +4,7 @@ from scrapy.spiders import CrawlSpider
 from scrapy.linkextractors import LinkExtractor
 
 from edscrapers.scrapers.edgov.oela.parser import parse
-from edscrapers.scrapers.base import helpers as h
+from edscrapers.scrapers.base.classifier import link_classifier
 
 
 class Crawler(CrawlSpider):
@@ -25,7 +25,7 @@ class Crawler(CrawlSpider):
         self.rules = [
             Rule(LinkExtractor(
                 allow=self.allowed_regex,
-                deny=["\\" + regex for regex in h.get_data_extensions().keys()],
+                deny=link_classifier.deny_patterns(),
                 #restrict_xpaths='//div[@id="maincontent"]'
             ), callback=parse, follow=True),
         ]
@@ -3,10 +3,10 @@
 import re
 import requests
 
-import bs4 # pip install beautifulsoup4
 from slugify import slugify
 
 import edscrapers.scrapers.base.helpers as h
+from edscrapers.scrapers.base import documents
 import edscrapers.scrapers.base.parser as base_parser
 from edscrapers.scrapers.base.models import Dataset, Resource
 
@@ -19,7 +19,7 @@ def parse(res, publisher) -> dict:
         return None
 
     try:
-        soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
+        soup_parser = documents.get_soup(res)
     except:
         return None
 
@@ -30,12 +30,7 @@ def parse(res, publisher) -> dict:
     # check if this page is a collection (i.e. collection of datasets)
     if len(dataset_containers) > 0: # this is a collection
         # create the collection (with a source)
-        collection = h.extract_dataset_collection_from_url(collection_url=res.url,
-                                        namespace="all",
-                                        source_url=\
-                                        str(res.request.headers.get(str(b'Referer',
-                                                                    encoding='utf-8'), b''), 
-                                            encoding='utf-8'))
+        collection = h.extract_dataset_collection_from_response(res, namespace="all")
 
     for container in dataset_containers:
         # create dataset model dict
@@ -128,9 +123,6 @@ def parse(res, publisher) -> dict:
                             [resource_link['href'].rfind('.') + 1:]
             resource['format'] = resource_format
 
-            # Add header information to resource object
-            resource['headers'] = h.get_resource_headers(res.url, resource_link['href'])
-
             # add the resource to collection of resources
             dataset['resources'].append(resource)
         
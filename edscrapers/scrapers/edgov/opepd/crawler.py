@@ -5,6 +5,7 @@ from scrapy.linkextractors import LinkExtractor
 
 from edscrapers.scrapers.edgov.opepd.parser import parse
 from edscrapers.scrapers.base import helpers as h
+from edscrapers.scrapers.base.classifier import link_classifier
 
 class Crawler(CrawlSpider):
 
@@ -23,7 +24,7 @@ class Crawler(CrawlSpider):
         self.rules = [
             Rule(LinkExtractor(
                 allow=self.allowed_regex,
-                deny=["\\" + regex for regex in h.get_data_extensions().keys()],
+                deny=link_classifier.deny_patterns(),
                 #deny=f'.*({"|".join(h.get_data_extensions().keys())})',
                 restrict_xpaths='//*[@id="maincontent"]'
             ), callback=parse, follow=True),
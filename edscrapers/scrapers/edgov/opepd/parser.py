@@ -6,9 +6,9 @@ other parsers in the 'parsers' subpackage"""
 import re
 import json
 
-import bs4
 
 from edscrapers.scrapers import base
+from edscrapers.scrapers.base import documents
 import edscrapers.scrapers.base.parser as base_parser
 from edscrapers.scrapers.edgov.opepd import parsers
 
@@ -25,17 +25,15 @@ def parse(res, publisher={'name': 'opepd', 'subOrganizationOf': None}):
     if not isinstance(getattr(res, 'text', None), str):
         return None
 
-    # create parser object
     try:
-        soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
+        # check if the content contains any of the extensions
+        if not base_parser.has_resource_link(res):
+            # no resource on this page, so return None
+            return None
+        # create parser object
+        soup_parser = documents.get_soup(res)
     except:
         return None
-        
-    # check if the content contains any of the extensions
-    if soup_parser.body.find(name='a', href=base_parser.resource_checker,
-                             recursive=True) is None:
-        # no resource on this page, so return None
-        return None
 
     # if code gets here, at least one resource was found
     
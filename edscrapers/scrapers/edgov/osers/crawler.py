@@ -4,7 +4,7 @@ from scrapy.spiders import CrawlSpider
 from scrapy.linkextractors import LinkExtractor
 
 from edscrapers.scrapers.edgov.osers.parser import parse
-from edscrapers.scrapers.base import helpers as h
+from edscrapers.scrapers.base.classifier import link_classifier, DATA
 
 class Crawler(CrawlSpider):
 
@@ -25,7 +25,7 @@ class Crawler(CrawlSpider):
         self.rules = [
             Rule(LinkExtractor(
                 allow=self.allowed_regex,
-                deny_extensions=[regex[1:] for regex in h.get_data_extensions().keys()],
+                deny_extensions=link_classifier.deny_extensions([DATA]),
                 allow_domains=Crawler.allowed_domains
                 #restrict_xpaths='//*[@id="maincontent"]'
             ), callback=parse, follow=True),
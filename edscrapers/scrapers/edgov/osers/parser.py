@@ -1,9 +1,8 @@
-import bs4
-
 import logging
 from datetime import datetime
 
 from edscrapers.cli import logger
+from edscrapers.scrapers.base import documents
 import edscrapers.scrapers.base.parser as base_parser
 from edscrapers.scrapers.edgov.osers import parsers
 
@@ -19,16 +18,15 @@ def parse(res, publisher={'name': 'osers', 'subOrganizationOf': None}):
         return None
 
     try:
-        soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
+        # check if the content contains any of the extensions
+        if not base_parser.has_resource_link(res):
+            # no resource on this page, so return None
+            return None
+        # create parser object
+        soup_parser = documents.get_soup(res)
     except:
         return None
 
-    # check if the content contains any of the extensions
-    if soup_parser.body.find(name='a', href=base_parser.resource_checker,
-                             recursive=True) is None:
-        # no resource on this page, so return None
-        return None
-
     # if code gets here, at least one resource was found
     
     # check if the parser is working on OSERS web page
@@ -7,9 +7,9 @@ import re
 import json
 import importlib
 
-import bs4
 
 from edscrapers.scrapers import base
+from edscrapers.scrapers.base import documents
 import edscrapers.scrapers.base.parser as base_parser
 from edscrapers.scrapers.edgov import parsers
 from edscrapers.scrapers.edgov.offices_map import offices_map
@@ -24,12 +24,7 @@ def parse(res):
     if '/print/' in res.url:
         return None
 
-    soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
-
-    try:
-        office = soup_parser.head.find(name='meta', attrs={'name': 'ED.office'})['content']
-    except:
-        office = None
+    office = base_parser.get_meta_content(res, 'ED.office')
 
     publisher = Publisher()
     publisher['name'] = 'edgov'
@@ -45,11 +40,11 @@ def parse(res):
             return parser.parse(res=res, publisher=publisher)
 
     # check if the content contains any of the extensions
-    if soup_parser.body.find(name='a', href=base_parser.resource_checker,
-                             recursive=True) is None:
+    if not base_parser.has_resource_link(res):
         # no resource on this page, so return None
         return None
     # if code gets here, at least one resource was found
+    soup_parser = documents.get_soup(res)
     
     # check if the parser is working on EDGOV web page
     if soup_parser.body.find(name='div', recursive=True) is not None:
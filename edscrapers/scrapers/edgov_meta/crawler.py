@@ -6,7 +6,7 @@ from scrapy.spiders import CrawlSpider
 from scrapy.linkextractors import LinkExtractor
 
 from edscrapers.scrapers.edgov_meta.parser import parse
-from edscrapers.scrapers.base import helpers as h
+from edscrapers.scrapers.base.classifier import link_classifier
 
 
 class Crawler(CrawlSpider):
@@ -25,15 +25,11 @@ class Crawler(CrawlSpider):
             'https://www2.ed.gov/rschstat/catalog/index.html'
         ]
 
-        extensions_to_avoid = []
-        for ext in [h.get_data_extensions(), h.get_document_extensions(), h.get_avoidable_extensions()]:
-            extensions_to_avoid.extend(ext.keys())
-
         # Make rules
         self.rules = [
             Rule(LinkExtractor(
                 allow=self.allowed_regex,
-                deny_extensions=[ext[1:] for ext in extensions_to_avoid],
+                deny_extensions=link_classifier.deny_extensions(),
             ), callback=parse, follow=True),
         ]
 
@@ -6,9 +6,9 @@ other parsers in the 'parsers' subpackage"""
 import re
 import json
 
-import bs4
 
 from edscrapers.scrapers import base
+from edscrapers.scrapers.base import documents
 import edscrapers.scrapers.base.parser as base_parser
 from edscrapers.scrapers.edgov import parsers
 from edscrapers.scrapers.base.models import MetaPage, MetaItem, MetaHeader
@@ -21,7 +21,7 @@ def parse(res):
     if '/print/' in res.url:
         return None
 
-    soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
+    soup_parser = documents.get_soup(res)
     all_meta = soup_parser.find_all(name='meta')
     all_headers = res.headers
 
@@ -8,13 +8,13 @@ import json
 from urllib.parse import urlparse
 from urllib.parse import urljoin
 
-import bs4
 from dateutil import parser
 from slugify import slugify
 
 from edscrapers.cli import logger
 import edscrapers.scrapers.base.helpers as h
 from edscrapers.scrapers import base
+from edscrapers.scrapers.base import documents
 import edscrapers.scrapers.base.parser as base_parser
 from edscrapers.scrapers.fsa import parsers
 from edscrapers.scrapers.base.models import Dataset
@@ -29,7 +29,7 @@ def parse(res):
         return None
 
     try:
-        soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
+        soup_parser = documents.get_soup(res)
     except:
         return None
 
@@ -44,18 +44,10 @@ def parse(res):
         return None
     # if code gets here, at least one resource was found
 
-    # create parser object
-    soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
-
     # create dataset model dict
     dataset = Dataset()
     # create the collection (with a source)
-    collection = h.extract_dataset_collection_from_url(collection_url=res.url,
-                                        namespace="all",
-                                        source_url=\
-                                        str(res.request.headers.get(str(b'Referer',
-                                                                    encoding='utf-8'), b''), 
-                                            encoding='utf-8'))
+    collection = h.extract_dataset_collection_from_response(res, namespace="all")
     # specify the collection which the dataset belongs to
     if collection: # if collection exist
         dataset['collection'] = collection
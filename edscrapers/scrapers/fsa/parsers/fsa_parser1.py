@@ -51,9 +51,6 @@ def parse(res, container, dataset) -> dict:
                         [resource_link['href'].rfind('.') + 1:]
         resource['format'] = resource_format
 
-        # Add header information to resource object
-        resource['headers'] = h.get_resource_headers(res.url, resource_link['href'])
-
         # add the resource to collection of resources
         dataset['resources'].append(resource)
     
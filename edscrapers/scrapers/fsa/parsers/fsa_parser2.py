@@ -28,9 +28,6 @@ def parse(res, container, dataset) -> dict:
                         [resource_link['value'].rfind('.') + 1:]
         resource['format'] = resource_format
 
-        # Add header information to resource object
-        resource['headers'] = h.get_resource_headers(res.url, resource_link['value'])
-
         # add the resource to collection of resources
         dataset['resources'].append(resource)
 
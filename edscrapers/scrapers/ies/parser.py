@@ -6,9 +6,9 @@ other parsers in the 'parsers' subpackage"""
 import re
 import json
 
-import bs4
 
 from edscrapers.scrapers import base
+from edscrapers.scrapers.base import documents
 import edscrapers.scrapers.base.parser as base_parser
 from edscrapers.scrapers.ies import parsers
 
@@ -19,13 +19,13 @@ def parse(res):
     """ function parses content to create a dataset model
     or return None if no resource in content"""
 
-    soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
     # check if the content contains any of the extensions
-    if soup_parser.body.find(name='a', href=base_parser.resource_checker,
-                             recursive=True) is None:
+    if not base_parser.has_resource_link(res):
         # no resource on this page, so return None
         return None
 
+    soup_parser = documents.get_soup(res)
+
     # if code gets here, at least one resource was found
 
     if (soup_parser.body.find(name='div', class_='nces', recursive=True) is not None)\
@@ -6,7 +6,7 @@ from scrapy.spiders import CrawlSpider
 from scrapy.linkextractors import LinkExtractor
 
 from edscrapers.scrapers.nces.parser import parse
-from edscrapers.scrapers.base import helpers as h
+from edscrapers.scrapers.base.classifier import link_classifier
 
 
 class Crawler(CrawlSpider):
@@ -33,7 +33,7 @@ class Crawler(CrawlSpider):
         self.rules = [
             Rule(LinkExtractor(
                 allow=self.allowed_regex,
-                deny=["\\" + regex for regex in h.get_data_extensions().keys()],
+                deny=link_classifier.deny_patterns(),
                 # restrict_xpaths='//*[@id="maincontent"]'
                 # process_value=lambda value: value.replace('http', 'https', 1),
             ), callback=parse, follow=True),
@@ -1,13 +1,12 @@
 # -*- coding: utf-8 -*-
 import re
 
-from urllib.parse import urlparse, urljoin
 from scrapy.spiders import Rule
 from scrapy.spiders import CrawlSpider
 from scrapy.linkextractors import LinkExtractor
 
+from edscrapers.scrapers.base import canonical
 from edscrapers.scrapers.rems.parser import parse
-from edscrapers.scrapers.base import helpers as h
 
 
 class Crawler(CrawlSpider):
@@ -19,24 +18,29 @@ class Crawler(CrawlSpider):
 
     #allowed_domains = ['rems.ed.gov']
 
+    # the session tokens (e.g. '(X(1)S(...))/') and the query of the
+    # urls are stripped (see scrapers/base/canonical.py)
+    canonical_url = {
+        'strip_patterns': [r'\(X\(1\)S.*\)\)/'],
+        'strip_query_params': ['*'],
+    }
+
     def __init__(self):
 
+        self.canonicalizer = canonical.for_spider(self)
+
         self.start_urls = [
             'http://rems.ed.gov/',
             'https://rems.ed.gov/REMSPublications.aspx',
             'https://rems.ed.gov/#resources',
         ]
 
-        extensions_to_avoid = []
-        for ext in [h.get_data_extensions(), h.get_document_extensions(), h.get_avoidable_extensions()]:
-            extensions_to_avoid.extend(ext.keys())
-
         # Make rules
         self.rules = [
             Rule(LinkExtractor(
                 #allow_domains=self.allowed_domains,
                 #allow=self.allowed_regex,
-                #deny_extensions=[ext[1:] for ext in extensions_to_avoid],
+                #deny_extensions=link_classifier.deny_extensions(),
                 process_value=self.process_value,
                 unique=True,
             ), callback=parse, follow=True,
@@ -48,20 +52,10 @@ class Crawler(CrawlSpider):
 
     def process_value(self, value):
         
-        url = value
-
-        if re.match(self.allowed_regex, url) is None:
+        if re.match(self.allowed_regex, value) is None:
             return None
 
-        regex_search = re.search(r'\(X\(1\)S.*\)\)/', url)
-        if regex_search:
-            matched_str = regex_search.group()
-            url = url.replace(matched_str, '')
-
-        url_parsed = urlparse(url)
-        url = urljoin(url, url_parsed.path) 
-        
-        return url
+        return self.canonicalizer.process_value(value)
 
     def process_links(self, links):
         filtered = []
@@ -3,10 +3,10 @@ import re
 import json
 import importlib
 
-import bs4
 from urllib.parse import urlparse, urljoin
 
 from edscrapers.scrapers import base
+from edscrapers.scrapers.base import documents
 import edscrapers.scrapers.base.parser as base_parser
 from edscrapers.scrapers.rems import parsers
 from edscrapers.scrapers.base.models import Publisher
@@ -18,6 +18,7 @@ def parse(res):
     if '/print/' in res.url:
         return None
 
+    original_res = res
     url = res.url
     regex_search = re.search(r'\(X\(1\)S.*\)\)/', url)
     if regex_search:
@@ -28,19 +29,20 @@ def parse(res):
     url_parsed = urlparse(url)
     url = urljoin(url, url_parsed.path)
     res = res.replace(url=url) 
-
-    soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
+    # the replaced response has the same body as the original one,
+    # so reuse the document already parsed for the original response
+    documents.alias(res, original_res)
 
     publisher = Publisher()
     publisher['name'] = 'rems'
     publisher['subOrganizationOf'] = None
 
     # check if the content contains any of the extensions
-    if soup_parser.body.find(name='a', href=base_parser.resource_checker,
-                             recursive=True) is None:
+    if not base_parser.has_resource_link(res):
         # no resource on this page, so return None
         return None
     # if code gets here, at least one resource was found
+    soup_parser = documents.get_soup(res)
     
     # check if the parser is working on EDGOV web page
     if soup_parser.body.find(name='div', recursive=True) is not None:
@@ -7,10 +7,10 @@ import re
 import json
 import importlib
 
-import bs4
 
 from edscrapers.scrapers import base
 from edscrapers.scrapers.sites import parsers
+from edscrapers.scrapers.base import documents
 import edscrapers.scrapers.base.parser as base_parser
 from edscrapers.scrapers.base.models import Publisher
 
@@ -26,8 +26,6 @@ def parse(res):
     if '/print/' in res.url:
         return None
 
-    soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
-
     try:
         publisher = res.url.split('sites.ed.gov')[1].split('/')[1]
     except:
@@ -43,12 +41,12 @@ def parse(res):
 
 
     # check if the content contains any of the extensions
-    if soup_parser.body.find(name='a', href=base_parser.resource_checker,
-                             recursive=True) is None:
+    if not base_parser.has_resource_link(res):
         # no resource on this page, so return None
         print('(no resources found)\n')
         return None
     # if code gets here, at least one resource was found
+    soup_parser = documents.get_soup(res)
     
     if soup_parser.body.find(name='div', recursive=True) is not None:
         # parse the page with the parser and return result
@@ -0,0 +1,165 @@
+""" module benchmarks the graph updates done for every response of a crawl
+(see `GraphMiddleWare.process_spider_input()` and `GraphItemPipeline.process_item()`)
+with the name-indexed ScraperGraph against a plain igraph Graph, which looks
+vertices up by scanning them.
+
+The benchmark grows a graph the way a crawl does (every page is linked from
+an already crawled page, and some pages yield a dataset) and reports the
+average cost of a response at several graph sizes. With the name index the
+cost of the vertex lookups stays flat as the graph grows.
+
+igraph adds vertices and edges in time proportional to the size of the graph,
+so the indexed graph is also grown with its vertices and edges staged and
+added in batches (as the crawl does, see `ScraperGraph.stage_vertex()`) """
+
+import os
+import json
+import time
+import random
+import pathlib
+
+import igraph
+
+from edscrapers.cli import logger
+from edscrapers.scrapers.base.graph import ScraperGraph
+
+OUTPUT_DIR = os.getenv('ED_OUTPUT_PATH')
+
+# number of pages crawled when none is given
+DEFAULT_PAGES = 20000
+# number of responses timed at each checkpoint
+SAMPLE_SIZE = 200
+# number of staged vertices and edges added at a time by the batched graph
+FLUSH_SIZE = 500
+
+
+def _find(graph, name):
+    """ function looks a vertex up by name with the lookup each graph supports """
+
+    if isinstance(graph, ScraperGraph):
+        return graph.find_vertex(name)
+    try:
+        return graph.vs.find(name=name)
+    except ValueError:
+        return None
+
+
+def _crawl_response(graph, url, referer, dataset_name=None, flush_size=None):
+    """ function applies the graph updates of a single response (and its dataset).
+    If 'flush_size' is provided, the vertices and edges are staged and added
+    to the graph in batches of 'flush_size' """
+
+    if flush_size is not None:
+        return _crawl_response_staged(graph, url, referer, dataset_name, flush_size)
+
+    current_vertex = _find(graph, url)
+    if current_vertex is None:
+        current_vertex = graph.add_vertex(name=url, color='pink', shape=1)
+        current_vertex['label'] = f"P{current_vertex.index}"
+    parent_vertex = _find(graph, referer)
+    graph.add_edge(parent_vertex.index, current_vertex.index)
+
+    if dataset_name is not None and _find(graph, dataset_name) is None:
+        page_vertex = _find(graph, url)
+        dataset_vertex = graph.add_vertex(name=dataset_name, color='blue', shape=1)
+        graph.add_edge(page_vertex.index, dataset_vertex.index)
+
+
+def _crawl_response_staged(graph, url, referer, dataset_name, flush_size):
+    """ function applies the graph updates of a single response the way
+    `GraphMiddleWare` and `GraphItemPipeline` do """
+
+    current_vertex = graph.find_vertex(url)
+    if current_vertex is None:
+        current_vertex = graph.stage_vertex(name=url, color='pink', shape=1)
+        current_vertex['label'] = f"P{current_vertex.index}"
+    parent_vertex = graph.find_vertex(referer)
+    graph.stage_edge(parent_vertex.index, current_vertex.index)
+
+    if dataset_name is not None and not graph.has_vertex(dataset_name):
+        dataset_vertex = graph.stage_vertex(name=dataset_name, color='blue', shape=1)
+        graph.stage_edge(current_vertex.index, dataset_vertex.index)
+    graph.maybe_flush(flush_size, float('inf'))
+
+
+def benchmark_graph(graph, pages, checkpoints, seed=0, flush_size=None):
+    """ function grows 'graph' to 'pages' page vertices (staging its vertices
+    and edges if 'flush_size' is provided). Returns two dicts keyed by the
+    'checkpoints' (page counts): the average time (in microseconds) of the
+    vertex lookups of a response (3 lookups) and of the whole response """
+
+    randomizer = random.Random(seed)
+    graph.add_vertex(name='base_vertex')
+    urls = ['base_vertex']
+    lookups = dict()
+    responses = dict()
+    checkpoints = sorted(checkpoints)
+
+    for number in range(pages):
+        url = f'https://www2.ed.gov/page/{number}.html'
+        referer = urls[randomizer.randrange(len(urls))]
+        dataset_name = f'scrapers/edgov/{number}.json' if randomizer.random() < 0.2 else None
+
+        checkpoint = next((c for c in checkpoints if c - SAMPLE_SIZE <= number < c), None)
+        if checkpoint is not None:
+            names = [urls[randomizer.randrange(len(urls))] for _ in range(3)]
+            start = time.perf_counter()
+            for name in names:
+                _find(graph, name)
+            lookups.setdefault(checkpoint, []).append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        _crawl_response(graph, url, referer, dataset_name, flush_size=flush_size)
+        if checkpoint is not None:
+            responses.setdefault(checkpoint, []).append(time.perf_counter() - start)
+        urls.append(url)
+
+    def average(timings):
+        return {checkpoint: round(sum(samples) / len(samples) * 1e6, 1)
+                for checkpoint, samples in timings.items()}
+    return average(lookups), average(responses)
+
+
+def benchmark(pages=DEFAULT_PAGES):
+    """ function runs the graph benchmark, logs and writes
+    (to ED_OUTPUT_PATH/tools/benchmark/graph.json) the report.
+    Returns the report """
+
+    checkpoints = sorted({max(SAMPLE_SIZE, pages * step // 4) for step in range(1, 5)})
+    indexed_lookup, indexed_response = benchmark_graph(ScraperGraph(directed=True), pages, checkpoints)
+    scan_lookup, scan_response = benchmark_graph(igraph.Graph(directed=True), pages, checkpoints)
+    batched_graph = ScraperGraph(directed=True)
+    batched_lookup, batched_response = benchmark_graph(batched_graph, pages, checkpoints,
+                                                       flush_size=FLUSH_SIZE)
+    batched_graph.flush()
+    report = {
+        'pages': pages,
+        'indexed': {'lookup_us_per_response': indexed_lookup, 'us_per_response': indexed_response},
+        'scan': {'lookup_us_per_response': scan_lookup, 'us_per_response': scan_response},
+        'batched': {'lookup_us_per_response': batched_lookup, 'us_per_response': batched_response,
+                    'flush_size': FLUSH_SIZE, 'flushes': batched_graph.flush_stats['flushes'],
+                    'flush_ms_avg': round(batched_graph.flush_stats['seconds'] /
+                                          max(batched_graph.flush_stats['flushes'], 1) * 1e3, 3),
+                    'flush_ms_max': round(batched_graph.flush_stats['max_seconds'] * 1e3, 3)},
+    }
+
+    logger.info(f"Graph cost per response (microseconds) while crawling {pages} pages:")
+    logger.info(f"  {'pages':>8}  {'indexed lookups':>16} {'indexed total':>14}  "
+                f"{'scan lookups':>13} {'scan total':>11}  {'batched total':>14}")
+    for checkpoint in checkpoints:
+        logger.info(f"  {checkpoint:>8}  {indexed_lookup.get(checkpoint, 0):>16.1f} "
+                    f"{indexed_response.get(checkpoint, 0):>14.1f}  "
+                    f"{scan_lookup.get(checkpoint, 0):>13.1f} {scan_response.get(checkpoint, 0):>11.1f}  "
+                    f"{batched_response.get(checkpoint, 0):>14.1f}")
+    # NOTE: the 'total' includes adding the vertices and edges, which igraph
+    # does in time proportional to the size of the graph. The batched total
+    # spreads the cost of a batch over the responses which staged it
+    logger.info(f"  batched: {report['batched']['flushes']} flushes of {FLUSH_SIZE} vertices and edges, "
+                f"{report['batched']['flush_ms_avg']}ms on average, {report['batched']['flush_ms_max']}ms at most")
+
+    output_path = os.path.join(OUTPUT_DIR, 'tools', 'benchmark', 'graph.json')
+    pathlib.Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    logger.info(f'Benchmark report written to {output_path}')
+    return report
@@ -0,0 +1,130 @@
+""" module benchmarks the link classifier (see edscrapers.scrapers.base.classifier)
+against the per-extension loop the parsers used to locate resource links with.
+
+The links classified are either generated (a mix of data, document, avoidable
+and html links, with and without query strings) or read from the saved pages of
+the parity corpus (see edscrapers.tools.parity) """
+
+import os
+import json
+import time
+import random
+import pathlib
+
+from edscrapers.cli import logger
+from edscrapers.scrapers.base import classifier
+
+OUTPUT_DIR = os.getenv('ED_OUTPUT_PATH')
+
+# number of links generated when no corpus is used
+DEFAULT_LINKS = 100000
+
+
+def _loop_resource_checker(tag_attr):
+    """ function mirrors the resource checker the parsers used before the
+    link classifier existed: it rebuilds the extension list for every call
+    and tests each extension in turn """
+
+    if tag_attr != '' and tag_attr is not None:
+        for extension in dict(classifier.DATA_EXTENSIONS).keys():
+            if tag_attr.lower().endswith(f'{extension}') and\
+                (tag_attr[tag_attr.rfind('/')+1:].lower() not in classifier.DENY_LIST):
+                return True
+        return False
+    return False
+
+
+def generate_links(count=DEFAULT_LINKS, seed=0):
+    """ function generates 'count' links with a realistic mix of extensions """
+
+    randomizer = random.Random(seed)
+    extensions = (list(classifier.DATA_EXTENSIONS) + list(classifier.DOCUMENT_EXTENSIONS) +
+                  list(classifier.AVOIDABLE_EXTENSIONS))
+    links = []
+    for number in range(count):
+        path = f'https://www2.ed.gov/about/offices/list/{randomizer.randint(0, 999)}/page{number}'
+        kind = randomizer.random()
+        if kind < 0.6: # most links are html pages
+            path += randomizer.choice(['.html', '.htm', '.asp', '/', ''])
+        else:
+            path += randomizer.choice(extensions)
+        if randomizer.random() < 0.1:
+            path += f'?id={number}'
+        links.append(path)
+    return links
+
+
+def load_corpus_links(corpus_dir):
+    """ function reads the href of every <a> tag in the saved pages of 'corpus_dir' """
+
+    from parsel import Selector
+
+    links = []
+    for html_path in sorted(pathlib.Path(corpus_dir).glob('**/*.html')):
+        with open(html_path, 'r', errors='replace') as html_file:
+            links.extend(Selector(text=html_file.read()).xpath('//a/@href').getall())
+    return links
+
+
+def _time(function, links, repeat):
+    """ function returns the best time (in seconds) taken by 'function' to check all 'links' """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for link in links:
+            function(link)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_links(links, repeat=3):
+    """ function classifies 'links' with the link classifier and with the
+    per-extension loop. Returns a report dict """
+
+    link_classifier = classifier.LinkClassifier()
+
+    # both implementations must agree on which links are data resources
+    disagreements = [link for link in links
+                     if _loop_resource_checker(link) != link_classifier.is_data(link)]
+
+    categories = dict()
+    for link in links:
+        category = link_classifier.category(link)
+        categories[category] = categories.get(category, 0) + 1
+
+    loop_seconds = _time(_loop_resource_checker, links, repeat)
+    classifier_seconds = _time(link_classifier.classify, links, repeat)
+    return {
+        'links': len(links),
+        'categories': categories,
+        'disagreements': disagreements[:20],
+        'loop_links_per_sec': len(links) / loop_seconds if loop_seconds else 0,
+        'classifier_links_per_sec': len(links) / classifier_seconds if classifier_seconds else 0,
+    }
+
+
+def benchmark(count=DEFAULT_LINKS, corpus_dir=None, repeat=3):
+    """ function runs the link classification benchmark, logs and writes
+    (to ED_OUTPUT_PATH/tools/benchmark/links.json) the report.
+    Returns the report """
+
+    if corpus_dir:
+        links = load_corpus_links(corpus_dir)
+    else:
+        links = generate_links(count)
+
+    report = benchmark_links(links, repeat=repeat)
+    logger.info(f"Classified {report['links']} links: {report['categories']}")
+    logger.info(f"  per-extension loop: {report['loop_links_per_sec']:,.0f} links/s")
+    logger.success(f"  link classifier:    {report['classifier_links_per_sec']:,.0f} links/s")
+    if report['disagreements']:
+        logger.warning(f"The classifier disagrees with the loop on: {report['disagreements']}")
+
+    output_path = os.path.join(OUTPUT_DIR, 'tools', 'benchmark', 'links.json')
+    pathlib.Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    logger.info(f'Benchmark report written to {output_path}')
+    return report
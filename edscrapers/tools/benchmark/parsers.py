@@ -0,0 +1,324 @@
+""" module benchmarks the parsers of the scrapers against the saved pages of the
+parser benchmark corpus (edscrapers/tools/benchmark/corpus), with each of the
+html parsing backends (see edscrapers.scrapers.base.documents).
+
+The corpus holds a subdirectory per scraper (named like the scraper given to
+`eds scrape`, e.g. 'nces' or 'edgov.osers'), in the format of the parity corpus
+(see edscrapers.tools.parity): a '<page>.html' file per page and a '<page>.json'
+file with the 'url', 'referer' and 'referer_title' of the page, and the 'parser'
+(of the scraper's 'parsers' subpackage, e.g. 'parser1') which handles the page.
+Every page is parsed by the main parser of its scraper, as in a crawl.
+
+For every parser and backend the benchmark reports:
+- the pages parsed per second (the best of 'repeat' rounds over the pages
+  of all the parsers)
+- the peak memory (KB) used while parsing a page (the highest of the pages)
+- the memory (KB) and the number of memory blocks still allocated when the
+  parser returns (the response, the parsed document and the datasets), per page
+
+The memory is measured with tracemalloc, in a round of its own, as tracing
+slows the parsing down.
+
+The report of every run is kept in ED_OUTPUT_PATH/tools/benchmark/parsers,
+named after the date and the commit it ran on, so runs can be compared
+across commits (see `compare()`) """
+
+import gc
+import os
+import json
+import time
+import pathlib
+import platform
+import importlib
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+from scrapy import Item
+
+from edscrapers.cli import logger
+from edscrapers.scrapers.base import documents
+from edscrapers.tools.parity import parity
+
+OUTPUT_DIR = os.getenv('ED_OUTPUT_PATH')
+
+# the corpus shipped with the package
+CORPUS_DIR = pathlib.Path(__file__).parent / 'corpus'
+
+# number of timed rounds over the pages of a parser
+DEFAULT_REPEAT = 5
+
+# a parser is reported as regressed when its pages/s drops by more than this (percent)
+DEFAULT_THRESHOLD = 10.0
+
+
+def corpus_scrapers(corpus_dir=CORPUS_DIR):
+    """ function returns the scrapers which have saved pages in 'corpus_dir' """
+
+    return sorted(path.name for path in pathlib.Path(corpus_dir).glob('*') if path.is_dir())
+
+
+def load_parser_pages(corpus_dir, scraper):
+    """ function loads the saved pages of 'scraper' from 'corpus_dir'.
+    Returns a dict of the pages (parity Page objects) of each parser """
+
+    pages = dict()
+    for page in parity.load_corpus_pages(corpus_dir, scraper):
+        meta_path = pathlib.Path(corpus_dir, scraper, page.name).with_suffix('.json')
+        parser = 'parser'
+        if meta_path.exists():
+            with open(meta_path, 'r') as meta_file:
+                parser = json.load(meta_file).get('parser', parser)
+        pages.setdefault(f'{scraper}.{parser}', []).append(page)
+    return pages
+
+
+def _count_datasets(result):
+    """ function consumes the output of a parser and returns the number of datasets """
+
+    if result is None:
+        return 0
+    if isinstance(result, Item): # a single Dataset was returned
+        return 1
+    return sum(1 for dataset in result if dataset is not None)
+
+
+def _parse(parser, page, backend, snapshot=False):
+    """ function parses 'page' with 'parser' using the html parsing 'backend'.
+    Returns the number of datasets, the seconds taken and (if 'snapshot')
+    the tracemalloc snapshot taken before the parsed document is freed """
+
+    res = page.to_response()
+    documents.set_backend(res, backend)
+    start = time.perf_counter()
+    try:
+        datasets = _count_datasets(parser.parse(res))
+        seconds = time.perf_counter() - start
+        return datasets, seconds, tracemalloc.take_snapshot() if snapshot else None
+    finally:
+        documents.release(res)
+
+
+def time_pages(parser, pages, backend):
+    """ function parses 'pages' with 'parser' and 'backend'.
+    Returns the number of datasets and the seconds taken """
+
+    # like timeit, the garbage collector does not run while the pages are timed,
+    # so a collection (of the objects of another parser) is not timed with a page
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    seconds = 0.0
+    datasets = 0
+    try:
+        for page in pages:
+            page_datasets, page_seconds, _ = _parse(parser, page, backend)
+            datasets += page_datasets
+            seconds += page_seconds
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return datasets, seconds
+
+
+def measure_parser(parser, pages, backend):
+    """ function measures the memory used by 'parser' and 'backend' to parse 'pages'.
+    Returns the peak KB (the highest of the pages) and the KB and blocks
+    still allocated when the parser returns (the average of the pages) """
+
+    peak = 0
+    allocated = 0
+    blocks = 0
+    for page in pages:
+        tracemalloc.start()
+        try:
+            _, _, snapshot = _parse(parser, page, backend, snapshot=True)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+        statistics = snapshot.statistics('filename')
+        allocated += sum(statistic.size for statistic in statistics)
+        blocks += sum(statistic.count for statistic in statistics)
+    return round(peak / 1024, 1), round(allocated / len(pages) / 1024, 1), round(blocks / len(pages))
+
+
+def benchmark_parsers(scrapers, backends, corpus_dir=CORPUS_DIR, repeat=DEFAULT_REPEAT):
+    """ function benchmarks the parsers of 'scrapers' with each of the 'backends'.
+    Returns the list of results (a dict per parser and backend) """
+
+    tasks = [] # (parser name, parser module, pages, backend)
+    for scraper in scrapers:
+        parser_pages = load_parser_pages(corpus_dir, scraper)
+        if not parser_pages:
+            logger.warning(f"No saved pages found for '{scraper}'")
+            continue
+        parser = importlib.import_module(f'edscrapers.scrapers.{scraper}.parser')
+        for name, pages in sorted(parser_pages.items()):
+            tasks.extend((name, parser, pages, backend) for backend in backends)
+
+    best = dict()
+    with parity.offline_helpers():
+        # the rounds go over every parser in turn (rather than timing a parser
+        # 'repeat' times in a row), so a slow spell of the machine does not
+        # slow down all the rounds of a parser
+        for _ in range(max(1, repeat)):
+            for name, parser, pages, backend in tasks:
+                datasets, seconds = time_pages(parser, pages, backend)
+                if (name, backend) not in best or seconds < best[(name, backend)][1]:
+                    best[(name, backend)] = (datasets, seconds)
+
+        results = []
+        for name, parser, pages, backend in tasks:
+            datasets, seconds = best[(name, backend)]
+            peak_kb, allocated_kb, allocated_blocks = measure_parser(parser, pages, backend)
+            results.append({
+                'parser': name,
+                'backend': backend,
+                'pages': len(pages),
+                'datasets': datasets,
+                'seconds': round(seconds, 6),
+                'pages_per_sec': round(len(pages) / seconds, 2) if seconds else 0.0,
+                'peak_kb': peak_kb,
+                'allocated_kb': allocated_kb,
+                'allocated_blocks': allocated_blocks,
+            })
+    return results
+
+
+def git_commit():
+    """ function returns the (short) commit the package is checked out at,
+    and whether the checkout has local changes. The commit is 'unknown'
+    outside a git checkout """
+
+    package_dir = pathlib.Path(__file__).resolve().parents[2]
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=package_dir,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=package_dir,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, bool(status)
+
+
+def reports_dir():
+    """ function returns the directory the benchmark reports are kept in """
+    return pathlib.Path(OUTPUT_DIR, 'tools', 'benchmark', 'parsers')
+
+
+def find_report(reference):
+    """ function returns the latest kept report (dict) of the commit 'reference'
+    (or a prefix of it), or the latest report when 'reference' is 'last'.
+    'reference' can also be the path of a report file. Returns None if not found """
+
+    if pathlib.Path(reference).is_file():
+        with open(reference, 'r') as report_file:
+            return json.load(report_file)
+
+    for report_path in sorted(reports_dir().glob('*.json'), reverse=True):
+        with open(report_path, 'r') as report_file:
+            report = json.load(report_file)
+        if reference == 'last' or report.get('commit', '').startswith(reference):
+            return report
+    return None
+
+
+def compare(report, reference, threshold=DEFAULT_THRESHOLD):
+    """ function compares the results of 'report' to those of the 'reference' report
+    and logs the change of every parser and backend.
+    Returns the list of (parser, backend) whose pages/s dropped by more than 'threshold' percent """
+
+    reference_results = {(result['parser'], result['backend']): result for result in reference['results']}
+    regressions = []
+    logger.info(f"Compared to {reference['commit']}{' (dirty)' if reference.get('dirty') else ''} "
+                f"of {reference['date']}:")
+    logger.info(f"  {'parser':<22} {'backend':<9} {'pages/s':>9} {'change':>8} {'peak KB':>9} {'change':>8}")
+    for result in report['results']:
+        before = reference_results.get((result['parser'], result['backend']))
+        if before is None:
+            continue
+        speed = (result['pages_per_sec'] / before['pages_per_sec'] - 1) * 100 if before['pages_per_sec'] else 0.0
+        peak = (result['peak_kb'] / before['peak_kb'] - 1) * 100 if before['peak_kb'] else 0.0
+        message = (f"  {result['parser']:<22} {result['backend']:<9} {result['pages_per_sec']:>9.1f} "
+                   f"{speed:>+7.1f}% {result['peak_kb']:>9.1f} {peak:>+7.1f}%")
+        if speed < -threshold:
+            regressions.append((result['parser'], result['backend']))
+            logger.warning(message)
+        else:
+            logger.info(message)
+    return regressions
+
+
+def log_results(results):
+    """ function logs the results of a benchmark run """
+
+    logger.info(f"  {'parser':<22} {'backend':<9} {'pages':>6} {'datasets':>9} {'pages/s':>9} "
+                f"{'peak KB':>9} {'alloc KB':>9} {'blocks':>8}")
+    for result in results:
+        logger.info(f"  {result['parser']:<22} {result['backend']:<9} {result['pages']:>6} "
+                    f"{result['datasets']:>9} {result['pages_per_sec']:>9.1f} {result['peak_kb']:>9.1f} "
+                    f"{result['allocated_kb']:>9.1f} {result['allocated_blocks']:>8}")
+
+
+def write_report(report):
+    """ function keeps the report of the run in the reports directory.
+    Returns the path of the written file """
+
+    report_path = reports_dir() / f"parsers-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json"
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    return report_path
+
+
+def benchmark(scrapers=None, backends=None, corpus_dir=None, repeat=DEFAULT_REPEAT,
+              compare_to=None, threshold=DEFAULT_THRESHOLD):
+    """ function runs the parser benchmark, logs and keeps the report,
+    and compares it with the report of another run.
+    Returns the report and the list of regressed (parser, backend)
+
+    PARAMETERS:
+    - scrapers: the scrapers whose parsers are benchmarked (default is all those in the corpus)
+
+    - backends: the html parsing backends (default is all of them)
+
+    - corpus_dir: the corpus directory (default is the corpus shipped with the package)
+
+    - repeat: the number of timed rounds over the pages of a parser
+
+    - compare_to: the commit (or the path of the report, or 'last') of the run to compare with
+
+    - threshold: the drop of pages/s (percent) reported as a regression """
+
+    corpus_dir = corpus_dir or CORPUS_DIR
+    scrapers = list(scrapers or corpus_scrapers(corpus_dir))
+    backends = [documents.check_backend(backend) for backend in backends or documents.BACKENDS.keys()]
+
+    commit, dirty = git_commit()
+    results = benchmark_parsers(scrapers, backends, corpus_dir=corpus_dir, repeat=repeat)
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        # timings are only comparable between runs of the same (idle) machine
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'corpus': str(corpus_dir),
+        'repeat': repeat,
+        'results': results,
+    }
+
+    logger.info(f"Parsed the pages of {len(results) // max(len(backends), 1)} parsers "
+                f"with {', '.join(backends)} (best of {repeat} rounds):")
+    log_results(results)
+
+    regressions = []
+    if compare_to:
+        reference = find_report(compare_to)
+        if reference is None:
+            logger.warning(f"No benchmark report found for '{compare_to}'")
+        else:
+            regressions = compare(report, reference, threshold=threshold)
+
+    logger.info(f'Benchmark report written to {write_report(report)}')
+    return report, regressions
@@ -0,0 +1,284 @@
+""" module runs the parsers of a scraper against saved pages with each of the
+html parsing backends (see edscrapers.scrapers.base.documents) and diffs the
+Dataset items yielded by every backend against the ones yielded by the
+reference backend (html5lib).
+
+Saved pages are read from either:
+- a corpus directory, which contains a subdirectory per scraper
+  (named like the scraper given to `eds scrape` e.g. 'nces' or 'edgov.osers').
+  Every page is a '<page>.html' file, optionally accompanied by a '<page>.json'
+  file holding the 'url' and 'referer' the page was crawled with
+  (and the 'referer_title' the crawl graph would provide)
+- the scrapy http cache (i.e. pages saved by `eds scrape --cache`), with
+  either the SQLite storage (see edscrapers.scrapers.base.httpcache) or the filesystem storage
+
+A scraper can safely be switched to a faster backend
+(with the 'html_parser_backend' attribute of its crawler) when
+its parity run shows no mismatched pages """
+
+import os
+import ast
+import json
+import time
+import pickle
+import difflib
+import pathlib
+import importlib
+
+from scrapy import Item, Request
+from scrapy.http import HtmlResponse
+from scrapy.http.headers import Headers
+from scrapy.utils.python import to_unicode
+from w3lib.http import headers_raw_to_dict
+
+from edscrapers.cli import logger
+from edscrapers.scrapers.base import documents
+from edscrapers.scrapers.base import httpcache
+
+OUTPUT_DIR = os.getenv('ED_OUTPUT_PATH')
+
+# the backend every other backend is compared against
+REFERENCE_BACKEND = 'html5lib'
+
+
+class Page():
+    """ class represents a saved page """
+
+    def __init__(self, name, url, body, referer=None, encoding='utf-8', referer_title=None):
+        self.name = name # used to identify the page in reports
+        self.url = url
+        self.body = body
+        self.referer = referer
+        self.encoding = encoding
+        self.referer_title = referer_title
+
+    def to_response(self):
+        """ creates a fresh scrapy Response for the page.
+        A new Response is created for every backend run,
+        so no parsed document is shared between runs """
+
+        headers = {'Referer': self.referer} if self.referer else {}
+        # saved pages have no crawl graph: without 'collection_network_fallback'
+        # in the meta, the collection helpers never download the referring page
+        meta = {'referer_title': self.referer_title} if self.referer_title else {}
+        request = Request(url=self.url, headers=headers, meta=meta)
+        return HtmlResponse(url=self.url, body=self.body,
+                            encoding=self.encoding, request=request)
+
+
+def load_corpus_pages(corpus_dir, scraper):
+    """ function loads the saved pages of 'scraper' from a corpus directory """
+
+    pages = []
+    for html_path in sorted(pathlib.Path(corpus_dir, scraper).glob('*.html')):
+        meta = dict()
+        meta_path = html_path.with_suffix('.json')
+        if meta_path.exists():
+            with open(meta_path, 'r') as meta_file:
+                meta = json.load(meta_file)
+        with open(html_path, 'rb') as html_file:
+            body = html_file.read()
+        pages.append(Page(name=html_path.name,
+                          url=meta.get('url', f'https://{scraper}.example.com/{html_path.name}'),
+                          body=body,
+                          referer=meta.get('referer'),
+                          encoding=meta.get('encoding', 'utf-8'),
+                          referer_title=meta.get('referer_title')))
+    return pages
+
+
+def load_cache_pages(cache_dir, scraper):
+    """ function loads the saved pages of 'scraper' from the scrapy http cache
+    (SQLite or filesystem storage). Only successful html responses are loaded """
+
+    spider_name = importlib.import_module(f'edscrapers.scrapers.{scraper}').Crawler.name
+    if httpcache.cache_path(cache_dir, spider_name).exists():
+        return load_sqlite_cache_pages(httpcache.cache_path(cache_dir, spider_name))
+
+    pages = []
+    for meta_path in sorted(pathlib.Path(cache_dir, spider_name).glob('*/*/pickled_meta')):
+        entry_dir = meta_path.parent
+        try:
+            with open(meta_path, 'rb') as meta_file:
+                meta = pickle.load(meta_file)
+        except Exception:
+            with open(entry_dir / 'meta', 'rb') as meta_file:
+                meta = ast.literal_eval(to_unicode(meta_file.read()))
+
+        if meta.get('status') != 200:
+            continue
+
+        with open(entry_dir / 'response_headers', 'rb') as headers_file:
+            response_headers = Headers(headers_raw_to_dict(headers_file.read()))
+        if b'html' not in response_headers.get(b'Content-Type', b'text/html'):
+            continue
+
+        request_headers = dict()
+        if (entry_dir / 'request_headers').exists():
+            with open(entry_dir / 'request_headers', 'rb') as headers_file:
+                request_headers = Headers(headers_raw_to_dict(headers_file.read()))
+
+        with open(entry_dir / 'response_body', 'rb') as body_file:
+            body = body_file.read()
+
+        referer = request_headers.get(b'Referer')
+        pages.append(Page(name=entry_dir.name,
+                          url=meta.get('response_url', meta['url']),
+                          body=body,
+                          referer=to_unicode(referer) if referer else None))
+    return pages
+
+
+def load_sqlite_cache_pages(path):
+    """ function loads the saved pages from an SQLite http cache file
+    (see scrapers/base/httpcache.py). Only successful html responses are loaded """
+
+    pages = []
+    for entry in httpcache.iter_responses(path):
+        if entry['status'] != 200:
+            continue
+        if b'html' not in entry['headers'].get(b'Content-Type', b'text/html'):
+            continue
+        referer = entry['request_headers'].get(b'Referer')
+        pages.append(Page(name=entry['url'],
+                          url=entry['response_url'] or entry['url'],
+                          body=entry['body'],
+                          referer=to_unicode(referer) if referer else None))
+    return pages
+
+
+def _serialize_datasets(result):
+    """ function turns the output of a parser into a list of
+    serialized (json) datasets """
+
+    if result is None:
+        return []
+    if isinstance(result, Item): # a single Dataset was returned
+        result = [result]
+
+    datasets = []
+    for dataset in result:
+        if dataset is None:
+            continue
+        datasets.append(json.dumps(dataset, sort_keys=True, indent=2,
+                                   default=lambda o: o.__dict__['_values']))
+    return datasets
+
+
+def parse_page(parser, page, backend):
+    """ function parses 'page' with 'parser' using the html parsing 'backend'.
+    Returns a list of serialized datasets (or the error raised by the parser)
+    and the time taken """
+
+    res = page.to_response()
+    documents.set_backend(res, backend)
+    start = time.perf_counter()
+    try:
+        datasets = _serialize_datasets(parser.parse(res))
+    except Exception as exc:
+        datasets = [f'{type(exc).__name__}: {exc}']
+    finally:
+        documents.release(res)
+    return datasets, time.perf_counter() - start
+
+
+def run_parity(scraper, pages, backends=tuple(documents.BACKENDS.keys())):
+    """ function runs the parser of 'scraper' against 'pages' with each of the
+    'backends' and compares the datasets to those of the REFERENCE_BACKEND.
+    Returns a report dict """
+
+    parser = importlib.import_module(f'edscrapers.scrapers.{scraper}.parser')
+    backends = [REFERENCE_BACKEND] + [documents.check_backend(b) for b in backends
+                                      if b != REFERENCE_BACKEND]
+
+    report = {
+        'scraper': scraper,
+        'pages': len(pages),
+        'backends': {backend: {'datasets': 0, 'seconds': 0.0, 'mismatches': []}
+                     for backend in backends}
+    }
+
+    for page in pages:
+        reference = None
+        for backend in backends:
+            datasets, seconds = parse_page(parser, page, backend)
+            backend_report = report['backends'][backend]
+            backend_report['datasets'] += len(datasets)
+            backend_report['seconds'] += seconds
+
+            if reference is None:
+                reference = datasets
+                continue
+            if datasets != reference:
+                diff = difflib.unified_diff('\n'.join(reference).splitlines(),
+                                            '\n'.join(datasets).splitlines(),
+                                            fromfile=f'{page.name} ({REFERENCE_BACKEND})',
+                                            tofile=f'{page.name} ({backend})',
+                                            lineterm='')
+                backend_report['mismatches'].append({'page': page.name,
+                                                     'url': page.url,
+                                                     'diff': '\n'.join(diff)})
+    return report
+
+
+def log_report(report, show_diff=True):
+    """ function logs a parity report """
+
+    logger.info(f"Parity for '{report['scraper']}' ({report['pages']} pages):")
+    for backend, backend_report in report['backends'].items():
+        pages_per_sec = report['pages'] / backend_report['seconds'] if backend_report['seconds'] else 0
+        message = (f"  {backend:<10} datasets: {backend_report['datasets']:<6} "
+                   f"pages/s: {pages_per_sec:<10.1f} "
+                   f"mismatched pages: {len(backend_report['mismatches'])}")
+        if backend_report['mismatches']:
+            logger.warning(message)
+        else:
+            logger.success(message)
+        if show_diff:
+            for mismatch in backend_report['mismatches']:
+                logger.debug(f"{mismatch['url']}\n{mismatch['diff']}")
+
+
+def write_report(reports, output_path=None):
+    """ function writes the parity reports as json.
+    Returns the path of the written file """
+
+    if output_path is None:
+        output_path = os.path.join(OUTPUT_DIR, 'tools', 'parity', 'parity.json')
+    pathlib.Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as output_file:
+        json.dump(reports, output_file, indent=2)
+    return output_path
+
+
+def parity(scrapers, backends, corpus_dir=None, cache_dir=None):
+    """ function runs the parity check for every scraper in 'scrapers'.
+    Pages are read from 'cache_dir' if provided, otherwise from 'corpus_dir'.
+    Returns the total number of mismatched pages """
+
+    if corpus_dir is None:
+        corpus_dir = os.path.join(OUTPUT_DIR, 'tools', 'parity', 'corpus')
+    if not scrapers and not cache_dir:
+        # check every scraper which has saved pages in the corpus
+        scrapers = sorted(path.name for path in pathlib.Path(corpus_dir).glob('*')
+                          if path.is_dir())
+
+    reports = []
+    mismatches = 0
+    for scraper in scrapers:
+        if cache_dir:
+            pages = load_cache_pages(cache_dir, scraper)
+        else:
+            pages = load_corpus_pages(corpus_dir, scraper)
+        if not pages:
+            logger.warning(f"No saved pages found for '{scraper}'")
+            continue
+
+        report = run_parity(scraper, pages, backends)
+        log_report(report)
+        reports.append(report)
+        mismatches += sum(len(backend_report['mismatches'])
+                          for backend_report in report['backends'].values())
+
+    logger.info(f"Parity report written to {write_report(reports)}")
+    return mismatches
@@ -11,7 +11,7 @@ import requests
 
 from json.decoder import JSONDecodeError
 
-from  edscrapers.transformers.base.helpers import traverse_output
+from  edscrapers.transformers.base.helpers import traverse_output, read_file
 from edscrapers.cli import logger
 
 
@@ -118,27 +118,26 @@ class Statistics():
         else:
             dfs = []
             for fp in files:
-                with open(fp, 'r') as json_file:
-                    try:
-                        j = json.load(json_file)
-
-                        # if it's marked for removal by the sanitizer, skip it
-                        if j.get('_clean_data', dict()).get('_remove_dataset'):
-                            logger.debug(f"Ignoring {j.get('source_url')}")
-                            continue
-
-                        j = [{
-                            'url': abs_url(r['url'], r['source_url']),
-                            'source_url': r['source_url'],
-                            'publisher': str(j['publisher']),
-                            'size': r.get('headers', dict()).get('content-length', 0),
-                            'scraper': fp.parent.name
-                        } for r in j['resources'] if r['source_url'].find('/print/') == -1]
-
-                        dfs.append(pd.read_json(json.dumps(j)))
-
-                    except Exception as e:
-                        logger.warning(f'Could not parse file {json_file} as JSON! {e}')
+                try:
+                    j = read_file(fp)
+
+                    # if it's marked for removal by the sanitizer, skip it
+                    if j.get('_clean_data', dict()).get('_remove_dataset'):
+                        logger.debug(f"Ignoring {j.get('source_url')}")
+                        continue
+
+                    j = [{
+                        'url': abs_url(r['url'], r['source_url']),
+                        'source_url': r['source_url'],
+                        'publisher': str(j['publisher']),
+                        'size': r.get('headers', dict()).get('content-length', 0),
+                        'scraper': fp.parent.name
+                    } for r in j['resources'] if r['source_url'].find('/print/') == -1]
+
+                    dfs.append(pd.read_json(json.dumps(j)))
+
+                except Exception as e:
+                    logger.warning(f'Could not parse file {fp} as JSON! {e}')
             df = pd.concat(dfs, ignore_index=True)
             df.to_csv(df_dump, index=False)
 
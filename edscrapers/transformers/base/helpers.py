@@ -10,6 +10,8 @@ from urllib.parse import urljoin
 
 from edscrapers.cli import logger
 from edscrapers.scrapers.edgov import offices_map
+from edscrapers.scrapers.base.classifier import link_classifier
+from edscrapers.scrapers.base import store as dataset_store
 
 OUTPUT_DIR = os.getenv('ED_OUTPUT_PATH')
 
@@ -231,18 +233,39 @@ def get_media_type(format):
 
 def traverse_output(target=None):
     if target is None:
-        results = Path(os.path.join(OUTPUT_DIR, 'scrapers')).rglob('*.json')
+        target_dir = 'scrapers'
     else:
         if target in ['oese', 'osers', 'oela', 'octae', 'ope', 'opepd']:
-            results = Path(os.path.join(OUTPUT_DIR, 'scrapers', 'edgov', target)).glob('**/*.json')
+            target_dir = os.path.join('scrapers', 'edgov', target)
         else:
-            results = Path(os.path.join(OUTPUT_DIR, 'scrapers', target)).glob('**/*.json')
+            target_dir = os.path.join('scrapers', target)
+    results = Path(os.path.join(OUTPUT_DIR, target_dir)).glob('**/*.json')
 
     files_list = [f for f in results
                   if 'print' not in str(f).split('/')[-1].split('-')]
+
+    # add the datasets kept in the dataset store (see scrapers/base/store.py).
+    # Their paths don't exist on disk, but can be read and written with
+    # `read_file()` and `write_file()` like any other output file
+    store = dataset_store.get_store(OUTPUT_DIR)
+    if not store.has_index(target_dir):
+        # no dataset store here, don't load its index
+        return files_list
+    files_on_disk = set(files_list)
+    for key in store.keys(target_dir):
+        file_path = Path(OUTPUT_DIR, key)
+        if file_path not in files_on_disk and \
+            'print' not in key.split('/')[-1].split('-'):
+            files_list.append(file_path)
     return files_list
 
 def read_file(file_path):
+    if not os.path.exists(file_path):
+        # the file may be kept in the dataset store
+        data = dataset_store.get_store(OUTPUT_DIR).read(file_path)
+        if data is not None:
+            return json.loads(data)
+
     with open(file_path, 'r') as fl:
         data = json.load(fl)
         return data
@@ -251,6 +274,12 @@ def read_file(file_path):
 def write_file(file_path, data, mode='w'):
     """ write data to a file as json """
 
+    if mode == 'w' and not os.path.exists(file_path) and \
+        file_path in dataset_store.get_store(OUTPUT_DIR):
+        # update the dataset in the dataset store
+        dataset_store.get_store(OUTPUT_DIR).write(file_path, json.dumps(data))
+        return
+
     with open(file_path, mode) as fl:
         json.dump(data, fl, indent=2)
 
@@ -311,25 +340,15 @@ def transform_dataset_identifier(title, url):
         return slugify(domain + path)
 
 def extract_resource_format_from_url(url):
-    
-    parsed_url = urlparse(url)
-    base = os.path.basename(parsed_url.geturl())
+    """ function returns the (normalized) extension of the resource at 'url'
+    as found by the link classifier the scrapers use
+    (see edscrapers.scrapers.base.classifier) """
 
-    ### rsplit on base name to support multiple periods
-    base_name_lst = base.rsplit('.', 1)
-
-    if len(base_name_lst) == 0:
-        ### return a default format
-        return 'txt'
-    
-    extension = base_name_lst[-1]
-
-    ### accepting only 5 char extensions
-    if len(extension) < 6:
-        return extension
-    else:
+    extension = link_classifier.extension(url)
+    if extension is None:
         ### return a default format
         return 'txt'
+    return extension
 
 def extract_resource_name_from_url(url):
     
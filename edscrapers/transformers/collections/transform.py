@@ -38,16 +38,14 @@ def transform(name=None, input_file=None):
         sys.exit(1)
     try:
         # load the Graph representing the deduplicated scraped datasets
-        GraphWrapper.load_graph(file_dir_path=Path(OUTPUT_DIR, 'graphs', name),
+        graph = GraphWrapper.load_graph(file_dir_path=Path(OUTPUT_DIR, 'graphs', name),
                             file_stem_name=f'{name}.deduplicate')
         
     except:
         # load the Graph representing the scraped datasets
-        GraphWrapper.load_graph(file_dir_path=Path(OUTPUT_DIR, 'graphs', name),
+        graph = GraphWrapper.load_graph(file_dir_path=Path(OUTPUT_DIR, 'graphs', name),
                             file_stem_name=name)
         
-    # get the loaded graph
-    graph = GraphWrapper.get_graph()
 
     # identify collections within the graph
     identify_collections_within_graph(graph)
@@ -59,11 +57,11 @@ def transform(name=None, input_file=None):
 
     # write the graph to files
     # this method is explicitly thread/proccess safe, so no need for lock
-    GraphWrapper.write_graph(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
+    GraphWrapper.write_graph(graph, file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
                                                         "graphs", f"{name}"),
                                         file_stem_name=f'{name}.collections')
     # create the page legend file for this graph
-    GraphWrapper.create_graph_page_legend(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
+    GraphWrapper.create_graph_page_legend(graph, file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
                                                         "graphs", f"{name}"),
                                          file_stem_name=f'{name}.collections')                                    
 
@@ -89,7 +87,7 @@ def transform(name=None, input_file=None):
                                  f'{(name or "all")}.collections.json')
 
 
-def identify_collections_within_graph(graph=GraphWrapper.graph):
+def identify_collections_within_graph(graph):
     """ function identifies AND flags/marks Collection vertices
     within the provided graph. All updates are done inplace,
     so the provided graph will be updated/modified after this process """
@@ -145,7 +143,7 @@ def identify_collections_within_graph(graph=GraphWrapper.graph):
         # return all identified collections as a Vertext_Seq
         return combined_col_seq
 
-def link_datasets_to_collections_in_graph(graph=GraphWrapper.graph):
+def link_datasets_to_collections_in_graph(graph):
     """ function marks dataset vertices within the graph as
     belonging to their appropriate Collection """
 
@@ -197,7 +195,7 @@ def link_datasets_to_collections_in_graph(graph=GraphWrapper.graph):
                             'collection_title': vertex['title'],
                             'collection_url': vertex['name']})
 
-def add_collections_to_raw_datasets(graph=GraphWrapper.graph, 
+def add_collections_to_raw_datasets(graph, 
                                     output_dir=OUTPUT_DIR):
     """ function writes the collections which have been identified in `graph`
     to their associated raw dataset json file. 
@@ -5,6 +5,8 @@ from urllib.parse import urljoin
 
 import edscrapers.transformers.base.helpers as h
 from edscrapers.cli import logger
+from edscrapers.scrapers.base import config
+from edscrapers.scrapers.base import metadata
 from edscrapers.transformers.base.helpers import traverse_output, read_file, guess_office_email
 from edscrapers.transformers.datajson.models import Catalog, Dataset, Resource, Organization, Source, Collection
 
@@ -16,6 +18,8 @@ resources_common_names = ['excel', 'doc', 'download excel', 'download se excel',
 
 dataset_title_list = []
 dataset_identifier_list = []
+# number of resources whose headers were (or were not) found in the resource metadata cache
+header_metadata_counts = {'hit': 0, 'miss': 0}
 
 
 def transform(name, input_file=None):
@@ -98,6 +102,8 @@ def transform(name, input_file=None):
     logger.debug('{} Collections transformed.'.format(collections_number))
     logger.debug('{} datasets transformed.'.format(datasets_number))
     logger.debug('{} resources transformed.'.format(resources_number))
+    logger.debug('{} resource headers read from the metadata cache ({} not cached).'.\
+                 format(header_metadata_counts['hit'], header_metadata_counts['miss']))
 
     output_path = h.get_output_path('datajson')
     file_path = os.path.join(output_path, f'{(name or "all")}.data.json')
@@ -288,12 +294,31 @@ def _transform_scraped_resource(target_dept, resource):
             distribution.resource_format = extension
             distribution.mediaType = h.get_media_type(extension)
     
-    if resource.get('headers'):
-        distribution.headerMetadata = resource.get('headers')
+    # use the headers recorded while scraping, otherwise use the headers
+    # kept in the resource metadata cache (no network call is made here)
+    header_metadata = resource.get('headers')
+    cache = _metadata_cache() if not header_metadata else None
+    if cache is not None:
+        header_metadata = metadata.resource_headers(cache.\
+                            get(metadata.resource_url(resource.get('source_url'), resource.get('url'))))
+        header_metadata_counts['hit' if header_metadata else 'miss'] += 1
+    if header_metadata:
+        distribution.headerMetadata = header_metadata
 
     return distribution
 
 
+def _metadata_cache():
+    """ function returns the resource metadata cache, or None if it is disabled
+    (RESOURCE_METADATA_CACHE_ENABLED) or no crawl has written it """
+
+    if not config.SCRAPY_SETTINGS.get('RESOURCE_METADATA_CACHE_ENABLED', True):
+        return None
+    if not os.path.exists(metadata.DEFAULT_PATH):
+        return None
+    return metadata.get_cache()
+
+
 def _transform_scraped_source(data: dict):
     """
     function is a private helper.
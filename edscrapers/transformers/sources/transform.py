@@ -35,10 +35,8 @@ def transform(name=None, input_file=None):
         sys.exit(1)
     
     # load the Graph representing the scraped datasets
-    GraphWrapper.load_graph(file_dir_path=Path(OUTPUT_DIR, 'graphs', name),
+    graph = GraphWrapper.load_graph(file_dir_path=Path(OUTPUT_DIR, 'graphs', name),
                             file_stem_name=f'{name}.collections')
-    # get the loaded graph
-    graph = GraphWrapper.get_graph()
 
     # identify sources within the graph
     identify_sources_within_graph(graph)
@@ -50,11 +48,11 @@ def transform(name=None, input_file=None):
 
     # write the graph to files
     # this method is explicitly thread/proccess safe, so no need for lock
-    GraphWrapper.write_graph(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
+    GraphWrapper.write_graph(graph, file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
                                                         "graphs", f"{name}"),
                                         file_stem_name=f'{name}.sources')
     # create the page legend file for this graph
-    GraphWrapper.create_graph_page_legend(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
+    GraphWrapper.create_graph_page_legend(graph, file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
                                                         "graphs", f"{name}"),
                                          file_stem_name=f'{name}.sources')
     
@@ -99,7 +97,7 @@ def identify_sources_within_graph(graph):
             source_vertex['source_id'] = f'{hashlib.md5(source_vertex["name"].encode("utf-8")).hexdigest()}-{hashlib.md5("all".encode("utf-8")).hexdigest()}'
 
 
-def link_collection_to_sources_in_graph(graph=GraphWrapper.graph):
+def link_collection_to_sources_in_graph(graph):
     """ function marks collection and dataset vertices within the graph as
     belonging to their appropriate Source """
 
@@ -146,7 +144,7 @@ def link_collection_to_sources_in_graph(graph=GraphWrapper.graph):
                             'source_url': edge.source_vertex['name']})
                  
 
-def add_sources_to_collections_json(name, graph=GraphWrapper.graph,
+def add_sources_to_collections_json(name, graph,
                                     output_dir=OUTPUT_DIR):
     """ function writes the sources which have been identified in `graph`
     to their associated collections.json and raw dataset json files. 
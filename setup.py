@@ -17,6 +17,10 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     # url="https://github.com/pypa/sampleproject",
     packages=setuptools.find_packages(),
+    # the saved pages of the parser benchmark corpus
+    package_data={
+        'edscrapers.tools.benchmark': ['corpus/*/*.html', 'corpus/*/*.json'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU Affero General Public License v3 or later (AGPLv3+)",